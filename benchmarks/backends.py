@@ -0,0 +1,343 @@
+#! /usr/bin/env python
+"""
+Run every token backend through the same get/set/delete workloads, and
+report throughput, time, database queries and memory per operation.
+
+Usage::
+
+    python benchmarks/backends.py --ops 20000
+    python benchmarks/backends.py --workload refresh-heavy --backend sqla-file sqla-file+cache
+
+Workloads:
+
+* ``read-heavy``: 95% get, 4% set, 1% delete, for 1,000 users, some of
+  whom are much more active than others.
+* ``refresh-heavy``: half get, half set, as when short-lived tokens are
+  refreshed all the time, for the same 1,000 users.
+* ``many-users``: 90% get, 10% set, spread evenly over 100,000 users, so
+  that caches can't hold every token.
+
+Every user has a token before a run starts. Each run uses a fresh backend
+(and database), and the same sequence of operations. Memory is measured
+in a second run of the sequence, with :mod:`tracemalloc`: "retained" is
+the memory still held after the run, per operation, and "peak" is the most
+memory held at any point during the run. ``MemoryBackend`` only ever holds
+one token, whatever the user. To benchmark another backend, add a function
+that builds it to ``SUBJECTS``.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+import flask
+from flask.sessions import SecureCookieSession
+from sqlalchemy import create_engine, event, Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.backend.session import (
+    SessionBackend, MemoryTokenStore, SQLiteTokenStore,
+)
+from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from flask_dance.utils import FakeCache, LocalCache
+
+
+Base = declarative_base()
+
+class OAuth(Base, OAuthConsumerMixin):
+    user_id = Column(Integer)
+
+
+WORKLOADS = {
+    "read-heavy": dict(users=1000, mix={"get": 95, "set": 4, "delete": 1}, skewed=True),
+    "refresh-heavy": dict(users=1000, mix={"get": 50, "set": 50}, skewed=True),
+    "many-users": dict(users=100000, mix={"get": 90, "set": 10}, skewed=False),
+}
+
+
+class Subject(object):
+    """
+    A backend under test. ``get``, ``set`` and ``delete`` act as the user
+    ``uid``; ``queries`` counts the database queries made so far.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.blueprint = OAuth2ConsumerBlueprint("bench", __name__)
+        self.queries = 0
+
+    def count_query(self, *args):
+        self.queries += 1
+
+    def get(self, uid):
+        return self.backend.get(self.blueprint)
+
+    def set(self, uid, token):
+        self.backend.set(self.blueprint, token)
+
+    def delete(self, uid):
+        self.backend.delete(self.blueprint)
+
+    def prefill(self, users):
+        for uid in range(1, users + 1):
+            self.set(uid, make_token(uid, 0))
+
+    def close(self):
+        pass
+
+
+class SessionSubject(Subject):
+    """
+    Gives every user their own Flask session, in one request context.
+    """
+    def __init__(self, backend):
+        super(SessionSubject, self).__init__(backend)
+        self.app = flask.Flask(__name__)
+        self.ctx = self.app.test_request_context("/")
+        self.ctx.push()
+        self.sessions = {}
+
+    def act_as(self, uid):
+        session = self.sessions.get(uid)
+        if session is None:
+            session = self.sessions[uid] = SecureCookieSession()
+        self.ctx.session = session
+
+    def get(self, uid):
+        self.act_as(uid)
+        return self.backend.get(self.blueprint)
+
+    def set(self, uid, token):
+        self.act_as(uid)
+        self.backend.set(self.blueprint, token)
+
+    def delete(self, uid):
+        self.act_as(uid)
+        if self.backend.get(self.blueprint) is not None:
+            self.backend.delete(self.blueprint)
+
+    def close(self):
+        self.ctx.pop()
+
+
+class SQLAlchemySubject(Subject):
+    def __init__(self, url, cache):
+        self.engine = create_engine(url)
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        super(SQLAlchemySubject, self).__init__(
+            SQLAlchemyBackend(OAuth, self.session, cache=cache),
+        )
+        event.listen(self.engine, "before_cursor_execute", self.count_query)
+
+    def get(self, uid):
+        return self.backend.get(self.blueprint, user_id=uid)
+
+    def set(self, uid, token):
+        self.backend.set(self.blueprint, token, user_id=uid)
+
+    def delete(self, uid):
+        self.backend.delete(self.blueprint, user_id=uid)
+
+    def prefill(self, users):
+        self.backend.set_many(self.blueprint, (
+            (uid, make_token(uid, 0)) for uid in range(1, users + 1)
+        ))
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self.count_query)
+        self.session.close()
+        self.engine.dispose()
+
+
+class SQLiteStoreSubject(SessionSubject):
+    def __init__(self, tmpdir):
+        self.store = SQLiteTokenStore(os.path.join(tmpdir, "store.db"))
+        self.store._conn.set_trace_callback(self.count_statement)
+        super(SQLiteStoreSubject, self).__init__(SessionBackend(store=self.store))
+
+    def count_statement(self, statement):
+        if not statement.startswith(("BEGIN", "COMMIT", "ROLLBACK")):
+            self.count_query()
+
+    def prefill(self, users):
+        # one transaction, rather than one per user
+        rows = []
+        key = self.backend.key.format(bp=self.blueprint)
+        for uid in range(1, users + 1):
+            handle = "handle-{}".format(uid)
+            self.act_as(uid)
+            flask.session[key] = handle
+            rows.append((handle, json.dumps(make_token(uid, 0))))
+        with self.store._conn:
+            self.store._conn.executemany(
+                "INSERT INTO {} (handle, token) VALUES (?, ?)".format(self.store.table),
+                rows,
+            )
+
+
+SUBJECTS = {
+    "session": lambda tmpdir: SessionSubject(SessionBackend()),
+    "session+memory-store": lambda tmpdir: SessionSubject(
+        SessionBackend(store=MemoryTokenStore()),
+    ),
+    "session+sqlite-store": SQLiteStoreSubject,
+    "memory": lambda tmpdir: Subject(MemoryBackend()),
+    "sqla-file": lambda tmpdir: SQLAlchemySubject(
+        "sqlite:///" + os.path.join(tmpdir, "sqla.db"), FakeCache(),
+    ),
+    "sqla-file+cache": lambda tmpdir: SQLAlchemySubject(
+        "sqlite:///" + os.path.join(tmpdir, "sqla.db"), LocalCache(),
+    ),
+    "sqla-memory": lambda tmpdir: SQLAlchemySubject("sqlite://", FakeCache()),
+    "sqla-memory+cache": lambda tmpdir: SQLAlchemySubject("sqlite://", LocalCache()),
+}
+
+
+# far enough in the future that caches keep tokens for the whole run
+EXPIRES_AT = time.time() + 86400
+
+
+def make_token(uid, version):
+    return {
+        "access_token": "access-{}-{}".format(uid, version),
+        "refresh_token": "refresh-{}".format(uid),
+        "token_type": "bearer",
+        "expires_at": EXPIRES_AT + version,
+    }
+
+
+def make_operations(workload, count, seed=42):
+    rand = random.Random(seed)
+    names = []
+    for name, weight in sorted(workload["mix"].items()):
+        names.extend([name] * weight)
+    users = workload["users"]
+    operations = []
+    for i in range(count):
+        if workload["skewed"]:
+            uid = min(users, int(rand.paretovariate(1.2)))
+        else:
+            uid = rand.randint(1, users)
+        operations.append((rand.choice(names), uid, i + 1))
+    return operations
+
+
+def replay(subject, operations):
+    """
+    Run ``operations`` against ``subject``, and return the total time and
+    number of queries for each kind of operation.
+    """
+    elapsed = defaultdict(float)
+    queries = Counter()
+    counts = Counter()
+    now = time.time
+    for name, uid, version in operations:
+        before = subject.queries
+        start = now()
+        if name == "get":
+            subject.get(uid)
+        elif name == "set":
+            subject.set(uid, make_token(uid, version))
+        else:
+            subject.delete(uid)
+        elapsed[name] += now() - start
+        queries[name] += subject.queries - before
+        counts[name] += 1
+    return counts, elapsed, queries
+
+
+def measure_memory(subject, operations):
+    if tracemalloc is None:
+        return None, None
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        replay(subject, operations)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (current - start) / len(operations), (peak - start) / 1024
+
+
+def run(make_subject, workload, operations):
+    results = []
+    for measure in ("time", "memory"):
+        tmpdir = tempfile.mkdtemp()
+        subject = make_subject(tmpdir)
+        try:
+            subject.prefill(workload["users"])
+            subject.queries = 0
+            if measure == "time":
+                start = time.time()
+                results.append(replay(subject, operations))
+                results.append(time.time() - start)
+            else:
+                results.append(measure_memory(subject, operations))
+        finally:
+            subject.close()
+            shutil.rmtree(tmpdir)
+    (counts, elapsed, queries), total, (retained, peak) = results
+    return counts, elapsed, queries, total, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--workload", nargs="+", choices=sorted(WORKLOADS),
+        default=["read-heavy", "refresh-heavy", "many-users"])
+    parser.add_argument("--backend", nargs="+", choices=sorted(SUBJECTS),
+        default=sorted(SUBJECTS))
+    args = parser.parse_args()
+
+    for workload_name in args.workload:
+        workload = WORKLOADS[workload_name]
+        operations = make_operations(workload, args.ops)
+        print("\n{} ({} users, {} operations)".format(
+            workload_name, workload["users"], args.ops,
+        ))
+        print("{:<22} {:>9} {:>8} {:>8} {:>8} {:>6} {:>6} {:>6} {:>10} {:>9}".format(
+            "backend", "ops/s", "get us", "set us", "del us",
+            "q/get", "q/set", "q/del", "retained B", "peak KiB",
+        ))
+        for backend_name in args.backend:
+            counts, elapsed, queries, total, retained, peak = run(
+                SUBJECTS[backend_name], workload, operations,
+            )
+            per_op = []
+            for name in ("get", "set", "delete"):
+                if counts[name]:
+                    per_op.append("{:>8.1f}".format(elapsed[name] / counts[name] * 1e6))
+                else:
+                    per_op.append("{:>8}".format("-"))
+            per_query = []
+            for name in ("get", "set", "delete"):
+                if counts[name]:
+                    per_query.append("{:>6.2f}".format(queries[name] / counts[name]))
+                else:
+                    per_query.append("{:>6}".format("-"))
+            memory = "{:>10} {:>9}".format("-", "-")
+            if retained is not None:
+                memory = "{:>10.1f} {:>9.0f}".format(retained, peak)
+            print("{:<22} {:>9.0f} {} {} {}".format(
+                backend_name, args.ops / total, " ".join(per_op),
+                " ".join(per_query), memory,
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+"""
+Compare calling several provider API endpoints one after another with
+sending them all at once through ``session.batch()``, against a local server
+that adds artificial latency to every response.
+
+Usage::
+
+    python benchmarks/batch.py --calls 20 --latency 0.05 --workers 10
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# the stub server doesn't use HTTPS
+os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import MemoryBackend
+from stub import LatencyServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with LatencyServer(latency=args.latency) as server:
+        blueprint = OAuth2ConsumerBlueprint("bench", __name__,
+            base_url=server.url,
+            backend=MemoryBackend({"access_token": "abc", "token_type": "bearer"}),
+            pool_maxsize=args.workers,
+        )
+        urls = ["/endpoint/{}".format(i) for i in range(args.calls)]
+
+        def sequential():
+            session = blueprint.session
+            return [session.get(url) for url in urls]
+
+        def batched():
+            return blueprint.session.batch(urls, max_workers=args.workers)
+
+        print("{} calls, {:.0f} ms latency each".format(args.calls, args.latency * 1000))
+        for name, func in (("sequential", sequential), ("batch", batched)):
+            func()  # warm up the connection pool
+            start = time.time()
+            for _ in range(args.rounds):
+                responses = func()
+                assert all(r.status_code == 200 for r in responses)
+            elapsed = (time.time() - start) / args.rounds
+            print("{:<12} {:>8.1f} ms/page view".format(name, elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
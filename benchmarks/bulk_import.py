@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+"""
+Measure how long it takes to import tokens into an SQLite database with
+``SQLAlchemyBackend.set_many()``, against calling ``set()`` once per token.
+
+Usage::
+
+    python benchmarks/bulk_import.py --tokens 100000 --sample 2000
+
+Calling ``set()`` for all 100,000 tokens takes minutes, so it is only timed
+for ``--sample`` tokens, and the rate is extrapolated from that.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, event, Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from flask_dance.utils import LocalCache
+
+
+Base = declarative_base()
+
+class OAuth(Base, OAuthConsumerMixin):
+    user_id = Column(Integer)
+
+
+def make_tokens(count):
+    return [
+        (uid, {
+            "access_token": "access-{}".format(uid),
+            "refresh_token": "refresh-{}".format(uid),
+            "token_type": "bearer",
+            "expires_at": 1500000000 + uid,
+        })
+        for uid in range(1, count + 1)
+    ]
+
+
+def set_each(backend, blueprint, tokens, batch_size):
+    for uid, token in tokens:
+        backend.set(blueprint, token, user_id=uid)
+
+
+def set_many(backend, blueprint, tokens, batch_size):
+    backend.set_many(blueprint, tokens, batch_size=batch_size)
+
+
+def run(importer, tokens, batch_size):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine("sqlite:///{}".format(path))
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    blueprint = OAuth2ConsumerBlueprint("bench", __name__)
+    backend = SQLAlchemyBackend(OAuth, session, cache=LocalCache())
+
+    statements = Counter()
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements[statement.split(None, 1)[0]] += 1
+    event.listen(engine, "before_cursor_execute", count)
+
+    start = time.time()
+    importer(backend, blueprint, tokens, batch_size)
+    elapsed = time.time() - start
+
+    event.remove(engine, "before_cursor_execute", count)
+    stored = session.query(OAuth).count()
+    session.close()
+    engine.dispose()
+    os.remove(path)
+    assert stored == len(tokens), stored
+    return elapsed, statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=100000)
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.tokens)
+    for name, importer, count in (
+            ("set() per token", set_each, min(args.sample, args.tokens)),
+            ("set_many()", set_many, args.tokens)):
+        elapsed, statements = run(importer, tokens[:count], args.batch_size)
+        rate = count / elapsed
+        print("{:<16} {:>7} tokens {:>9.0f} tokens/s {:>8.1f} s for {}  {}".format(
+            name, count, rate, args.tokens / rate, args.tokens,
+            ", ".join("{} {}".format(k, v) for k, v in sorted(statements.items())),
+        ))
+
+
+if __name__ == "__main__":
+    main()
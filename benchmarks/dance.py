@@ -0,0 +1,267 @@
+#! /usr/bin/env python
+"""
+Drive OAuth 1 and OAuth 2 blueprints through the whole dance against a fake
+provider running in this process, and report latency percentiles and
+throughput for each token backend.
+
+Usage::
+
+    python benchmarks/dance.py --dances 500 --concurrency 1 8 --latency 0.005
+
+Each dance is a request to the ``login`` view, a request to the provider's
+authorize URL (as the user's browser would make), a request to the
+``authorized`` view, and a request to a view that calls the provider's API.
+Every simulated user has their own Flask test client, so the
+``session`` backend keeps each user's token in their own session cookie.
+Pass ``--expires-in -1`` to have every OAuth 2 token expire at once, so
+that each API call refreshes the token first.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# the fake provider doesn't use HTTPS
+os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+
+import flask
+import requests
+from urlobject import URLObject
+from flask_login import LoginManager, UserMixin, current_user
+from sqlalchemy import create_engine, Column, ForeignKey, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, scoped_session, sessionmaker
+from flask_dance.consumer import OAuth1ConsumerBlueprint, OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.backend.session import SessionBackend
+from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from stub import FakeProvider
+
+
+Base = declarative_base()
+
+class User(Base, UserMixin):
+    __tablename__ = "bench_user"
+    id = Column(Integer, primary_key=True)
+
+class OAuth(Base, OAuthConsumerMixin):
+    user_id = Column(Integer, ForeignKey(User.id))
+    user = relationship(User)
+
+
+def make_sqlalchemy_backend(app, users, tmpdir):
+    """
+    Store tokens in an SQLite file, for users that log in to the app with
+    Flask-Login. Each simulated user sends their ID in a header.
+    """
+    engine = create_engine(
+        "sqlite:///{}".format(os.path.join(tmpdir, "dance.db")),
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    Base.metadata.create_all(engine)
+    db_session = scoped_session(sessionmaker(bind=engine))
+    db_session.add_all(User(id=uid) for uid in range(1, users + 1))
+    db_session.commit()
+    db_session.remove()
+
+    login_manager = LoginManager(app)
+
+    @login_manager.request_loader
+    def load_user(request):
+        return db_session.query(User).get(int(request.headers["X-Bench-User"]))
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        db_session.remove()
+
+    def make_backend():
+        return SQLAlchemyBackend(OAuth, db_session, user=current_user)
+    return make_backend
+
+
+def make_app(provider, backend, users, tmpdir):
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+
+    if backend == "session":
+        make_backend = SessionBackend
+    elif backend == "memory":
+        make_backend = MemoryBackend
+    else:
+        make_backend = make_sqlalchemy_backend(app, users, tmpdir)
+
+    token_url = provider.url + "/oauth2/token"
+    oauth2 = OAuth2ConsumerBlueprint("oauth2", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        base_url=provider.url,
+        authorization_url=provider.url + "/oauth2/authorize",
+        token_url=token_url,
+        auto_refresh_url=token_url,
+        auto_refresh_kwargs={"client_id": "client_id", "client_secret": "client_secret"},
+        redirect_url="/",
+        backend=make_backend(),
+    )
+    oauth1 = OAuth1ConsumerBlueprint("oauth1", __name__,
+        client_key="client_key",
+        client_secret="client_secret",
+        base_url=provider.url,
+        request_token_url=provider.url + "/oauth1/request_token",
+        authorization_url=provider.url + "/oauth1/authorize",
+        access_token_url=provider.url + "/oauth1/access_token",
+        redirect_url="/",
+        backend=make_backend(),
+    )
+    app.register_blueprint(oauth2, url_prefix="/login")
+    app.register_blueprint(oauth1, url_prefix="/login")
+
+    @app.route("/")
+    def index():
+        return "index"
+
+    @app.route("/api/<name>")
+    def api(name):
+        resp = app.blueprints[name].session.get("/api/user")
+        return resp.text, resp.status_code
+
+    return app
+
+
+def dance(client, browser, name, headers, timings):
+    """
+    Go through the OAuth dance once, and append the time each step took to
+    ``timings``.
+    """
+    start = time.time()
+    resp = client.get("/login/" + name, headers=headers)
+    assert resp.status_code == 302, resp.status
+    login_done = time.time()
+
+    resp = browser.get(resp.headers["Location"], allow_redirects=False)
+    assert resp.status_code == 302, resp.status_code
+    callback = URLObject(resp.headers["Location"])
+    authorize_done = time.time()
+
+    resp = client.get(callback.path + "?" + callback.query, headers=headers)
+    assert resp.status_code == 302, resp.status
+    authorized_done = time.time()
+
+    resp = client.get("/api/" + name, headers=headers)
+    assert resp.status_code == 200, resp.status
+    api_done = time.time()
+
+    timings["login"].append(login_done - start)
+    timings["authorized"].append(authorized_done - authorize_done)
+    timings["api"].append(api_done - authorized_done)
+    timings["dance"].append(api_done - start)
+
+
+def run(app, name, dances, concurrency):
+    """
+    Run ``dances`` dances on ``concurrency`` threads, one simulated user per
+    thread. Returns the timings of each step, the wall clock time, and the
+    errors.
+    """
+    timings = defaultdict(list)
+    errors = []
+    lock = threading.Lock()
+
+    def work(uid, count):
+        client = app.test_client()
+        browser = requests.Session()
+        headers = {"X-Bench-User": str(uid)}
+        mine = defaultdict(list)
+        for _ in range(count):
+            try:
+                dance(client, browser, name, headers, mine)
+            except Exception as exc:
+                with lock:
+                    errors.append(exc)
+        with lock:
+            for step, values in mine.items():
+                timings[step].extend(values)
+
+    threads = [
+        threading.Thread(target=work, args=(uid, dances // concurrency))
+        for uid in range(1, concurrency + 1)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, time.time() - start, errors
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dances", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--latency", type=float, default=0.005,
+        help="seconds the fake provider sleeps before each response")
+    parser.add_argument("--expires-in", type=int, default=3600)
+    parser.add_argument("--backend", nargs="+",
+        choices=["session", "memory", "sqlalchemy"],
+        default=["session", "memory", "sqlalchemy"])
+    parser.add_argument("--protocol", nargs="+",
+        choices=["oauth1", "oauth2"], default=["oauth1", "oauth2"])
+    args = parser.parse_args()
+
+    print("{:<11} {:<7} {:>4} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8} {:>7}".format(
+        "backend", "proto", "conc", "login p50", "auth p50", "api p50",
+        "dance p50", "dance p99", "req/s", "errors",
+    ))
+    with FakeProvider(latency=args.latency, expires_in=args.expires_in) as provider:
+        for backend in args.backend:
+            for concurrency in args.concurrency:
+                tmpdir = tempfile.mkdtemp()
+                try:
+                    app = make_app(provider, backend, concurrency, tmpdir)
+                    for name in args.protocol:
+                        timings, elapsed, errors = run(
+                            app, name, args.dances, concurrency,
+                        )
+                        report(backend, name, concurrency, timings, elapsed, errors)
+                finally:
+                    shutil.rmtree(tmpdir)
+        print("provider: {} tokens issued, {} refreshed".format(
+            provider.issued, provider.refreshed,
+        ))
+
+
+def report(backend, name, concurrency, timings, elapsed, errors):
+    p50 = {}
+    for step, values in timings.items():
+        values.sort()
+        p50[step] = percentile(values, 50) * 1000
+    dances = len(timings["dance"])
+    if not dances:
+        print("{:<11} {:<7} {:>4} all dances failed: {!r}".format(
+            backend, name, concurrency, errors[0],
+        ))
+        return
+    # three requests to the Flask app for each dance
+    print("{:<11} {:<7} {:>4} {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms {:>8.0f} {:>7}".format(
+        backend, name, concurrency,
+        p50["login"], p50["authorized"], p50["api"], p50["dance"],
+        percentile(timings["dance"], 99) * 1000,
+        dances * 3 / elapsed, len(errors),
+    ))
+    if errors:
+        print("    first error: {!r}".format(errors[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+"""
+Measure the per-call overhead of working out which user a token belongs to
+in ``SQLAlchemyBackend``, when the user is Flask-Login's ``current_user``.
+
+Usage::
+
+    python benchmarks/identity.py --calls 100000
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import flask
+from flask_login import LoginManager, UserMixin, current_user, login_user
+from sqlalchemy import create_engine, Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+
+
+Base = declarative_base()
+
+class OAuth(Base, OAuthConsumerMixin):
+    user_id = Column(Integer)
+
+
+class User(UserMixin):
+    def __init__(self, id):
+        self.id = id
+
+
+def timeit(func, calls):
+    start = time.time()
+    for _ in range(calls):
+        func()
+    return (time.time() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(OAuth(provider="bench", user_id=1, token={"access_token": "abc"}))
+    session.commit()
+
+    app = flask.Flask(__name__)
+    app.secret_key = "bench"
+    login_manager = LoginManager(app)
+    loads = []
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        loads.append(user_id)
+        return User(int(user_id))
+
+    blueprint = OAuth2ConsumerBlueprint("bench", __name__)
+    backend = SQLAlchemyBackend(OAuth, session, user=current_user)
+    blueprint.backend = backend
+    app.register_blueprint(blueprint)
+
+    with app.test_request_context("/"):
+        login_user(User(1))
+        # warm up the token cache
+        backend.get(blueprint)
+
+        results = [
+            ("resolve_identity (remembered)",
+             timeit(lambda: backend.resolve_identity(blueprint), args.calls)),
+            ("resolve_identity (fresh)",
+             timeit(lambda: backend.resolve_identity(blueprint, fresh=True), args.calls)),
+            ("get (cached token)",
+             timeit(lambda: backend.get(blueprint), args.calls)),
+        ]
+
+    for name, micros in results:
+        print("{:<32} {:>8.2f} us/call".format(name, micros))
+    print("user_loader calls: {}".format(len(loads)))
+
+
+if __name__ == "__main__":
+    main()
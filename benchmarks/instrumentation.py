@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+"""
+Measure what the ``oauth_span`` instrumentation costs: per token lookup
+through ``blueprint.token``, and per request to the ``login`` view, with
+nothing connected to the signal, and with the logging and metrics observers
+connected.
+
+Usage::
+
+    python benchmarks/instrumentation.py --lookups 200000 --requests 2000
+
+With nothing connected, a token lookup should cost no more than
+``--budget`` microseconds over calling the backend directly; the script
+exits with an error if it does.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import flask
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.instrumentation import LoggingObserver, MetricsRegistry
+
+
+def make_app():
+    blueprint = OAuth2ConsumerBlueprint("bench", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        authorization_url="https://example.com/oauth/authorize",
+        token_url="https://example.com/oauth/access_token",
+        backend=MemoryBackend({"access_token": "abc", "token_type": "bearer"}),
+    )
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(blueprint, url_prefix="/login")
+    return app, blueprint
+
+
+def lookup_time(blueprint, lookups, direct=False):
+    backend = blueprint.backend
+    start = time.time()
+    if direct:
+        for _ in range(lookups):
+            backend.get(blueprint)
+    else:
+        for _ in range(lookups):
+            blueprint.token
+    return (time.time() - start) / lookups
+
+
+def request_time(app, requests):
+    client = app.test_client()
+    start = time.time()
+    for _ in range(requests):
+        client.get("/login/bench")
+    return (time.time() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--budget", type=float, default=0.5,
+        help="allowed overhead per lookup with nothing connected, in us")
+    args = parser.parse_args()
+
+    app, blueprint = make_app()
+    logging.getLogger("flask_dance").setLevel(logging.INFO)
+    direct = lookup_time(blueprint, args.lookups, direct=True)
+    results = []
+    for name, observer in (
+            ("nothing connected", None),
+            ("LoggingObserver (disabled)", LoggingObserver()),
+            ("MetricsRegistry", MetricsRegistry())):
+        if observer is not None:
+            observer.connect()
+        try:
+            results.append((
+                name,
+                lookup_time(blueprint, args.lookups),
+                request_time(app, args.requests),
+            ))
+        finally:
+            if observer is not None:
+                observer.disconnect()
+
+    print("{:<28} {:>8.2f} us/lookup".format("backend.get() directly", direct * 1e6))
+    for name, lookup, request in results:
+        print("{:<28} {:>8.2f} us/lookup {:>+7.2f} us overhead {:>8.1f} us/login".format(
+            name, lookup * 1e6, (lookup - direct) * 1e6, request * 1e6,
+        ))
+
+    overhead = (results[0][1] - direct) * 1e6
+    if overhead > args.budget:
+        sys.exit("overhead with nothing connected is {:.2f} us, over the "
+                 "{:.2f} us budget".format(overhead, args.budget))
+
+
+if __name__ == "__main__":
+    main()
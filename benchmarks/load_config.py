@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+"""
+Measure what loading ``from_config`` costs per request, for an app with
+many blueprints that each pull their credentials from the app config.
+
+Usage::
+
+    python benchmarks/load_config.py --blueprints 20 --requests 20000
+
+Each blueprint loads ``client_id``, ``client_secret`` and ``session.scope``
+from the app config. Three ways of loading the config are compared: reading
+every variable at the start of every request (the way blueprints used to
+work), reading it once for each app (the default), and reading it once but
+checking for changes on every request (``watch_config = True``). Only the
+``before_request`` functions are timed, not the views. Setting
+``session.scope`` builds each blueprint's session, so most of what is left
+once the config is no longer read is the cost of building 20 sessions.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import flask
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.utils import getattrd
+
+
+class PerRequestBlueprint(OAuth2ConsumerBlueprint):
+    """
+    Reads the app config at the start of every request.
+    """
+    def load_config(self):
+        for local_var, config_var in self.from_config.items():
+            value = flask.current_app.config.get(config_var)
+            if value:
+                if "." in local_var:
+                    body, tail = local_var.rsplit(".", 1)
+                    setattr(getattrd(self, body), tail, value)
+                else:
+                    setattr(self, local_var, value)
+
+
+def make_app(blueprint_class, count, watch=False):
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    for i in range(count):
+        name = "provider{}".format(i)
+        prefix = name.upper()
+        blueprint = blueprint_class(name, __name__,
+            authorization_url="https://example.com/oauth/authorize",
+            token_url="https://example.com/oauth/access_token",
+        )
+        blueprint.watch_config = watch
+        blueprint.from_config["client_id"] = prefix + "_CLIENT_ID"
+        blueprint.from_config["client_secret"] = prefix + "_CLIENT_SECRET"
+        blueprint.from_config["session.scope"] = prefix + "_SCOPE"
+        app.config[prefix + "_CLIENT_ID"] = "id-{}".format(i)
+        app.config[prefix + "_CLIENT_SECRET"] = "secret-{}".format(i)
+        app.config[prefix + "_SCOPE"] = "scope-{}".format(i)
+        app.register_blueprint(blueprint, url_prefix="/login")
+    return app
+
+
+def request_time(app, requests):
+    """
+    Average time for the ``before_request`` functions, in seconds.
+    """
+    ctx = app.test_request_context("/")
+    ctx.push()
+    try:
+        # the first request reads the config in every mode
+        app.preprocess_request()
+        start = time.time()
+        for _ in range(requests):
+            app.preprocess_request()
+        return (time.time() - start) / requests
+    finally:
+        ctx.pop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--blueprints", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    baseline = request_time(flask.Flask(__name__), args.requests)
+    results = []
+    for name, blueprint_class, watch in (
+            ("every request (before)", PerRequestBlueprint, False),
+            ("once per app", OAuth2ConsumerBlueprint, False),
+            ("watch_config", OAuth2ConsumerBlueprint, True)):
+        app = make_app(blueprint_class, args.blueprints, watch=watch)
+        results.append((name, request_time(app, args.requests) - baseline))
+
+    print("{} blueprints, 3 variables each".format(args.blueprints))
+    before = results[0][1]
+    for name, elapsed in results:
+        print("{:<24} {:>8.1f} us/request {:>6.1f}x".format(
+            name, elapsed * 1e6, before / elapsed,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+"""
+Measure how many RSA-SHA1 OAuth 1 signatures per second can be made with
+an RSA key given as a PEM string, which is parsed for every signature, and
+with the key parsed once by ``load_rsa_key``, as JIRA blueprints do.
+
+Usage::
+
+    python benchmarks/rsa_signing.py --signatures 2000 --key-size 2048
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from oauthlib.oauth1 import Client, SIGNATURE_RSA
+from flask_dance.consumer.oauth1 import load_rsa_key
+
+
+def make_pem(key_size):
+    key = rsa.generate_private_key(
+        public_exponent=65537, key_size=key_size, backend=default_backend(),
+    )
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode("ascii")
+
+
+def signatures_per_second(rsa_key, signatures):
+    client = Client(
+        "consumer-key",
+        resource_owner_key="token",
+        resource_owner_secret="secret",
+        signature_method=SIGNATURE_RSA,
+        rsa_key=rsa_key,
+    )
+    start = time.time()
+    for i in range(signatures):
+        client.sign("https://jira.example.com/rest/api/2/issue/{}".format(i))
+    return signatures / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--signatures", type=int, default=2000)
+    parser.add_argument("--key-size", type=int, default=2048)
+    args = parser.parse_args()
+
+    pem = make_pem(args.key_size)
+    results = [
+        ("PEM string (parsed per signature)",
+         signatures_per_second(pem, args.signatures)),
+        ("parsed key (load_rsa_key)",
+         signatures_per_second(load_rsa_key(pem), args.signatures)),
+    ]
+    for name, rate in results:
+        print("{:<36} {:>10.0f} signatures/s".format(name, rate))
+    print("speedup: {:.1f}x".format(results[1][1] / results[0][1]))
+
+
+if __name__ == "__main__":
+    main()
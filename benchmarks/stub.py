@@ -0,0 +1,191 @@
+"""
+Small HTTP servers with artificial latency, run in a background thread,
+for benchmarks that need to talk to something over a real socket.
+"""
+from __future__ import print_function, division
+
+import json
+import time
+import uuid
+import threading
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlsplit, parse_qsl, urlencode
+
+
+class StubServer(object):
+    """
+    Serves HTTP requests in a background thread, calling
+    ``respond(method, path, params, headers)`` for each request after
+    sleeping for ``latency`` seconds. ``respond`` returns a
+    ``(status, headers, body)`` tuple. Use it as a context manager.
+    """
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def handle_request(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                params.update(parse_qsl(body.decode("utf-8")))
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, headers, body = stub.respond(
+                    self.command, url.path, params, self.headers,
+                )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05},
+        )
+        self.thread.daemon = True
+
+    def respond(self, method, path, params, headers):
+        raise NotImplementedError()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LatencyServer(StubServer):
+    """
+    Responds to every request with ``body`` after sleeping for ``latency``
+    seconds.
+    """
+    def __init__(self, latency=0.05, body=b'{"ok": true}'):
+        super(LatencyServer, self).__init__(latency=latency)
+        self.body = body
+
+    def respond(self, method, path, params, headers):
+        return 200, {"Content-Type": "application/json"}, self.body
+
+
+def _json(data):
+    return 200, {"Content-Type": "application/json"}, json.dumps(data).encode("utf-8")
+
+
+def _form(data):
+    return (
+        200, {"Content-Type": "application/x-www-form-urlencoded"},
+        urlencode(data).encode("utf-8"),
+    )
+
+
+def _redirect(url, params):
+    separator = "&" if "?" in url else "?"
+    return 302, {"Location": url + separator + urlencode(params)}, b""
+
+
+def _oauth1_params(headers):
+    auth = headers.get("Authorization") or ""
+    if not auth.startswith("OAuth "):
+        return {}
+    params = {}
+    for part in auth[len("OAuth "):].split(","):
+        key, _, value = part.strip().partition("=")
+        params[key] = dict(parse_qsl("v=" + value.strip('"')))["v"]
+    return params
+
+
+class FakeProvider(StubServer):
+    """
+    An OAuth provider that implements just enough of OAuth 1 and OAuth 2 for
+    a client to go through the whole dance, without checking signatures or
+    client credentials:
+
+    * ``/oauth2/authorize``, ``/oauth2/token`` (for the
+      ``authorization_code`` and ``refresh_token`` grants)
+    * ``/oauth1/request_token``, ``/oauth1/authorize``,
+      ``/oauth1/access_token``
+    * ``/api/user``, which stands in for the provider's API.
+
+    OAuth 2 access tokens expire after ``expires_in`` seconds; pass a
+    negative number to have every new token expire straight away, so that
+    clients have to refresh it before calling the API. Refreshed tokens
+    are valid for an hour.
+    """
+    def __init__(self, latency=0.005, expires_in=3600):
+        super(FakeProvider, self).__init__(latency=latency)
+        self.expires_in = expires_in
+        self.issued = 0
+        self.refreshed = 0
+        # OAuth 1 request token -> callback URL
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def _new_token(self):
+        return uuid.uuid4().hex
+
+    def respond(self, method, path, params, headers):
+        if path == "/oauth2/authorize":
+            return _redirect(params["redirect_uri"], {
+                "code": self._new_token(), "state": params.get("state", ""),
+            })
+        if path == "/oauth2/token":
+            expires_in = self.expires_in
+            with self._lock:
+                if params.get("grant_type") == "refresh_token":
+                    self.refreshed += 1
+                    expires_in = 3600
+                else:
+                    self.issued += 1
+            return _json({
+                "access_token": self._new_token(),
+                "refresh_token": params.get("refresh_token") or self._new_token(),
+                "token_type": "bearer",
+                "expires_in": expires_in,
+            })
+        if path == "/oauth1/request_token":
+            token = self._new_token()
+            with self._lock:
+                self._callbacks[token] = _oauth1_params(headers).get("oauth_callback")
+            return _form({
+                "oauth_token": token,
+                "oauth_token_secret": self._new_token(),
+                "oauth_callback_confirmed": "true",
+            })
+        if path == "/oauth1/authorize":
+            token = params["oauth_token"]
+            with self._lock:
+                callback = self._callbacks.pop(token)
+            return _redirect(callback, {
+                "oauth_token": token, "oauth_verifier": self._new_token(),
+            })
+        if path == "/oauth1/access_token":
+            with self._lock:
+                self.issued += 1
+            return _form({
+                "oauth_token": self._new_token(),
+                "oauth_token_secret": self._new_token(),
+            })
+        if path == "/api/user":
+            return _json({"id": 1, "login": "octocat"})
+        return 404, {"Content-Type": "text/plain"}, b"not found"
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+"""
+Measure what serving many tenants from one blueprint costs per request,
+compared with an app that registers one blueprint per tenant.
+
+Usage::
+
+    python benchmarks/tenants.py --tenants 50000 --requests 5000
+
+Each request goes to the ``login`` view, which builds the authorization URL
+from the tenant's ``client_id`` and ``authorization_url``, and picks the
+tenant from a request header. Tenants are loaded from a dict, so a cache
+miss costs about as little as it can; a real loader that queries a database
+makes misses more expensive. The ``skewed`` runs send most requests to a
+few tenants, as real traffic does, and the ``uniform`` runs spread them
+evenly, so that the registry can't keep every tenant.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import flask
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.tenants import TenantRegistry
+
+
+def make_tenants(count):
+    return {
+        "tenant{}".format(i): {
+            "client_id": "client-{}".format(i),
+            "client_secret": "secret-{}".format(i),
+            "authorization_url": "https://t{}.example.com/oauth/authorize".format(i),
+        }
+        for i in range(count)
+    }
+
+
+def make_blueprint(name, **kwargs):
+    settings = dict(
+        client_id="client_id",
+        client_secret="client_secret",
+        authorization_url="https://example.com/oauth/authorize",
+        token_url="https://example.com/oauth/access_token",
+    )
+    settings.update(kwargs)
+    return OAuth2ConsumerBlueprint(name, __name__, **settings)
+
+
+def make_app(blueprints):
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    for blueprint in blueprints:
+        app.register_blueprint(blueprint, url_prefix="/login")
+    return app
+
+
+def make_tenant_app(tenants, maxsize):
+    registry = TenantRegistry(tenants.get, maxsize=maxsize)
+    blueprint = make_blueprint("provider", tenants=registry)
+
+    @blueprint.tenant_resolver
+    def resolve_tenant():
+        return flask.request.headers.get("X-Tenant")
+
+    return make_app([blueprint]), registry
+
+
+def make_per_tenant_app(tenants):
+    """
+    The alternative: one blueprint, with its own routes and hooks, for each
+    tenant.
+    """
+    blueprints = []
+    for tenant_id, settings in tenants.items():
+        blueprints.append(make_blueprint(tenant_id, **settings))
+    return make_app(blueprints)
+
+
+def pick_tenants(count, requests, skewed, seed=42):
+    rand = random.Random(seed)
+    picked = []
+    for _ in range(requests):
+        if skewed:
+            i = min(count, int(rand.paretovariate(1.2))) - 1
+        else:
+            i = rand.randrange(count)
+        picked.append("tenant{}".format(i))
+    return picked
+
+
+def request_time(app, paths_and_headers):
+    # a fresh session for every request, as from many different users
+    client = app.test_client(use_cookies=False)
+    start = time.time()
+    for path, headers in paths_and_headers:
+        resp = client.get(path, headers=headers, base_url="https://a.b.c")
+        assert resp.status_code == 302, resp.status
+    return (time.time() - start) / len(paths_and_headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--maxsize", type=int, default=10000,
+        help="tenants kept by the registry's cache")
+    parser.add_argument("--per-tenant-blueprints", type=int, default=200,
+        help="tenants for the one-blueprint-per-tenant app")
+    args = parser.parse_args()
+
+    tenants = make_tenants(args.tenants)
+    print("{:<34} {:>10} {:>9}".format("setup", "us/request", "hit rate"))
+
+    single = make_app([make_blueprint("provider")])
+    elapsed = request_time(single, [("/login/provider", {})] * args.requests)
+    print("{:<34} {:>10.1f} {:>9}".format("no tenants", elapsed * 1e6, "-"))
+
+    for skewed in (True, False):
+        app, registry = make_tenant_app(tenants, args.maxsize)
+        picked = pick_tenants(args.tenants, args.requests, skewed)
+        elapsed = request_time(app, [
+            ("/login/provider", {"X-Tenant": tenant_id}) for tenant_id in picked
+        ])
+        lookups = registry.hits + registry.misses
+        print("{:<34} {:>10.1f} {:>8.1f}%".format(
+            "{} tenants, {}".format(args.tenants, "skewed" if skewed else "uniform"),
+            elapsed * 1e6, registry.hits / lookups * 100,
+        ))
+
+    count = args.per_tenant_blueprints
+    subset = {}
+    for i in range(count):
+        tenant_id = "tenant{}".format(i)
+        subset[tenant_id] = tenants[tenant_id]
+    start = time.time()
+    app = make_per_tenant_app(subset)
+    setup = time.time() - start
+    picked = pick_tenants(count, args.requests, skewed=False)
+    elapsed = request_time(app, [
+        ("/login/" + tenant_id, {}) for tenant_id in picked
+    ])
+    print("{:<34} {:>10.1f} {:>9}".format(
+        "{} blueprints, one per tenant".format(count), elapsed * 1e6, "-",
+    ))
+    print("    {} URL rules, {} before_request hooks, {:.2f}s to set up".format(
+        len(list(app.url_map.iter_rules())),
+        len(app.before_request_funcs.get(None, [])), setup,
+    ))
+
+
+if __name__ == "__main__":
+    main()
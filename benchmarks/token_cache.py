@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+"""
+Measure the latency of ``SQLAlchemyBackend.get()`` with and without the
+in-process token cache, for a table with many distinct users.
+
+Usage::
+
+    python benchmarks/token_cache.py --users 10000 1000000
+
+Each run fills an SQLite database with one token per user, then looks up
+tokens for randomly chosen users. Lookups follow a skewed distribution, so
+that some users are much more active than others, as on a real site.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from flask_dance.utils import FakeCache, LocalCache
+
+
+Base = declarative_base()
+
+class OAuth(Base, OAuthConsumerMixin):
+    user_id = Column(Integer)
+
+
+def make_database(path, users):
+    engine = create_engine("sqlite:///{}".format(path))
+    Base.metadata.create_all(engine)
+    rows = (
+        {"provider": "bench", "user_id": uid,
+         "token": {"access_token": "token-{}".format(uid), "token_type": "bearer"}}
+        for uid in range(1, users + 1)
+    )
+    chunk = []
+    with engine.begin() as conn:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == 10000:
+                conn.execute(OAuth.__table__.insert(), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(OAuth.__table__.insert(), chunk)
+    return engine
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def run(engine, users, lookups, cache):
+    session = sessionmaker(bind=engine)()
+    blueprint = OAuth2ConsumerBlueprint("bench", __name__)
+    backend = SQLAlchemyBackend(OAuth, session, cache=cache)
+    rand = random.Random(42)
+    user_ids = [
+        min(users, int(rand.paretovariate(1.2))) for _ in range(lookups)
+    ]
+    timings = []
+    for uid in user_ids:
+        start = time.time()
+        backend.get(blueprint, user_id=uid)
+        timings.append(time.time() - start)
+    session.close()
+    timings.sort()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 1000000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--maxsize", type=int, default=10000)
+    args = parser.parse_args()
+
+    print("{:>9} {:>12} {:>10} {:>10} {:>10} {:>8}".format(
+        "users", "cache", "mean us", "p50 us", "p99 us", "hit %"
+    ))
+    for users in args.users:
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            engine = make_database(path, users)
+            for name, cache in (
+                    ("none", FakeCache()),
+                    ("LocalCache", LocalCache(maxsize=args.maxsize, default_timeout=0))):
+                timings = run(engine, users, args.lookups, cache)
+                hits = getattr(cache, "hits", 0)
+                print("{:>9} {:>12} {:>10.1f} {:>10.1f} {:>10.1f} {:>8.1f}".format(
+                    users, name,
+                    sum(timings) / len(timings) * 1e6,
+                    percentile(timings, 50) * 1e6,
+                    percentile(timings, 99) * 1e6,
+                    hits / args.lookups * 100,
+                ))
+            engine.dispose()
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+"""
+Show the query plan and latency of the query that ``SQLAlchemyBackend.get()``
+runs on a large SQLite token table, with and without the unique
+``(provider, user_id)`` index that ``OAuthConsumerMixin`` declares, and with
+and without loading full model instances.
+
+Usage::
+
+    python benchmarks/token_query.py --rows 1000000
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend.sqla import (
+    OAuthConsumerMixin, SQLAlchemyBackend, Identity,
+)
+
+
+Base = declarative_base()
+
+class OAuth(Base, OAuthConsumerMixin):
+    user_id = Column(Integer)
+
+
+PROVIDERS = ("github", "google", "twitter", "jira")
+
+
+def make_database(path, rows):
+    engine = create_engine("sqlite:///{}".format(path))
+    Base.metadata.create_all(engine)
+    chunk = []
+    with engine.begin() as conn:
+        for i in range(rows):
+            chunk.append({
+                "provider": PROVIDERS[i % len(PROVIDERS)],
+                "user_id": i // len(PROVIDERS) + 1,
+                "token": {"access_token": "token-{}".format(i)},
+            })
+            if len(chunk) == 10000:
+                conn.execute(OAuth.__table__.insert(), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(OAuth.__table__.insert(), chunk)
+    return engine
+
+
+def query_plan(engine, query):
+    compiled = query.statement.compile(
+        dialect=engine.dialect, compile_kwargs={"literal_binds": True},
+    )
+    with engine.connect() as conn:
+        rows = conn.execute("EXPLAIN QUERY PLAN {}".format(compiled)).fetchall()
+    return "; ".join(row[-1] for row in rows)
+
+
+def time_lookups(session, backend, blueprint, entity, user_ids):
+    start = time.time()
+    for uid in user_ids:
+        backend._query(blueprint, Identity(None, uid), entity).one()
+        session.expunge_all()
+    return (time.time() - start) / len(user_ids) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        engine = make_database(path, args.rows)
+        session = sessionmaker(bind=engine)()
+        blueprint = OAuth2ConsumerBlueprint("github", __name__)
+        backend = SQLAlchemyBackend(OAuth, session)
+        rand = random.Random(42)
+        users = args.rows // len(PROVIDERS)
+        user_ids = [rand.randint(1, users) for _ in range(args.lookups)]
+        index_name = "uq_{}_provider_user_id".format(OAuth.__tablename__)
+
+        for indexed in (True, False):
+            if not indexed:
+                engine.execute("DROP INDEX {}".format(index_name))
+            label = "with index" if indexed else "without index"
+            plan = query_plan(engine, backend._query(
+                blueprint, Identity(None, 1), OAuth.token,
+            ))
+            print("{}: {}".format(label, plan))
+            for name, entity in (("token column", OAuth.token), ("full model", OAuth)):
+                micros = time_lookups(session, backend, blueprint, entity, user_ids)
+                print("    {:<14} {:>12.1f} us/lookup".format(name, micros))
+        session.close()
+        engine.dispose()
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+"""
+Compare the statements issued by ``SQLAlchemyBackend.set()`` when it
+refreshes an existing token on SQLite, against the old DELETE + INSERT
+approach.
+
+Usage::
+
+    python benchmarks/upsert.py --users 1000 --refreshes 5000
+
+With SQLAlchemy 1.4 or newer, each refresh is a single
+``INSERT ... ON CONFLICT DO UPDATE`` statement. With older versions of
+SQLAlchemy, it is a single ``UPDATE`` statement.
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, event, Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from flask_dance.utils import FakeCache
+
+
+Base = declarative_base()
+
+class OAuth(Base, OAuthConsumerMixin):
+    user_id = Column(Integer)
+
+
+class DeleteInsertBackend(SQLAlchemyBackend):
+    """
+    The way ``SQLAlchemyBackend.set()`` used to store tokens.
+    """
+    def set(self, blueprint, token, user=None, user_id=None):
+        (self.session.query(self.model)
+            .filter_by(provider=blueprint.name, user_id=user_id)
+            .delete())
+        self.session.add(self.model(
+            provider=blueprint.name, user_id=user_id, token=token,
+        ))
+        self.session.commit()
+
+
+def run(backend_class, users, refreshes):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine("sqlite:///{}".format(path))
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    blueprint = OAuth2ConsumerBlueprint("bench", __name__)
+    backend = backend_class(OAuth, session, cache=FakeCache())
+    for uid in range(1, users + 1):
+        backend.set(blueprint, {"access_token": "initial"}, user_id=uid)
+
+    statements = Counter()
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements[statement.split(None, 1)[0]] += 1
+    event.listen(engine, "before_cursor_execute", count)
+
+    rand = random.Random(42)
+    start = time.time()
+    for i in range(refreshes):
+        uid = rand.randint(1, users)
+        backend.set(blueprint, {"access_token": "refresh-{}".format(i)}, user_id=uid)
+    elapsed = time.time() - start
+
+    event.remove(engine, "before_cursor_execute", count)
+    session.close()
+    engine.dispose()
+    os.remove(path)
+    return elapsed, statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--refreshes", type=int, default=5000)
+    args = parser.parse_args()
+
+    for name, backend_class in (
+            ("DELETE + INSERT", DeleteInsertBackend),
+            ("SQLAlchemyBackend", SQLAlchemyBackend)):
+        elapsed, statements = run(backend_class, args.users, args.refreshes)
+        per_refresh = sum(statements.values()) / args.refreshes
+        print("{:<18} {:>8.1f} us/refresh {:>5.2f} statements/refresh  {}".format(
+            name, elapsed / args.refreshes * 1e6, per_refresh,
+            ", ".join("{} {}".format(k, v) for k, v in sorted(statements.items())),
+        ))
+
+
+if __name__ == "__main__":
+    main()
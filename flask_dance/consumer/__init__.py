@@ -1,4 +1,4 @@
 from .oauth1 import OAuth1ConsumerBlueprint
 from .oauth2 import OAuth2ConsumerBlueprint
-from .base import oauth_authorized, oauth_error
+from .base import oauth_authorized, oauth_error, oauth_span
 
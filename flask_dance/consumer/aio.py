@@ -0,0 +1,455 @@
+"""
+Asynchronous counterparts of the sessions in :mod:`flask_dance.consumer.requests`,
+for use with :mod:`asyncio`. They require Python 3.5 or newer, and the
+`HTTPX`_ library, which you can install with ``pip install Flask-Dance[async]``.
+
+Token backends are synchronous, so the sessions call them on other threads,
+with :meth:`~asyncio.AbstractEventLoop.run_in_executor`, rather than
+blocking the event loop. Those calls run with a copy of the current Flask
+request context, or app context, and with the tenant chosen with
+:meth:`~flask_dance.consumer.base.BaseOAuthConsumerBlueprint.use_tenant`.
+
+.. _HTTPX: https://www.python-httpx.org/
+"""
+import asyncio
+import functools
+import threading
+import weakref
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from urllib.parse import urlencode
+
+import flask
+import httpx
+from lazy import lazy
+from urlobject import URLObject
+from oauthlib.common import to_unicode
+from oauthlib.oauth2 import WebApplicationClient, TokenExpiredError
+from .signing import OAuth1Signer
+
+
+FORM_ENCODED = "application/x-www-form-urlencoded"
+
+# httpx clients for sessions without a blueprint, one per event loop
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+# locks that serialise token refreshes, one set per event loop
+_refresh_locks = weakref.WeakKeyDictionary()
+
+
+def get_async_client(blueprint=None):
+    """
+    Return the :class:`httpx.AsyncClient` for the current event loop.
+    Every blueprint keeps one client per event loop, so connections to the
+    OAuth provider are pooled and reused by all of its async sessions.
+    """
+    loop = asyncio.get_event_loop()
+    if blueprint is None:
+        clients, lock, pool_maxsize = _clients, _clients_lock, None
+        timeout = httpx.Timeout(5)
+    else:
+        clients = blueprint._async_clients
+        lock = blueprint._transport_lock
+        pool_maxsize = blueprint.pool_maxsize
+        timeout = make_timeout(blueprint.timeout)
+    client = clients.get(loop)
+    if client is None or client.is_closed:
+        with lock:
+            client = clients.get(loop)
+            if client is None or client.is_closed:
+                limits = httpx.Limits(max_keepalive_connections=pool_maxsize)
+                client = clients[loop] = httpx.AsyncClient(
+                    limits=limits, timeout=timeout,
+                )
+    return client
+
+
+def make_timeout(timeout):
+    """
+    Turn a Requests-style timeout, which is either a number or a
+    ``(connect, read)`` tuple, into an :class:`httpx.Timeout`.
+    """
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+async def run_blocking(blueprint, func, *args):
+    """
+    Call ``func`` with ``args`` on a thread of the event loop's default
+    executor, with the current Flask context and the blueprint's current
+    tenant, and return its result. Use it for calls to the token backend.
+    """
+    context = _ThreadContext(blueprint)
+
+    def call():
+        with context:
+            return func(*args)
+
+    return await asyncio.get_event_loop().run_in_executor(None, call)
+
+
+class _ThreadContext(object):
+    """
+    What a backend call on another thread needs from the thread that makes
+    it: the Flask request context (or app context), and the tenant chosen
+    with ``use_tenant``. Entering it on the other thread recreates them.
+    """
+    def __init__(self, blueprint):
+        self.blueprint = blueprint
+        top = flask._request_ctx_stack.top
+        if top is not None:
+            self.flask_ctx = top.copy()
+            # older versions of Flask open the session again for a copy,
+            # which would lose changes that haven't been saved yet
+            self.flask_ctx.session = top.session
+        elif flask.has_app_context():
+            self.flask_ctx = flask.current_app.app_context()
+        else:
+            self.flask_ctx = None
+        local = getattr(blueprint, "_tenant_local", None)
+        self.tenants = list(getattr(local, "stack", None) or [])
+
+    def __enter__(self):
+        if self.flask_ctx is not None:
+            self.flask_ctx.push()
+        if self.tenants:
+            self.blueprint._tenant_local.stack = list(self.tenants)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.tenants:
+            self.blueprint._tenant_local.stack = []
+        if self.flask_ctx is not None:
+            self.flask_ctx.pop()
+
+
+class _BackendThread(object):
+    """
+    A thread of its own for backend calls that have to be made from the
+    same thread, like entering and leaving
+    :meth:`~flask_dance.consumer.backend.BaseBackend.refresh_lock`, which
+    may hold a database transaction. Context managers entered with
+    :meth:`enter` are left, on that thread, when this is.
+    """
+    def __init__(self, blueprint):
+        self.blueprint = blueprint
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._stack = ExitStack()
+
+    async def call(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args),
+        )
+
+    async def enter(self, context_manager):
+        return await self.call(self._stack.enter_context, context_manager)
+
+    async def __aenter__(self):
+        await self.enter(_ThreadContext(self.blueprint))
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            return await self.call(
+                self._stack.__exit__, exc_type, exc_value, traceback,
+            )
+        finally:
+            self._executor.shutdown(wait=False)
+
+
+class BaseAsyncSession(metaclass=ABCMeta):
+    """
+    The parts that :class:`AsyncOAuth1Session` and :class:`AsyncOAuth2Session`
+    have in common:
+
+    * lazy-loads OAuth tokens from the backend via the blueprint
+    * has a ``base_url`` property used for relative URL resolution
+    * sends requests through an :class:`httpx.AsyncClient` that is shared
+      with the other async sessions of the blueprint on the same event loop
+
+    Requests return :class:`httpx.Response` objects.
+    """
+    def __init__(self, blueprint=None, base_url=None, http_client=None):
+        self.blueprint = blueprint
+        self.base_url = URLObject(base_url)
+        self._http_client = http_client
+
+    @lazy
+    def token(self):
+        return self.blueprint.token
+
+    async def load_token(self):
+        """
+        Load the token from the backend, if it isn't loaded yet, without
+        blocking the event loop.
+        """
+        if "token" not in self.__dict__ and self.blueprint is not None:
+            blueprint = self.blueprint
+            self.token = await run_blocking(
+                blueprint, lambda: blueprint.token,
+            )
+
+    @property
+    def http_client(self):
+        """
+        The :class:`httpx.AsyncClient` that this session sends requests with.
+        """
+        if self._http_client is not None:
+            return self._http_client
+        return get_async_client(self.blueprint)
+
+    def resolve_url(self, url, params=None):
+        if self.base_url:
+            url = self.base_url.relative(url)
+        url = httpx.URL(str(url))
+        if params:
+            url = url.copy_merge_params(params)
+        return str(url)
+
+    def encode_body(self, data, headers):
+        """
+        Turn ``data`` into a request body, and set the Content-Type header
+        for form data.
+        """
+        if data is None or isinstance(data, (str, bytes)):
+            return data
+        headers.setdefault("Content-Type", FORM_ENCODED)
+        return urlencode(data)
+
+    @abstractmethod
+    async def request(self, method, url, data=None, headers=None,
+                      params=None, **kwargs):
+        raise NotImplementedError()
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, data=None, **kwargs):
+        return await self.request("POST", url, data=data, **kwargs)
+
+    async def put(self, url, data=None, **kwargs):
+        return await self.request("PUT", url, data=data, **kwargs)
+
+    async def patch(self, url, data=None, **kwargs):
+        return await self.request("PATCH", url, data=data, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+    async def aclose(self):
+        """
+        Close the HTTP client for the current event loop, along with its
+        open connections.
+        """
+        await self.http_client.aclose()
+
+
+class AsyncOAuth1Session(BaseAsyncSession):
+    """
+    An asynchronous session that signs requests with OAuth 1, like
+    :class:`~flask_dance.consumer.requests.OAuth1Session`. Requests are
+    signed with a copy of the :class:`~flask_dance.consumer.signing.OAuth1Signer`'s
+    client that holds the current token, so concurrent requests never share
+    signing state.
+    """
+    def __init__(self, client_key, client_secret=None,
+                 signature_method="HMAC-SHA1", signature_type="AUTH_HEADER",
+                 rsa_key=None, client_class=None, force_include_body=False,
+                 blueprint=None, base_url=None, http_client=None, signer=None,
+                 **kwargs):
+        super(AsyncOAuth1Session, self).__init__(
+            blueprint=blueprint, base_url=base_url, http_client=http_client,
+        )
+        if signer is None:
+            signer = OAuth1Signer(
+                client_key,
+                client_secret=client_secret,
+                signature_method=signature_method,
+                signature_type=signature_type,
+                rsa_key=rsa_key,
+                client_class=client_class,
+                **kwargs
+            )
+        self.signer = signer
+        self.force_include_body = force_include_body
+
+    def make_signer(self):
+        # httpx wants text, so don't encode the signed request
+        return self.signer.client_for(self.token, decoding=None)
+
+    async def request(self, method, url, data=None, headers=None,
+                      params=None, **kwargs):
+        url = self.resolve_url(url, params)
+        headers = dict(headers or {})
+        body = self.encode_body(data, headers)
+        await self.load_token()
+        signer = self.make_signer()
+        content_type = headers.get("Content-Type", "")
+        if body and (FORM_ENCODED in content_type or self.force_include_body):
+            url, headers, body = signer.sign(
+                to_unicode(url), to_unicode(method), body=body, headers=headers,
+            )
+        else:
+            url, headers, _ = signer.sign(
+                to_unicode(url), to_unicode(method), headers=headers,
+            )
+        return await self.http_client.request(
+            method, url, content=body, headers=headers, **kwargs
+        )
+
+
+class AsyncOAuth2Session(BaseAsyncSession):
+    """
+    An asynchronous session that authenticates requests with OAuth 2, like
+    :class:`~flask_dance.consumer.requests.OAuth2Session`. If the token has
+    expired and ``auto_refresh_url`` is set, the token is refreshed and
+    stored before the request is sent. Concurrent requests on the same event
+    loop that find the same expired token wait for one refresh, rather than
+    all refreshing it at once.
+    """
+    def __init__(self, client_id=None, client=None, auto_refresh_url=None,
+                 auto_refresh_kwargs=None, scope=None, redirect_uri=None,
+                 token=None, state=None, token_updater=None,
+                 blueprint=None, base_url=None, http_client=None):
+        super(AsyncOAuth2Session, self).__init__(
+            blueprint=blueprint, base_url=base_url, http_client=http_client,
+        )
+        self.client_id = client_id
+        self._client = client or WebApplicationClient(client_id)
+        self.auto_refresh_url = auto_refresh_url
+        self.auto_refresh_kwargs = auto_refresh_kwargs or {}
+        self.scope = scope
+        self.redirect_uri = redirect_uri
+        self.state = state
+        self.token_updater = token_updater
+        if token is not None:
+            self.token = token
+
+    def add_token(self, url, method, body, headers):
+        self._client.token = self.token
+        if self.token:
+            self._client._populate_attributes(self.token)
+        return self._client.add_token(
+            url, http_method=method, body=body, headers=headers,
+        )
+
+    async def request(self, method, url, data=None, headers=None,
+                      params=None, withhold_token=False, **kwargs):
+        url = self.resolve_url(url, params)
+        headers = dict(headers or {})
+        body = self.encode_body(data, headers)
+        if not withhold_token:
+            await self.load_token()
+        if self.token and not withhold_token:
+            try:
+                url, headers, body = self.add_token(url, method, body, headers)
+            except TokenExpiredError:
+                if not self.auto_refresh_url:
+                    raise
+                await self.refresh_expired_token()
+                url, headers, body = self.add_token(url, method, body, headers)
+        return await self.http_client.request(
+            method, url, content=body, headers=headers, **kwargs
+        )
+
+    async def refresh_token(self, token_url, refresh_token=None, **kwargs):
+        """
+        Fetch a new access token from the OAuth provider with the
+        refresh token, and return it. Unlike :meth:`refresh_expired_token`,
+        this doesn't store the new token.
+        """
+        refresh_token = refresh_token or self.token.get("refresh_token")
+        kwargs.update(self.auto_refresh_kwargs)
+        body = self._client.prepare_refresh_body(
+            refresh_token=refresh_token, scope=self.scope, **kwargs
+        )
+        response = await self.http_client.post(
+            self.resolve_url(token_url),
+            content=body,
+            headers={
+                "Accept": "application/json",
+                "Content-Type": FORM_ENCODED + ";charset=UTF-8",
+            },
+        )
+        token = self._client.parse_request_body_response(
+            response.text, scope=self.scope,
+        )
+        if "refresh_token" not in token:
+            token["refresh_token"] = refresh_token
+        return token
+
+    async def refresh_expired_token(self):
+        """
+        Refresh the current token, unless another request has already done
+        so, and store the new token. Like a refresh in a synchronous
+        request, this holds the blueprint's refresh lock and the backend's
+        :meth:`~flask_dance.consumer.backend.BaseBackend.refresh_lock`, so
+        synchronous and asynchronous requests never refresh the same token
+        at the same time.
+        """
+        stale = self.token
+        blueprint = self.blueprint
+        coordinator = getattr(blueprint, "refresh_coordinator", None)
+        if coordinator is not None:
+            key = coordinator.make_key(blueprint, stale)
+        else:
+            key = (id(self), stale.get("refresh_token"))
+        async with _RefreshLock(key):
+            if blueprint is None:
+                token = await self.refresh_token(self.auto_refresh_url)
+                if self.token_updater:
+                    self.token_updater(token)
+                self.token = token
+                return token
+            async with _BackendThread(blueprint) as thread:
+                if coordinator is not None:
+                    await thread.enter(coordinator.lock(blueprint, stale))
+                current = await thread.enter(
+                    blueprint.backend.refresh_lock(blueprint)
+                )
+                if coordinator is not None and coordinator.is_fresher(current, stale):
+                    coordinator.reused += 1
+                    self.token = current
+                    return current
+                token = await self.refresh_token(self.auto_refresh_url)
+                await thread.call(setattr, blueprint, "token", token)
+                if coordinator is not None:
+                    coordinator.refreshed += 1
+            self.token = token
+            return token
+
+
+class _RefreshLock(object):
+    """
+    An :class:`asyncio.Lock` for one token on the current event loop, which
+    is forgotten once nobody is waiting for it.
+    """
+    def __init__(self, key):
+        self.key = key
+
+    async def __aenter__(self):
+        locks = _refresh_locks.setdefault(asyncio.get_event_loop(), {})
+        entry = locks.get(self.key)
+        if entry is None:
+            entry = locks[self.key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.locks, self.entry = locks, entry
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._checkin()
+            raise
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.entry[0].release()
+        self._checkin()
+
+    def _checkin(self):
+        self.entry[1] -= 1
+        if not self.entry[1]:
+            del self.locks[self.key]
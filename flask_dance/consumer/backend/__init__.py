@@ -1,5 +1,44 @@
 import six
+import inspect
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+
+
+class BulkNotSupported(NotImplementedError):
+    """
+    Raised by backends that only know the token of the user making the
+    current request, like
+    :class:`~flask_dance.consumer.backend.session.SessionBackend`, when
+    asked to store or delete the tokens of other users. The bulk methods of
+    :class:`BaseBackend` raise it, too, if the backend's ``get``, ``set``
+    or ``delete`` method doesn't take a ``user_id`` argument.
+    """
+
+
+def _takes_user_id(method):
+    """
+    Whether ``method`` can be called with a ``user_id`` keyword argument.
+    """
+    try:
+        params = inspect.signature(method).parameters.values()
+    except AttributeError:
+        # Python 2
+        spec = inspect.getargspec(method)
+        return "user_id" in spec.args or spec.keywords is not None
+    return any(
+        param.name == "user_id" or param.kind == param.VAR_KEYWORD
+        for param in params
+    )
+
+
+def _check_user_id(method):
+    if not _takes_user_id(method):
+        raise BulkNotSupported(
+            "{}.{} doesn't take a user_id argument, so it can't be used "
+            "for the tokens of other users".format(
+                type(method.__self__).__name__, method.__name__,
+            )
+        )
 
 
 class BaseBackend(six.with_metaclass(ABCMeta)):
@@ -15,6 +54,77 @@ class BaseBackend(six.with_metaclass(ABCMeta)):
     def delete(self, blueprint):
         return None
 
+    def get_many(self, blueprint, user_ids):
+        """
+        Look up the tokens of many users at once, and return a dict that
+        maps the ID of each user who has a token to their token. Users
+        without a token are left out.
+
+        The default implementation calls :meth:`get` with a ``user_id``
+        argument once per user, or raises :class:`BulkNotSupported` if
+        :meth:`get` doesn't take one. Backends that can look up many tokens
+        with fewer round trips, like
+        :class:`~flask_dance.consumer.backend.sqla.SQLAlchemyBackend`,
+        override it.
+        """
+        _check_user_id(self.get)
+        tokens = {}
+        for user_id in user_ids:
+            token = self.get(blueprint, user_id=user_id)
+            if token:
+                tokens[user_id] = token
+        return tokens
+
+    def set_many(self, blueprint, tokens):
+        """
+        Store the tokens of many users at once. ``tokens`` is a dict that
+        maps user IDs to tokens, or an iterable of ``(user_id, token)``
+        pairs.
+
+        The default implementation calls :meth:`set` with a ``user_id``
+        argument once per user, or raises :class:`BulkNotSupported` if
+        :meth:`set` doesn't take one.
+        """
+        _check_user_id(self.set)
+        if hasattr(tokens, "items"):
+            tokens = tokens.items()
+        for user_id, token in tokens:
+            self.set(blueprint, token, user_id=user_id)
+
+    def delete_many(self, blueprint, user_ids):
+        """
+        Delete the tokens of many users at once.
+
+        The default implementation calls :meth:`delete` with a ``user_id``
+        argument once per user, or raises :class:`BulkNotSupported` if
+        :meth:`delete` doesn't take one.
+        """
+        _check_user_id(self.delete)
+        for user_id in user_ids:
+            self.delete(blueprint, user_id=user_id)
+
+    def iter_tokens(self, blueprint, batch_size=1000):
+        """
+        Yield a ``(user_id, token)`` pair for every token stored for this
+        blueprint, reading ``batch_size`` tokens from storage at a time.
+
+        The default implementation only knows about the token that
+        :meth:`get` returns, which it yields with a ``user_id`` of ``None``.
+        """
+        token = self.get(blueprint)
+        if token:
+            yield None, token
+
+    @contextmanager
+    def refresh_lock(self, blueprint):
+        """
+        A context manager that is held while an expired token is refreshed,
+        and yields the token that is currently stored. Backends that are
+        shared between processes can override this to lock the stored token,
+        so that only one process refreshes it at a time.
+        """
+        yield self.get(blueprint)
+
 
 class NullBackend(BaseBackend):
     """
@@ -26,6 +136,12 @@ class NullBackend(BaseBackend):
         return None
     def delete(self, blueprint):
         return None
+    def get_many(self, blueprint, user_ids):
+        return {}
+    def set_many(self, blueprint, tokens):
+        return None
+    def delete_many(self, blueprint, user_ids):
+        return None
 
 
 class MemoryBackend(BaseBackend):
@@ -43,3 +159,19 @@ class MemoryBackend(BaseBackend):
 
     def delete(self, blueprint):
         self.token = None
+
+    def get_many(self, blueprint, user_ids):
+        # there is only one token, and it belongs to everyone
+        if not self.token:
+            return {}
+        return dict((user_id, self.token) for user_id in user_ids)
+
+    def set_many(self, blueprint, tokens):
+        if hasattr(tokens, "items"):
+            tokens = tokens.items()
+        for user_id, token in tokens:
+            self.token = token
+
+    def delete_many(self, blueprint, user_ids):
+        if list(user_ids):
+            self.token = None
@@ -1,31 +1,189 @@
-from . import BaseBackend
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from . import BaseBackend, BulkNotSupported
+from flask_dance.utils import LocalCache
 import flask
 
 
+_NO_BULK = (
+    "SessionBackend only knows the token of the current request; "
+    "use a backend that stores tokens per user, like SQLAlchemyBackend"
+)
+
+
 class SessionBackend(BaseBackend):
     """
     The default storage backend. Stores and retrieves OAuth tokens using
     the :ref:`Flask session <flask:sessions>`.
     """
-    def __init__(self, key="{bp.name}_oauth_token"):
+    def __init__(self, key="{bp.token_namespace}_oauth_token", store=None):
         """
         Args:
             key (str): The name to use as a key for storing the OAuth token in the
                 Flask session. This string will have ``.format(bp=self.blueprint)``
                 called on it before it is used. so you can refer to information
                 on the blueprint as part of the key. For example, ``{bp.name}``
-                will be replaced with the name of the blueprint.
+                will be replaced with the name of the blueprint. The default
+                uses ``{bp.token_namespace}``, which is the name of the
+                blueprint, followed by the tenant if the blueprint has
+                tenants.
+            store: A server-side token store, like
+                :class:`MemoryTokenStore` or :class:`SQLiteTokenStore`.
+                If given, the Flask session only holds a short, random handle,
+                and the OAuth token itself is kept in the store. This keeps
+                cookie-based sessions small. Any object with ``get``, ``set``
+                and ``delete`` methods that take a handle will do.
         """
         self.key = key
+        self.store = store
 
     def get(self, blueprint):
         key = self.key.format(bp=blueprint)
-        return flask.session.get(key)
+        value = flask.session.get(key)
+        if self.store is None or value is None or isinstance(value, dict):
+            # tokens stored before the store was configured are still
+            # kept in the session
+            return value
+        return self.store.get(value)
 
     def set(self, blueprint, token):
         key = self.key.format(bp=blueprint)
-        flask.session[key] = token
+        if self.store is None:
+            flask.session[key] = token
+            return
+        old_handle = flask.session.get(key)
+        # use a new handle for every token, so that an old session cookie
+        # can't be used to read a newer token
+        handle = uuid.uuid4().hex
+        self.store.set(handle, token)
+        flask.session[key] = handle
+        if old_handle and not isinstance(old_handle, dict):
+            self.store.delete(old_handle)
 
     def delete(self, blueprint):
         key = self.key.format(bp=blueprint)
-        del flask.session[key]
+        value = flask.session.pop(key)
+        if self.store is not None and not isinstance(value, dict):
+            self.store.delete(value)
+
+    def get_many(self, blueprint, user_ids):
+        """
+        The Flask session only holds the token of the user who made the
+        current request, and doesn't know who that user is, so no other
+        user's token can be found: this always returns an empty dict.
+        """
+        return {}
+
+    def set_many(self, blueprint, tokens):
+        """
+        Tokens can't be stored in other users' sessions, so this raises
+        :class:`~flask_dance.consumer.backend.BulkNotSupported`, rather
+        than losing the tokens.
+        """
+        raise BulkNotSupported(_NO_BULK)
+
+    def delete_many(self, blueprint, user_ids):
+        """
+        Tokens can't be deleted from other users' sessions, so this raises
+        :class:`~flask_dance.consumer.backend.BulkNotSupported`.
+        """
+        raise BulkNotSupported(_NO_BULK)
+
+
+class MemoryTokenStore(LocalCache):
+    """
+    A server-side token store for :class:`SessionBackend` that keeps tokens
+    in the memory of the current process. Tokens are lost when the process
+    exits, and they aren't shared between processes, so this is best suited
+    to development and single-process deployments.
+    """
+    def __init__(self, maxsize=100000, timeout=0):
+        """
+        Args:
+            maxsize (int): The maximum number of tokens to keep. Once it is
+                reached, the least recently used token is forgotten.
+            timeout (int): The number of seconds to keep a token.
+                Defaults to 0, which means that tokens are kept until they
+                are deleted or forgotten.
+        """
+        super(MemoryTokenStore, self).__init__(
+            maxsize=maxsize, default_timeout=timeout,
+        )
+
+
+class SQLiteTokenStore(object):
+    """
+    A server-side token store for :class:`SessionBackend` that keeps tokens
+    in an SQLite database, using only the Python standard library. Tokens
+    survive restarts, and are shared by all the processes on one machine.
+    """
+    def __init__(self, path, timeout=None, table="flask_dance_session_tokens"):
+        """
+        Args:
+            path (str): The path of the SQLite database file. It is created
+                if it doesn't exist.
+            timeout (int): The number of seconds to keep a token.
+                Defaults to keeping tokens until they are deleted.
+            table (str): The name of the table to keep tokens in.
+        """
+        self.path = path
+        self.timeout = timeout
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS {table} ("
+                "handle TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL"
+                ")".format(table=table)
+            )
+
+    def get(self, handle):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT token, expires_at FROM {table} WHERE handle = ?"
+                .format(table=self.table), (handle,),
+            ).fetchone()
+        if row is None:
+            return None
+        token, expires_at = row
+        if expires_at and expires_at <= time.time():
+            self.delete(handle)
+            return None
+        return json.loads(token)
+
+    def set(self, handle, token, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires_at = time.time() + timeout if timeout else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO {table} (handle, token, expires_at) "
+                "VALUES (?, ?, ?)".format(table=self.table),
+                (handle, json.dumps(token), expires_at),
+            )
+
+    def delete(self, handle):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM {table} WHERE handle = ?".format(table=self.table),
+                (handle,),
+            )
+
+    def purge_expired(self):
+        """
+        Delete all the tokens that have expired, and return how many there were.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM {table} WHERE expires_at <= ?".format(table=self.table),
+                (time.time(),),
+            )
+        return cursor.rowcount
+
+    def close(self):
+        self._conn.close()
@@ -1,16 +1,39 @@
 from datetime import datetime
+from itertools import islice
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
 
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index, inspect
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy_utils import JSONType
 from sqlalchemy.orm.exc import NoResultFound
-from flask_dance.utils import FakeCache, first, getattrd
+import flask
+from flask_dance.utils import (
+    LocalCache, first, getattrd, delete_many, token_cache_timeout,
+)
 from flask_dance.consumer.backend import BaseBackend
 try:
-    from flask_login import AnonymousUserMixin
+    from flask_login import AnonymousUserMixin, user_logged_in, user_logged_out
 except ImportError:
-    AnonymousUserMixin = None
+    AnonymousUserMixin = user_logged_in = user_logged_out = None
+
+
+class _NoToken(object):
+    """
+    Stored in the cache in place of a token when the database has no token
+    for a user, so that cache hits and cache misses can be told apart. It
+    pickles by reference, so it survives a round trip through an external
+    cache.
+    """
+    def __reduce__(self):
+        return "NO_TOKEN"
+
+    def __repr__(self):
+        return "NO_TOKEN"
+
+NO_TOKEN = _NoToken()
 
 
 class OAuthConsumerMixin(object):
@@ -29,11 +52,38 @@ class OAuthConsumerMixin(object):
     ``token``
         a :class:`JSON <sqlalchemy_utils.types.json.JSONType>` field to store
         the actual token received from the OAuth provider
+
+    If your model adds a ``user_id`` column, the mixin also declares a unique
+    index on ``provider`` and ``user_id``, named
+    ``uq_<tablename>_provider_user_id``, so that
+    :class:`SQLAlchemyBackend` can store tokens with a single upsert
+    statement. Existing tables don't get the index by themselves: until
+    you create it with a migration, the backend updates rows in place, as
+    it always has. The backend checks for the index in the database the
+    first time it stores a token, so restart the app after migrating.
+
+    If your model adds an ``expires_at`` column, such as
+    ``expires_at = db.Column(db.Float, index=True)``, the backend copies the
+    token's ``expires_at`` timestamp into it whenever it stores a token, and
+    :meth:`SQLAlchemyBackend.expiring_tokens` finds expiring tokens with a
+    query on that column. Tokens stored before you added the column aren't
+    found until they are stored again, so fill the column in when you add it.
     """
     @declared_attr
     def __tablename__(cls):
         return "flask_dance_{}".format(cls.__name__.lower())
 
+    @declared_attr
+    def __table_args__(cls):
+        if not hasattr(cls, "user_id"):
+            return ()
+        return (
+            Index(
+                "uq_{}_provider_user_id".format(cls.__tablename__),
+                "provider", "user_id", unique=True,
+            ),
+        )
+
     id = Column(Integer, primary_key=True)
     provider = Column(String(50))
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -57,7 +107,8 @@ class SQLAlchemyBackend(BaseBackend):
     .. _SQLAlchemy: http://www.sqlalchemy.org/
     """
     def __init__(self, model, session,
-                 user=None, user_id=None, anon_user=None, cache=None):
+                 user=None, user_id=None, anon_user=None, cache=None,
+                 cache_timeout=None, negative_cache_timeout=None):
         """
         Args:
             model: The SQLAlchemy model class that represents the OAuth token
@@ -91,8 +142,34 @@ class SQLAlchemyBackend(BaseBackend):
                 :class:`flask_login.AnonymousUserMixin` class, but you don't have
                 to provide that -- Flask-Dance treats it as the default.
             cache:
-                An instance of `Flask-Cache`_. Providing a caching system is
-                highly recommended, but not required.
+                An instance of `Flask-Cache`_, or any object with the same
+                ``get``, ``set`` and ``delete`` methods. Defaults to a
+                :class:`~flask_dance.utils.LocalCache`, which caches tokens
+                in the memory of the current process. Other processes can't
+                invalidate it, so if your app runs in several worker
+                processes, a token that one worker stores or deletes can go
+                unnoticed by the others for up to ``cache_timeout`` seconds.
+                To use a small in-process cache in front of a shared cache,
+                pass ``LocalCache(backend=cache)``.
+            cache_timeout (int):
+                The number of seconds to cache a token for. If the token
+                has an ``expires_at`` value, it will never be cached past that
+                time. Defaults to the default timeout of the cache. Pass
+                ``False`` to not cache tokens at all. Any other value is
+                passed on to the cache, so ``0`` means that tokens never
+                time out, as it does for
+                :class:`~flask_dance.utils.LocalCache` and Flask-Cache; they
+                are still dropped once they expire.
+            negative_cache_timeout (int):
+                The number of seconds to remember that there is no token for
+                a user, such as an anonymous user, or a user who hasn't linked
+                their account with this OAuth provider yet. Pass ``False`` to
+                turn this off; as with ``cache_timeout``, ``0`` means that
+                misses are remembered until the token is stored. Defaults to
+                the default timeout of the cache, but if you don't pass a
+                ``cache``, it defaults to ``False``: otherwise, a user who
+                has just linked their account could look unlinked to the
+                other worker processes of your app.
 
         .. _Flask-SQLAlchemy: http://pythonhosted.org/Flask-SQLAlchemy/
         .. _Flask-Login: https://flask-login.readthedocs.org/
@@ -103,115 +180,485 @@ class SQLAlchemyBackend(BaseBackend):
         self.user = user
         self.user_id = user_id
         self.anon_user = anon_user or AnonymousUserMixin
-        self.cache = cache or FakeCache()
+        if cache is None:
+            cache = LocalCache()
+            if negative_cache_timeout is None:
+                negative_cache_timeout = False
+        self.cache = cache
+        self.cache_timeout = cache_timeout
+        self.negative_cache_timeout = negative_cache_timeout
+
+    def resolve_identity(self, blueprint, user=None, user_id=None, fresh=False):
+        """
+        Work out which user an OAuth token belongs to. The ``user`` and
+        ``user_id`` arguments take precedence, followed by the ``user`` and
+        ``user_id`` passed to this backend, followed by the ``user`` and
+        ``user_id`` keys in the blueprint's :attr:`config`.
+
+        Resolving a user proxy, like Flask-Login's ``current_user``, can be
+        expensive, so when neither ``user`` nor ``user_id`` is passed, the
+        result is remembered on :data:`flask.g` for the rest of the request.
+        It is forgotten if the blueprint's config changes, or if a user logs
+        in or out with Flask-Login. Pass ``fresh=True`` to skip the
+        remembered result.
 
-    def make_cache_key(self, blueprint, user=None, user_id=None):
+        :rtype: :class:`Identity`
+        """
+        if user is not None or user_id is not None or not flask.has_request_context():
+            return self._resolve_identity(blueprint, user, user_id)
+
+        memo = getattr(flask.g, "flask_dance_identities", None)
+        if memo is None:
+            memo = flask.g.flask_dance_identities = {}
+        request = flask.request._get_current_object()
+        config_user_id = blueprint.config.get("user_id")
+        config_user = blueprint.config.get("user")
+        key = (id(self), blueprint.name)
+        entry = memo.get(key)
+        if (not fresh and entry and entry[0] is request and
+                entry[1] == config_user_id and entry[2] is config_user):
+            return entry[3]
+        identity = self._resolve_identity(blueprint)
+        memo[key] = (request, config_user_id, config_user, identity)
+        return identity
+
+    def _resolve_identity(self, blueprint, user=None, user_id=None):
         uid = first([user_id, self.user_id, blueprint.config.get("user_id")])
+        if uid and hasattr(self.model, "user_id"):
+            # no need to resolve the user object
+            return Identity(user=None, user_id=uid)
+        u = first(_get_real_user(ref, self.anon_user)
+                  for ref in (user, self.user, blueprint.config.get("user")))
+        return Identity(user=u, user_id=uid)
+
+    def make_cache_key(self, blueprint, user=None, user_id=None, identity=None):
+        if identity is None:
+            identity = self.resolve_identity(blueprint, user=user, user_id=user_id)
+        uid = identity.user_id
         if not uid:
-            u = first(_get_real_user(ref, self.anon_user)
-                      for ref in (user, self.user, blueprint.config.get("user")))
-            uid = getattr(u, "id", u)
+            uid = getattr(identity.user, "id", identity.user)
         return "flask_dance_token|{name}|{user_id}".format(
-            name=blueprint.name, user_id=uid,
+            name=blueprint.token_namespace, user_id=uid,
         )
 
-    def get(self, blueprint, user=None, user_id=None):
-        # check cache
-        cache_key = self.make_cache_key(blueprint=blueprint, user=user, user_id=user_id)
-        token = self.cache.get(cache_key)
-        if token:
-            return token
-
-        # if not cached, make database queries
+    def _query(self, blueprint, identity, entity=None):
+        if entity is None:
+            entity = self.model
         query = (
-            self.session.query(self.model)
-            .filter_by(provider=blueprint.name)
+            self.session.query(entity)
+            .filter_by(provider=blueprint.token_namespace)
         )
-        uid = first([user_id, self.user_id, blueprint.config.get("user_id")])
-        u = first(_get_real_user(ref, self.anon_user)
-                  for ref in (user, self.user, blueprint.config.get("user")))
         # check for user ID
-        if hasattr(self.model, "user_id") and uid:
-            query = query.filter_by(user_id=uid)
+        if hasattr(self.model, "user_id") and identity.user_id:
+            query = query.filter_by(user_id=identity.user_id)
         # check for user (relationship property)
-        elif hasattr(self.model, "user") and u:
-            query = query.filter_by(user=u)
+        elif hasattr(self.model, "user") and identity.user:
+            query = query.filter_by(user=identity.user)
         # if we have the property, but not value, filter by None
         elif hasattr(self.model, "user_id"):
             query = query.filter_by(user_id=None)
-        # run query
+        return query
+
+    def get(self, blueprint, user=None, user_id=None):
+        identity = self.resolve_identity(blueprint, user=user, user_id=user_id)
+        # check cache
+        cache_key = self.make_cache_key(blueprint, identity=identity)
+        token = self.cache.get(cache_key)
+        if token is NO_TOKEN:
+            return None
+        if token:
+            return token
+
+        # if not cached, make database queries. Only the token column is
+        # loaded, so no model instances are added to the session.
+        query = self._query(blueprint, identity, self.model.token)
         try:
             token = query.one().token
         except NoResultFound:
             token = None
 
         # cache the result
-        self.cache.set(cache_key, token)
+        if token is None:
+            if self.negative_cache_timeout is not False:
+                self.cache.set(cache_key, NO_TOKEN,
+                               timeout=self.negative_cache_timeout)
+        elif self.cache_timeout is not False:
+            timeout = self.cache_timeout
+            if timeout is None:
+                timeout = getattr(self.cache, "default_timeout", None)
+            # an expired token is about to be refreshed, so don't cache it
+            timeout = token_cache_timeout(token, timeout)
+            if timeout is not False:
+                self.cache.set(cache_key, token, timeout=timeout)
 
         return token
 
     def set(self, blueprint, token, user=None, user_id=None):
-        # if there was an existing model, delete it
-        existing_query = (
-            self.session.query(self.model)
-            .filter_by(provider=blueprint.name)
+        # writes must never go to the wrong user, so don't trust a
+        # remembered identity here
+        identity = self.resolve_identity(
+            blueprint, user=user, user_id=user_id, fresh=True,
         )
-        # check for user ID
+        uid, u = identity.user_id, identity.user
         has_user_id = hasattr(self.model, "user_id")
-        if has_user_id:
-            uid = first([user_id, self.user_id, blueprint.config.get("user_id")])
-            if uid:
-                existing_query = existing_query.filter_by(user_id=uid)
-        # check for user (relationship property)
         has_user = hasattr(self.model, "user")
-        if has_user:
-            u = first(_get_real_user(ref, self.anon_user)
-                      for ref in (user, self.user, blueprint.config.get("user")))
-            if u:
-                existing_query = existing_query.filter_by(user=u)
-        # queue up delete query -- won't be run until commit()
-        existing_query.delete()
-        # create a new model for this token
-        kwargs = {
-            "provider": blueprint.name,
-            "token": token,
-        }
+        values = {"token": token}
+        if hasattr(self.model, "created_at"):
+            values["created_at"] = datetime.utcnow()
+        if hasattr(self.model, "expires_at"):
+            values["expires_at"] = _expires_at(token)
+
+        upsert = None
         if has_user_id and uid:
-            kwargs["user_id"] = uid
-        if has_user and u:
-            kwargs["user"] = u
-        self.session.add(self.model(**kwargs))
-        # commit to delete and add simultaneously
+            upsert = self._upsert_statement(dict(
+                values, provider=blueprint.token_namespace, user_id=uid,
+            ))
+        if upsert is not None:
+            self.session.execute(upsert)
+        else:
+            # update the existing model in place, if there is one
+            updated = self._query(blueprint, identity).update(
+                values, synchronize_session=False,
+            )
+            if not updated:
+                # create a new model for this token
+                kwargs = dict(values, provider=blueprint.token_namespace)
+                if has_user_id and uid:
+                    kwargs["user_id"] = uid
+                if has_user and u:
+                    kwargs["user"] = u
+                self.session.add(self.model(**kwargs))
         self.session.commit()
         # invalidate cache
-        self.cache.delete(self.make_cache_key(
-            blueprint=blueprint, user=user, user_id=user_id
-        ))
+        self.cache.delete(self.make_cache_key(blueprint, identity=identity))
 
-    def delete(self, blueprint, user=None, user_id=None):
+    def _upsert_statement(self, values):
+        """
+        Build a single INSERT statement that updates the existing row for
+        this provider and user on conflict, if the database supports it and
+        the model has a unique index on ``provider`` and ``user_id``.
+        Otherwise, return ``None``.
+        """
+        stmt = self._upsert_insert(list(values))
+        if stmt is None:
+            return None
+        return stmt.values(**values)
+
+    def _upsert_insert(self, columns):
+        """
+        The upsert from :meth:`_upsert_statement`, without any values, so
+        that it can be executed with many rows of ``columns`` at once.
+        """
+        table = self.model.__table__
+        dialect = self._get_bind().dialect.name
+        update_cols = [key for key in columns if key not in ("provider", "user_id")]
+        stmt = None
+        try:
+            if dialect in ("postgresql", "sqlite"):
+                if dialect == "postgresql":
+                    from sqlalchemy.dialects.postgresql import insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert
+                stmt = insert(table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["provider", "user_id"],
+                    set_={key: getattr(stmt.excluded, key) for key in update_cols},
+                )
+            elif dialect == "mysql":
+                from sqlalchemy.dialects.mysql import insert
+                stmt = insert(table)
+                stmt = stmt.on_duplicate_key_update(
+                    **{key: getattr(stmt.inserted, key) for key in update_cols}
+                )
+        except (ImportError, AttributeError):
+            # this version of SQLAlchemy doesn't support upserts
+            # for this database
+            return None
+        if stmt is None or not self._has_unique_user_key():
+            return None
+        return stmt
+
+    def _get_bind(self):
+        try:
+            return self.session.get_bind(self.model.__mapper__)
+        except TypeError:
+            # Flask-SQLAlchemy 2.x sessions don't accept the arguments that
+            # SQLAlchemy 1.4's scoped_session passes on to get_bind()
+            return self.session.bind
+
+    def _has_unique_user_key(self):
+        """
+        Whether the table in the database has a unique index on
+        ``provider`` and ``user_id``. Upserts need one, and tables created
+        before the model declared it don't have it until they are migrated,
+        so this asks the database rather than the model. The answer is
+        remembered for the life of the backend.
+        """
+        if not hasattr(self, "_unique_user_key"):
+            wanted = set(["provider", "user_id"])
+            table = self.model.__table__
+            try:
+                inspector = inspect(self._get_bind())
+                candidates = [
+                    idx for idx in inspector.get_indexes(table.name, schema=table.schema)
+                    if idx.get("unique")
+                ]
+                candidates.extend(inspector.get_unique_constraints(
+                    table.name, schema=table.schema,
+                ))
+            except (SQLAlchemyError, NotImplementedError):
+                candidates = []
+            self._unique_user_key = any(
+                set(cand["column_names"]) == wanted for cand in candidates
+            )
+        return self._unique_user_key
+
+    def get_many(self, blueprint, user_ids, batch_size=500):
+        """
+        Look up the tokens of many users at once, with one
+        ``SELECT ... WHERE user_id IN (...)`` query for every ``batch_size``
+        users, and return a dict that maps the ID of each user who has a
+        token to their token. The keys are the user IDs as they are stored
+        in the database. Tokens are read straight from the database, and
+        aren't cached, so that a bulk job doesn't push the tokens of active
+        users out of the cache.
+
+        The model must have a ``user_id`` column; otherwise, each user is
+        looked up separately.
+        """
+        if not hasattr(self.model, "user_id"):
+            return super(SQLAlchemyBackend, self).get_many(blueprint, user_ids)
+        user_ids = list(user_ids)
+        tokens = {}
+        for start in range(0, len(user_ids), batch_size):
+            chunk = user_ids[start:start + batch_size]
+            query = self._query_users(
+                blueprint, chunk, self.model.user_id, self.model.token,
+            )
+            for uid, token in query:
+                if token:
+                    tokens[uid] = token
+        return tokens
+
+    def set_many(self, blueprint, tokens, batch_size=1000):
+        """
+        Store the tokens of many users at once, for imports and backfills.
+        ``tokens`` is a dict that maps user IDs to tokens, or an iterable of
+        ``(user_id, token)`` pairs.
+
+        Tokens are written ``batch_size`` at a time, each batch in its own
+        transaction: with a single upsert statement executed for every row
+        of the batch, where the database supports it, or otherwise with one
+        ``DELETE`` of the batch's existing rows followed by one ``INSERT``
+        executed for every row. The cached tokens of each batch are then
+        invalidated with a single ``delete_many`` call, if the cache has one.
+
+        The model must have a ``user_id`` column; otherwise, each token is
+        stored separately.
+        """
+        if not hasattr(self.model, "user_id"):
+            return super(SQLAlchemyBackend, self).set_many(blueprint, tokens)
+        if hasattr(tokens, "items"):
+            tokens = tokens.items()
+        has_created_at = hasattr(self.model, "created_at")
+        has_expires_at = hasattr(self.model, "expires_at")
+        columns = ["provider", "user_id", "token"]
+        if has_created_at:
+            columns.append("created_at")
+        if has_expires_at:
+            columns.append("expires_at")
+        upsert = self._upsert_insert(columns)
+        provider = blueprint.token_namespace
+
+        for chunk in _chunks(tokens, batch_size):
+            # the last token for a user wins, as it would with set()
+            by_user = OrderedDict(chunk)
+            now = datetime.utcnow()
+            rows = []
+            for uid, token in by_user.items():
+                row = {"provider": provider, "user_id": uid, "token": token}
+                if has_created_at:
+                    row["created_at"] = now
+                if has_expires_at:
+                    row["expires_at"] = _expires_at(token)
+                rows.append(row)
+            try:
+                if upsert is not None:
+                    self.session.execute(upsert, rows)
+                else:
+                    self._query_users(blueprint, list(by_user)).delete(
+                        synchronize_session=False,
+                    )
+                    self.session.execute(self.model.__table__.insert(), rows)
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+            self._invalidate_many(blueprint, by_user)
+
+    def delete_many(self, blueprint, user_ids, batch_size=1000):
+        """
+        Delete the tokens of many users at once, with one
+        ``DELETE ... WHERE user_id IN (...)`` statement and one transaction
+        for every ``batch_size`` users. The cached tokens of each batch are
+        invalidated with a single ``delete_many`` call, if the cache has one.
+
+        The model must have a ``user_id`` column; otherwise, each token is
+        deleted separately.
+        """
+        if not hasattr(self.model, "user_id"):
+            return super(SQLAlchemyBackend, self).delete_many(blueprint, user_ids)
+        for chunk in _chunks(user_ids, batch_size):
+            try:
+                self._query_users(blueprint, chunk).delete(synchronize_session=False)
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+            self._invalidate_many(blueprint, chunk)
+
+    def _query_users(self, blueprint, user_ids, *entities):
+        return (
+            self.session.query(*(entities or [self.model]))
+            .filter_by(provider=blueprint.token_namespace)
+            .filter(self.model.user_id.in_(user_ids))
+        )
+
+    def _invalidate_many(self, blueprint, user_ids):
+        delete_many(self.cache, [
+            self.make_cache_key(blueprint, user_id=uid) for uid in user_ids
+        ])
+
+    def iter_tokens(self, blueprint, batch_size=1000):
+        """
+        Yield a ``(user_id, token)`` pair for every token from this
+        blueprint's provider. Rows are fetched ``batch_size`` at a time,
+        with a server-side cursor on databases that support one, so memory
+        use doesn't grow with the number of tokens. ``user_id`` is ``None``
+        if the model has no ``user_id`` column, or the token doesn't belong
+        to a user.
+        """
+        return self._iter_tokens(blueprint, batch_size)
+
+    def _iter_tokens(self, blueprint, batch_size, *criteria):
+        has_user_id = hasattr(self.model, "user_id")
+        if has_user_id:
+            entities = (self.model.user_id, self.model.token)
+        else:
+            entities = (self.model.token,)
         query = (
-            self.session.query(self.model)
-            .filter_by(provider=blueprint.name)
+            self.session.query(*entities)
+            .filter_by(provider=blueprint.token_namespace)
+            .filter(*criteria)
+            .yield_per(batch_size)
         )
-        uid = first([user_id, self.user_id, blueprint.config.get("user_id")])
-        u = first(_get_real_user(ref, self.anon_user)
-                  for ref in (user, self.user, blueprint.config.get("user")))
-        # check for user ID
-        if hasattr(self.model, "user_id") and uid:
-            query = query.filter_by(user_id=uid)
-        # check for user (relationship property)
-        elif hasattr(self.model, "user") and u:
-            query = query.filter_by(user=u)
-        # if we have the property, but not value, filter by None
-        elif hasattr(self.model, "user_id"):
-            query = query.filter_by(user_id=None)
-        # run query
+        for row in query:
+            if row.token:
+                yield (row.user_id if has_user_id else None), row.token
+
+    def expiring_tokens(self, blueprint, before):
+        """
+        Yield a ``(user_id, token)`` pair for every token from this
+        blueprint's provider that expires before the ``before`` timestamp
+        and has a refresh token, so that it can be refreshed ahead of time.
+
+        If the model has an ``expires_at`` column, only the rows that expire
+        before ``before`` are read. Otherwise, every token from this
+        blueprint's provider is read with :meth:`iter_tokens`, in batches,
+        and checked in Python, so each scan costs a full read of the
+        provider's tokens. Add the column (see
+        :class:`OAuthConsumerMixin`) if you have many tokens.
+
+        Tokens that don't belong to a user are only included if this backend
+        isn't configured to look up tokens for a particular user, since they
+        couldn't be stored again otherwise.
+        """
+        allow_no_user = self.user is None and self.user_id is None
+        if hasattr(self.model, "expires_at"):
+            column = self.model.expires_at
+            tokens = self._iter_tokens(
+                blueprint, 1000, column.isnot(None), column < before,
+            )
+        else:
+            tokens = self.iter_tokens(blueprint)
+        for uid, token in tokens:
+            if uid is None and not allow_no_user:
+                continue
+            if not token.get("refresh_token"):
+                continue
+            expires_at = token.get("expires_at")
+            if expires_at and float(expires_at) < before:
+                yield uid, token
+
+    @contextmanager
+    def refresh_lock(self, blueprint, user=None, user_id=None):
+        """
+        Lock the row that stores the token with ``SELECT ... FOR UPDATE``
+        while it is refreshed, and yield the token that is stored in the
+        database, bypassing the cache. Other processes that try to refresh
+        the same token wait until the transaction ends, and then see the
+        refreshed token. Databases that don't support row locks, like SQLite,
+        ignore the lock.
+        """
+        identity = self.resolve_identity(
+            blueprint, user=user, user_id=user_id, fresh=True,
+        )
+        query = self._query(blueprint, identity, self.model.token)
+        row = query.with_for_update().first()
+        try:
+            yield row.token if row else None
+        except Exception:
+            self.session.rollback()
+            raise
+        else:
+            self.session.commit()
+
+    def delete(self, blueprint, user=None, user_id=None):
+        identity = self.resolve_identity(
+            blueprint, user=user, user_id=user_id, fresh=True,
+        )
+        query = self._query(blueprint, identity)
         query.delete()
         self.session.commit()
         # invalidate cache
-        self.cache.delete(self.make_cache_key(
-            blueprint=blueprint, user=user, user_id=user_id,
-        ))
+        self.cache.delete(self.make_cache_key(blueprint, identity=identity))
+
+
+class Identity(namedtuple("Identity", ["user", "user_id"])):
+    """
+    The user that an OAuth token belongs to, as worked out by
+    :meth:`SQLAlchemyBackend.resolve_identity`. ``user`` is a real user
+    object rather than a proxy, and ``user_id`` is an identifier for the user.
+    Either may be ``None``.
+    """
+    __slots__ = ()
+
+
+def _forget_identities(sender, **kwargs):
+    """
+    Receiver for Flask-Login's ``user_logged_in`` and ``user_logged_out``
+    signals: the current user has changed, so identities remembered for this
+    request are no longer valid.
+    """
+    if flask.has_app_context():
+        flask.g.flask_dance_identities = {}
+
+
+def _expires_at(token):
+    """
+    The ``expires_at`` timestamp of ``token``, as a float, or ``None``.
+    """
+    expires_at = token.get("expires_at") if token else None
+    return float(expires_at) if expires_at else None
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 def _get_real_user(user, anon_user=None):
@@ -233,3 +680,12 @@ def _get_real_user(user, anon_user=None):
     if anon_user and isinstance(user, anon_user):
         return None
     return user
+
+
+if user_logged_in is not None:
+    try:
+        user_logged_in.connect(_forget_identities, weak=False)
+        user_logged_out.connect(_forget_identities, weak=False)
+    except RuntimeError:
+        # signals require blinker, which isn't installed
+        pass
@@ -1,25 +1,107 @@
 from __future__ import unicode_literals, print_function
 
 import six
+import weakref
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
 from lazy import lazy
 from abc import ABCMeta, abstractmethod, abstractproperty
 from distutils.version import StrictVersion
 import flask
 from flask.signals import Namespace
+from flask.globals import _lookup_app_object, _request_ctx_stack
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+from urlobject import URLObject
 from flask_dance.consumer.backend.session import SessionBackend
-from flask_dance.utils import Dictective, getattrd
+from flask_dance.consumer.resilience import (
+    DEFAULT_TIMEOUT, JitteredRetry, CircuitBreaker,
+)
+from flask_dance.utils import Dictective, getattrd, local_lazy
 
 
 _signals = Namespace()
 oauth_authorized = _signals.signal('oauth-authorized')
 oauth_error = _signals.signal('oauth-error')
+oauth_span = _signals.signal('oauth-span')
+# blinker updates this dict in place as receivers are connected; it's
+# empty if blinker isn't installed
+_span_receivers = getattr(oauth_span, "receivers", {})
+
+
+class Span(object):
+    """
+    Times one phase of the OAuth dance, or one call to the token backend,
+    and sends the :data:`oauth_span` signal when the phase is over. The
+    ``status`` is ``"ok"``, or ``"error"`` if the phase raised an exception,
+    unless the code being timed sets ``status`` (and ``error``) itself.
+    Blueprints create spans with
+    :meth:`~BaseOAuthConsumerBlueprint.span`.
+    """
+    def __init__(self, blueprint, phase, url=None):
+        self.blueprint = blueprint
+        self.phase = phase
+        self.url = url
+        self.status = None
+        self.error = None
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = default_timer() - self.start
+        status = self.status or ("error" if exc_type else "ok")
+        oauth_span.send(self.blueprint,
+            phase=self.phase,
+            duration=duration,
+            status=status,
+            host=self.blueprint.provider_host(self.url),
+            error=exc_value if exc_type else self.error,
+        )
+
+
+class _NullSpan(object):
+    """
+    Stands in for a :class:`Span` when nothing is connected to
+    :data:`oauth_span`, so that uninstrumented applications don't pay for
+    timing. Anything set on it is ignored.
+    """
+    status = error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+def lookup_blueprint_session(name):
+    """
+    Look up the blueprint stored on the current application context under
+    ``name``, and return its :attr:`session`. This is meant to be wrapped in a
+    :class:`~werkzeug.local.LocalProxy`, so that the session (and the token
+    it loads from the backend) is only built the first time the proxy is
+    actually used during a request, rather than on every request.
+    """
+    return _lookup_app_object(name).session
 
 
 class BaseOAuthConsumerBlueprint(six.with_metaclass(ABCMeta, flask.Blueprint)):
     def __init__(self, name, import_name,
             static_folder=None, static_url_path=None, template_folder=None,
             url_prefix=None, subdomain=None, url_defaults=None, root_path=None,
-            login_url=None, authorized_url=None, backend=None):
+            login_url=None, authorized_url=None, backend=None,
+            pool_maxsize=None, http_cache=None, rate_limit=None,
+            timeout=None, retries=None, circuit_breaker=None,
+            tenants=None):
 
         bp_kwargs = dict(
             name=name,
@@ -58,9 +140,33 @@ class BaseOAuthConsumerBlueprint(six.with_metaclass(ABCMeta, flask.Blueprint)):
         else:
             self.backend = backend
 
+        self.pool_maxsize = pool_maxsize or DEFAULT_POOLSIZE
+        self.http_cache = http_cache
+        self.rate_limit = rate_limit
+        self.timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+        self.retries = JitteredRetry() if retries is None else retries
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker or None
+        self._transport = None
+        self._transport_lock = threading.Lock()
+        self._provider_hosts = {}
+        # httpx clients for async sessions, one per event loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.tenants = tenants
+        self._tenant_resolver = None
+        # tenants chosen with use_tenant(), innermost last
+        self._tenant_local = threading.local()
+
         self.logged_in_funcs = []
-        self.from_config = {}
-        self.config = Dictective(lambda d: lazy.invalidate(self.session, "token"))
+        self.from_config = Dictective(lambda d: self.forget_config())
+        self.watch_config = False
+        self.config = Dictective(lambda d: self.invalidate_token())
+        # the app whose config was last loaded, the values loaded from it,
+        # and the dotpaths that have to be set again for every request
+        self._config_app = None
+        self._config_values = ()
+        self._config_paths = ()
         self.before_app_request(self.load_config)
 
     def load_config(self):
@@ -74,32 +180,233 @@ class BaseOAuthConsumerBlueprint(six.with_metaclass(ABCMeta, flask.Blueprint)):
 
             blueprint.from_config["session.client_id"] = "GITHUB_OAUTH_CLIENT_ID"
 
+        This runs before every request, but the app config is only read the
+        first time for each app: after that, only dotpaths are set again,
+        because the objects they point to, like the :attr:`session`, are
+        created anew for every request. Call :meth:`reload_config` after
+        changing the app config, or set :attr:`watch_config` to ``True``
+        to check the app config for changes on every request.
+        """
+        app = flask.current_app._get_current_object()
+        if app is not self._config_app:
+            self.reload_config(app)
+            return
+        if self.watch_config and self._read_config(app) != self._config_values:
+            self.reload_config(app)
+            return
+        for body, tail, value in self._config_paths:
+            setattr(getattrd(self, body), tail, value)
+
+    def reload_config(self, app=None):
+        """
+        Load the variables in ``from_config`` from the config of ``app``, or
+        of the current app, right now.
+        """
+        if app is None:
+            app = flask.current_app._get_current_object()
+        values = self._read_config(app)
+        paths = []
+        for local_var, value in values:
+            if "." in local_var:
+                # this is a dotpath -- needs special handling
+                body, tail = local_var.rsplit(".", 1)
+                setattr(getattrd(self, body), tail, value)
+                paths.append((body, tail, value))
+            else:
+                # just use a normal setattr call
+                setattr(self, local_var, value)
+        self._config_values = values
+        self._config_paths = tuple(paths)
+        self._config_app = app
+
+    def forget_config(self):
+        """
+        Make the next request load the variables in ``from_config`` from the
+        app config again. This is called whenever ``from_config`` changes.
         """
-        for local_var, config_var in self.from_config.items():
-            value = flask.current_app.config.get(config_var)
+        self._config_app = None
+
+    def _read_config(self, app):
+        values = []
+        for local_var, config_var in sorted(self.from_config.items()):
+            value = app.config.get(config_var)
             if value:
-                if "." in local_var:
-                    # this is a dotpath -- needs special handling
-                    body, tail = local_var.rsplit(".", 1)
-                    obj = getattrd(self, body)
-                    setattr(obj, tail, value)
-                else:
-                    # just use a normal setattr call
-                    setattr(self, local_var, value)
+                values.append((local_var, value))
+        return tuple(values)
+
+    def tenant_resolver(self, func):
+        """
+        A decorator for the function that picks the tenant for the current
+        request. The function takes no arguments, and returns the ID of a
+        tenant in :attr:`tenants`, or ``None`` to use the blueprint's own
+        settings. It's called at most once per request, the first time a
+        setting that tenants can override is needed::
+
+            @blueprint.tenant_resolver
+            def resolve_tenant():
+                return request.headers.get("X-Tenant")
+
+        """
+        self._tenant_resolver = func
+        return func
+
+    @property
+    def current_tenant(self):
+        """
+        The :class:`~flask_dance.consumer.tenants.Tenant` for the current
+        request, or ``None``. Raises
+        :class:`~flask_dance.consumer.tenants.UnknownTenant` if the tenant
+        resolver returns a tenant that isn't in :attr:`tenants`.
+        """
+        if self.tenants is None:
+            return None
+        chosen = getattr(self._tenant_local, "stack", None)
+        if chosen:
+            return chosen[-1]
+        ctx = _request_ctx_stack.top
+        if ctx is None or self._tenant_resolver is None:
+            return None
+        memo = getattr(ctx, "flask_dance_tenants", None)
+        if memo is None:
+            memo = ctx.flask_dance_tenants = {}
+        try:
+            return memo[self.name]
+        except KeyError:
+            tenant_id = self._tenant_resolver()
+            tenant = None if tenant_id is None else self.tenants.get(tenant_id)
+            memo[self.name] = tenant
+            return tenant
+
+    @contextmanager
+    def use_tenant(self, tenant_id):
+        """
+        A context manager that makes ``tenant_id`` the current tenant in
+        this thread, whatever the tenant resolver says. Use it to work with
+        a tenant's tokens outside of a request, for instance in a background
+        job. Pass ``None`` to use the blueprint's own settings.
+        """
+        if self.tenants is None:
+            raise ValueError("{} has no tenants".format(self.name))
+        tenant = None if tenant_id is None else self.tenants.get(tenant_id)
+        stack = getattr(self._tenant_local, "stack", None)
+        if stack is None:
+            stack = self._tenant_local.stack = []
+        stack.append(tenant)
+        # sessions built before now have the wrong tenant's settings
+        self._forget_sessions()
+        try:
+            yield tenant
+        finally:
+            stack.pop()
+            self._forget_sessions()
+
+    def _forget_sessions(self):
+        local_lazy.invalidate(self, "session")
+        local_lazy.invalidate(self, "async_session")
+
+    @property
+    def token_namespace(self):
+        """
+        The name that backends store this blueprint's tokens under: the
+        name of the blueprint, followed by ``:`` and the ID of the current
+        tenant, if there is one. Each tenant's tokens are kept apart, even
+        for the same user.
+        """
+        tenant = self.current_tenant
+        if tenant is None:
+            return self.name
+        return "{}:{}".format(self.name, tenant.id)
+
+    def span(self, phase, url=None):
+        """
+        Return a context manager that times ``phase``, such as ``"login"``
+        or ``"backend.get"``, and sends :data:`oauth_span` when it's over.
+        ``url`` is the URL of the OAuth provider that the phase talks to,
+        if any. If nothing is connected to :data:`oauth_span`, nothing is
+        timed or sent.
+        """
+        if not _span_receivers:
+            return _null_span
+        return Span(self, phase, url)
+
+    def provider_host(self, url=None):
+        """
+        The host of ``url``, resolved relative to the ``base_url`` of this
+        blueprint, or the host of the ``base_url`` itself if ``url`` isn't
+        given. ``None`` if neither is set.
+        """
+        base_url = getattr(self, "base_url", None)
+        key = (base_url, url)
+        try:
+            return self._provider_hosts[key]
+        except KeyError:
+            if url and base_url:
+                url = URLObject(base_url).relative(url)
+            host = URLObject(url or base_url or "").netloc or None
+            if len(self._provider_hosts) < 100:
+                self._provider_hosts[key] = host
+            return host
+
+    @property
+    def transport(self):
+        """
+        A :class:`requests.adapters.HTTPAdapter` that holds a pool of HTTP
+        connections for this blueprint. Unlike the :attr:`session`, which is
+        rebuilt for every request to your Flask application, the transport
+        lives as long as the blueprint does, so connections to the OAuth
+        provider can be reused across requests and threads. The transport
+        also retries failed requests, as configured by :attr:`retries`.
+        """
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    self._transport = HTTPAdapter(
+                        pool_maxsize=self.pool_maxsize,
+                        max_retries=self.retries or 0,
+                    )
+        return self._transport
+
+    def mount_transport(self, session):
+        """
+        Mount this blueprint's :attr:`transport` on a Requests session, so
+        that the session sends its requests over the shared connection pool.
+        """
+        session.mount("https://", self.transport)
+        session.mount("http://", self.transport)
+        return session
 
     @property
     def token(self):
-        return self.backend.get(self)
+        if not _span_receivers:
+            # this runs on every request, so skip the span entirely
+            return self.backend.get(self)
+        with Span(self, "backend.get") as span:
+            token = self.backend.get(self)
+            if token is None:
+                span.status = "miss"
+        return token
 
     @token.setter
     def token(self, value):
-        self.backend.set(self, value)
-        lazy.invalidate(self.session, "token")
+        with self.span("backend.set"):
+            self.backend.set(self, value)
+        self.invalidate_token()
 
     @token.deleter
     def token(self):
-        self.backend.delete(self)
+        with self.span("backend.delete"):
+            self.backend.delete(self)
+        self.invalidate_token()
+
+    def invalidate_token(self):
+        """
+        Make the sessions load the token from the backend again the next
+        time they need it.
+        """
         lazy.invalidate(self.session, "token")
+        async_session = local_lazy.peek(self, "async_session")
+        if async_session is not None:
+            lazy.invalidate(async_session, "token")
 
     @abstractproperty
     def session(self):
@@ -0,0 +1,141 @@
+from __future__ import unicode_literals
+
+import json
+import hashlib
+import threading
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from flask_dance.utils import LocalCache
+
+
+# response headers that describe the body, and should be served with it
+BODY_HEADERS = ("Content-Type", "Content-Language", "Link")
+
+
+class ConditionalCache(object):
+    """
+    An opt-in cache for the responses of GET requests to the OAuth
+    provider's API, that uses HTTP validators to avoid downloading the same
+    response body twice. Pass one to a blueprint to enable it::
+
+        blueprint = make_github_blueprint(http_cache=ConditionalCache())
+
+    When a response has an ``ETag`` or ``Last-Modified`` header, its
+    validators and body are stored. The next GET request for the same URL
+    with the same token sends ``If-None-Match`` or ``If-Modified-Since``,
+    and if the provider answers with ``304 Not Modified``, the session
+    returns the stored body with a ``200`` status instead. Many providers,
+    including GitHub, don't count such requests against your rate limit.
+
+    The ``hits``, ``misses`` and ``bytes_saved`` attributes count how many
+    requests were answered from the cache, how many were not, and how many
+    bytes of response body the provider didn't have to send.
+    """
+    def __init__(self, store=None, maxsize=1000):
+        """
+        Args:
+            store: Where to keep responses: an instance of `Flask-Cache`_, or
+                any object with the same ``get``, ``set`` and ``delete``
+                methods. Defaults to a :class:`~flask_dance.utils.LocalCache`
+                that keeps ``maxsize`` responses in the memory of the current
+                process.
+            maxsize (int): The number of responses to keep in the default
+                store.
+
+        .. _Flask-Cache: http://pythonhosted.org/Flask-Cache/
+        """
+        if store is None:
+            store = LocalCache(maxsize=maxsize, default_timeout=0)
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, token, url):
+        """
+        The key to store a response under. Responses can differ between
+        users, so the key includes a hash of the token, rather than the
+        token itself.
+        """
+        token = token or {}
+        secret = token.get("access_token") or token.get("oauth_token") or ""
+        digest = hashlib.sha256(
+            json.dumps([secret, url]).encode("utf-8")
+        ).hexdigest()
+        return "flask_dance_http|{}".format(digest)
+
+    def send(self, send, request, token, **kwargs):
+        """
+        Send ``request`` by calling ``send``, and make it conditional if
+        there is a stored response for it.
+        """
+        if request.method != "GET" or kwargs.get("stream"):
+            return send(request, **kwargs)
+        if "If-None-Match" in request.headers or "If-Modified-Since" in request.headers:
+            # the caller is doing its own caching
+            return send(request, **kwargs)
+
+        key = self.make_key(token, request.url)
+        entry = self.store.get(key)
+        if entry is not None:
+            etag, last_modified = entry[0], entry[1]
+            if etag:
+                request.headers["If-None-Match"] = etag
+            if last_modified:
+                request.headers["If-Modified-Since"] = last_modified
+
+        response = send(request, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self._count(hits=1, bytes_saved=len(entry[4]))
+            return self.cached_response(entry, response)
+        self._count(misses=1)
+        if response.status_code == 200:
+            self.store_response(key, response)
+        return response
+
+    def store_response(self, key, response):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        cache_control = response.headers.get("Cache-Control", "")
+        if not (etag or last_modified) or "no-store" in cache_control:
+            return
+        headers = dict(
+            (name, response.headers[name])
+            for name in BODY_HEADERS if name in response.headers
+        )
+        self.store.set(key, (
+            etag, last_modified, response.status_code, headers, response.content,
+        ))
+
+    def cached_response(self, entry, not_modified):
+        """
+        Build the response to return for a ``304 Not Modified`` response,
+        from the stored response.
+        """
+        etag, last_modified, status, headers, content = entry
+        response = Response()
+        response.status_code = status
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(not_modified.headers)
+        response.headers.update(headers)
+        response.headers.pop("Transfer-Encoding", None)
+        response.headers["Content-Length"] = str(len(content))
+        response._content = content
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.connection = not_modified.connection
+        response.elapsed = not_modified.elapsed
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.history = not_modified.history
+        response.from_cache = True
+        return response
+
+    def _count(self, hits=0, misses=0, bytes_saved=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.bytes_saved += bytes_saved
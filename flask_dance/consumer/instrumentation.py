@@ -0,0 +1,173 @@
+"""
+Receivers for the :data:`~flask_dance.consumer.oauth_span` signal, which
+blueprints send for each phase of the OAuth dance and each call to their
+token backend. Blueprints only time these phases while something is
+connected to the signal, so instrumentation is free until you connect one
+of these observers (or your own receiver).
+"""
+from __future__ import unicode_literals, division
+
+import bisect
+import logging
+import threading
+
+from .base import oauth_span
+
+
+class Observer(object):
+    """
+    Base class for receivers of :data:`~flask_dance.consumer.oauth_span`.
+    Subclasses implement :meth:`observe`.
+    """
+    def connect(self, sender=None):
+        """
+        Start receiving spans, from every blueprint or only from ``sender``.
+        Requires the `blinker`_ library.
+
+        .. _blinker: http://pythonhosted.org/blinker/
+        """
+        kwargs = {"weak": False}
+        if sender is not None:
+            kwargs["sender"] = sender
+        oauth_span.connect(self, **kwargs)
+        return self
+
+    def disconnect(self, sender=None):
+        """
+        Stop receiving spans.
+        """
+        if sender is None:
+            oauth_span.disconnect(self)
+        else:
+            oauth_span.disconnect(self, sender=sender)
+
+    def __call__(self, blueprint, **kwargs):
+        self.observe(blueprint, **kwargs)
+
+    def observe(self, blueprint, phase, duration, status, host=None, error=None):
+        """
+        Called with the blueprint that sent the span, and the name of the
+        ``phase``, its ``duration`` in seconds, its ``status``, the ``host``
+        of the OAuth provider, and the ``error`` that ended it, if any.
+        """
+        raise NotImplementedError()
+
+
+class LoggingObserver(Observer):
+    """
+    Logs every span: spans with the ``"error"`` status at ``error_level``,
+    and all the others at ``level``.
+    """
+    def __init__(self, logger=None, level=logging.DEBUG, error_level=logging.WARNING):
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        elif not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.level = level
+        self.error_level = error_level
+
+    def observe(self, blueprint, phase, duration, status, host=None, error=None):
+        level = self.error_level if status == "error" else self.level
+        if not self.logger.isEnabledFor(level):
+            return
+        if error is not None:
+            self.logger.log(level, "%s %s %s in %.1f ms (host %s): %s",
+                blueprint.name, phase, status, duration * 1000, host, error,
+            )
+        else:
+            self.logger.log(level, "%s %s %s in %.1f ms (host %s)",
+                blueprint.name, phase, status, duration * 1000, host,
+            )
+
+
+def _escape(value):
+    return (
+        "{}".format(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
+
+
+class MetricsRegistry(Observer):
+    """
+    Keeps a histogram of span durations in memory, like a `Prometheus`_
+    histogram, with one series for each blueprint, phase, status and host.
+    :meth:`render` returns the histograms in the Prometheus text format,
+    so you can serve them from a view for Prometheus to scrape::
+
+        metrics = MetricsRegistry().connect()
+
+        @app.route("/metrics")
+        def show_metrics():
+            return metrics.render(), 200, {"Content-Type": "text/plain"}
+
+    .. _Prometheus: https://prometheus.io/
+    """
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    LABELS = ("blueprint", "phase", "status", "host")
+
+    def __init__(self, name="flask_dance_span_seconds", buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            name (str): The name of the histogram.
+            buckets: The upper bounds of the histogram buckets, in seconds.
+        """
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, blueprint, phase, duration, status, host=None, error=None):
+        labels = (blueprint.name, phase, status, host or "")
+        index = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += duration
+
+    def count(self, **labels):
+        """
+        The number of spans observed with the given label values, such as
+        ``count(phase="login", status="ok")``.
+        """
+        total = 0
+        with self._lock:
+            for key, series in self._series.items():
+                if all(key[self.LABELS.index(k)] == v for k, v in labels.items()):
+                    total += sum(series[:-1])
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """
+        Return the histograms in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP {} Time spent in each phase of the OAuth dance.".format(self.name),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        with self._lock:
+            series = sorted((key, list(value)) for key, value in self._series.items())
+        bounds = ["{!r}".format(float(b)) for b in self.buckets] + ["+Inf"]
+        for key, counts in series:
+            labels = ",".join(
+                '{}="{}"'.format(name, _escape(value))
+                for name, value in zip(self.LABELS, key)
+            )
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    self.name, labels, bound, cumulative,
+                ))
+            lines.append("{}_sum{{{}}} {!r}".format(self.name, labels, counts[-1]))
+            lines.append("{}_count{{{}}} {}".format(self.name, labels, cumulative))
+        return "\n".join(lines) + "\n"
@@ -1,19 +1,58 @@
 from __future__ import unicode_literals, print_function
 
-from lazy import lazy
+import logging
+import six
+import requests
 from flask import request, url_for, redirect
 from urlobject import URLObject
 from requests_oauthlib import OAuth1Session as BaseOAuth1Session
-from oauthlib.oauth1 import SIGNATURE_HMAC, SIGNATURE_TYPE_AUTH_HEADER
+from oauthlib.oauth1 import SIGNATURE_HMAC, SIGNATURE_RSA, SIGNATURE_TYPE_AUTH_HEADER
 from oauthlib.common import to_unicode
-from .base import BaseOAuthConsumerBlueprint, oauth_authorized
+from .base import BaseOAuthConsumerBlueprint, oauth_authorized, oauth_error
 from .requests import OAuth1Session
+from .signing import OAuth1Signer
+from .tenants import tenant_setting
+from flask_dance.utils import LocalCache, local_lazy
+
+log = logging.getLogger(__name__)
+
+
+def load_rsa_key(rsa_key):
+    """
+    Parse a PEM-encoded RSA private key into a key object from the
+    `cryptography`_ library, which oauthlib can sign requests with directly,
+    instead of parsing the PEM again for every signature. If the key can't
+    be parsed, or ``cryptography`` isn't installed, return it unchanged.
+
+    .. _cryptography: https://cryptography.io/
+    """
+    if not isinstance(rsa_key, (six.text_type, six.binary_type)):
+        return rsa_key
+    try:
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    except ImportError:
+        return rsa_key
+    data = rsa_key.encode("utf-8") if isinstance(rsa_key, six.text_type) else rsa_key
+    try:
+        return load_pem_private_key(data, password=None, backend=default_backend())
+    except (ValueError, TypeError) as exc:
+        log.debug("Couldn't parse RSA key, leaving it to oauthlib: %s", exc)
+        return rsa_key
 
 
 class OAuth1ConsumerBlueprint(BaseOAuthConsumerBlueprint):
     """
     A subclass of :class:`flask.Blueprint` that sets up OAuth 1 authentication.
     """
+    # settings that each tenant can override
+    client_key = tenant_setting("client_key")
+    client_secret = tenant_setting("client_secret")
+    base_url = tenant_setting("base_url")
+    request_token_url = tenant_setting("request_token_url")
+    authorization_url = tenant_setting("authorization_url")
+    access_token_url = tenant_setting("access_token_url")
+
     def __init__(self, name, import_name,
             client_key=None,
             client_secret=None,
@@ -36,6 +75,13 @@ class OAuth1ConsumerBlueprint(BaseOAuthConsumerBlueprint):
             redirect_to=None,
             session_class=None,
             backend=None,
+            pool_maxsize=None,
+            http_cache=None,
+            rate_limit=None,
+            timeout=None,
+            retries=None,
+            circuit_breaker=None,
+            tenants=None,
 
             **kwargs):
         """
@@ -90,6 +136,42 @@ class OAuth1ConsumerBlueprint(BaseOAuthConsumerBlueprint):
             backend: A storage backend class, or an instance of a storage
                 backend class, to use for this blueprint. Defaults to
                 :class:`~flask_dance.consumer.backend.session.SessionBackend`.
+            pool_maxsize (int): The maximum number of connections to keep
+                open to each host used by the OAuth provider. The connection
+                pool is shared by all requests to your Flask application.
+                Defaults to 10.
+            http_cache: A
+                :class:`~flask_dance.consumer.http_cache.ConditionalCache`
+                to make GET requests to the OAuth provider conditional,
+                so that unchanged responses aren't downloaded again.
+                Disabled by default.
+            rate_limit: A
+                :class:`~flask_dance.consumer.ratelimit.RateLimitTracker`
+                to pace requests so that they stay within the rate limits
+                that the OAuth provider reports. Disabled by default.
+            timeout: The default timeout for requests to the OAuth provider,
+                in seconds: either a single number, or a ``(connect, read)``
+                tuple. Defaults to ``(5, 30)``.
+            retries: How to retry requests to the OAuth provider that fail:
+                a number of retries, or a :class:`urllib3.util.retry.Retry`.
+                Defaults to a
+                :class:`~flask_dance.consumer.resilience.JitteredRetry`,
+                which retries idempotent requests up to twice.
+                Pass ``0`` to disable retries.
+            circuit_breaker: A
+                :class:`~flask_dance.consumer.resilience.CircuitBreaker`
+                that stops sending requests to the OAuth provider while it
+                keeps failing, or ``True`` for one with the default
+                settings. Disabled by default. Failures of any request to a
+                host count, so once the circuit opens, every user's
+                requests to that host fail until it closes again.
+            tenants: A :class:`~flask_dance.consumer.tenants.TenantRegistry`
+                of tenants that bring their own OAuth client credentials and
+                endpoints. Use :meth:`tenant_resolver` to pick the tenant
+                for each request. Tenants can override the ``client_key``,
+                ``client_secret``, ``base_url``, ``request_token_url``,
+                ``authorization_url``, ``access_token_url`` settings of the
+                blueprint.
         """
         BaseOAuthConsumerBlueprint.__init__(
             self, name, import_name,
@@ -101,6 +183,13 @@ class OAuth1ConsumerBlueprint(BaseOAuthConsumerBlueprint):
             login_url=login_url,
             authorized_url=authorized_url,
             backend=backend,
+            pool_maxsize=pool_maxsize,
+            http_cache=http_cache,
+            rate_limit=rate_limit,
+            timeout=timeout,
+            retries=retries,
+            circuit_breaker=circuit_breaker,
+            tenants=tenants,
         )
 
         self.base_url = base_url
@@ -112,6 +201,10 @@ class OAuth1ConsumerBlueprint(BaseOAuthConsumerBlueprint):
         self.signature_method = signature_method
         self.signature_type = signature_type
         self.rsa_key = rsa_key
+        self._parsed_rsa_key = (None, None)
+        self._signer = (None, None)
+        # each tenant's signer, keyed by tenant ID
+        self._tenant_signers = LocalCache(maxsize=1000, default_timeout=0)
         self.client_class = client_class
         self.force_include_body = force_include_body
         self.kwargs = kwargs
@@ -125,47 +218,151 @@ class OAuth1ConsumerBlueprint(BaseOAuthConsumerBlueprint):
 
         self.teardown_app_request(self.teardown_session)
 
-    @lazy
+    @property
+    def signing_key(self):
+        """
+        The :attr:`rsa_key`, parsed into a key object with
+        :func:`load_rsa_key`. It is parsed once, and shared by all the
+        sessions of this blueprint, until :attr:`rsa_key` changes.
+        Only used for the ``RSA-SHA1`` signature method.
+        """
+        rsa_key = self.rsa_key
+        if self.signature_method != SIGNATURE_RSA or not rsa_key:
+            return rsa_key
+        raw, parsed = self._parsed_rsa_key
+        if raw is not rsa_key and raw != rsa_key:
+            parsed = load_rsa_key(rsa_key)
+            # one assignment, so other threads see both halves or neither
+            self._parsed_rsa_key = (rsa_key, parsed)
+        return parsed
+
+    @property
+    def signer(self):
+        """
+        The :class:`~flask_dance.consumer.signing.OAuth1Signer` that the
+        sessions of this blueprint sign requests with. It is shared by all
+        requests and threads, and is only rebuilt when the client credentials
+        or signature settings of the blueprint change. Each tenant gets a
+        signer of its own.
+        """
+        params = (
+            self.client_key, self.client_secret, self.signature_method,
+            self.signature_type, self.signing_key, self.client_class,
+            self.force_include_body, dict(self.kwargs),
+        )
+        tenant = self.current_tenant
+        if tenant is None:
+            cached_params, signer = self._signer
+        else:
+            cached_params, signer = (
+                self._tenant_signers.get(tenant.id) or (None, None)
+            )
+        if params != cached_params:
+            signer = OAuth1Signer(
+                client_key=self.client_key,
+                client_secret=self.client_secret,
+                signature_method=self.signature_method,
+                signature_type=self.signature_type,
+                rsa_key=self.signing_key,
+                client_class=self.client_class,
+                force_include_body=self.force_include_body,
+                **self.kwargs
+            )
+            if tenant is None:
+                self._signer = (params, signer)
+            else:
+                self._tenant_signers.set(tenant.id, (params, signer))
+        return signer
+
+    @local_lazy
     def session(self):
-        return self.session_class(
+        ret = self.session_class(
+            client_key=self.client_key,
+            client_secret=self.client_secret,
+            signature_method=self.signature_method,
+            signature_type=self.signature_type,
+            rsa_key=self.signing_key,
+            client_class=self.client_class,
+            force_include_body=self.force_include_body,
+            blueprint=self,
+            base_url=self.base_url,
+            signer=self.signer,
+            **self.kwargs
+        )
+        return self.mount_transport(ret)
+
+    @local_lazy
+    def async_session(self):
+        """
+        An :class:`~flask_dance.consumer.aio.AsyncOAuth1Session` for calling
+        the OAuth provider's API from :mod:`asyncio` code. Requires Python 3.5
+        or newer, and HTTPX.
+        """
+        from .aio import AsyncOAuth1Session
+        return AsyncOAuth1Session(
             client_key=self.client_key,
             client_secret=self.client_secret,
             signature_method=self.signature_method,
             signature_type=self.signature_type,
-            rsa_key=self.rsa_key,
+            rsa_key=self.signing_key,
             client_class=self.client_class,
             force_include_body=self.force_include_body,
             blueprint=self,
             base_url=self.base_url,
+            signer=self.signer,
             **self.kwargs
         )
 
     def teardown_session(self, exception=None):
-        lazy.invalidate(self, "session")
+        local_lazy.invalidate(self, "session")
+        local_lazy.invalidate(self, "async_session")
 
     def login(self):
-        secure = request.is_secure or request.headers.get("X-Forwarded-Proto", "http") == "https"
-        callback_uri = url_for(
-            ".authorized", next=request.args.get('next'), _external=True,
-            _scheme="https" if secure else "http",
-        )
-        self.session._client.client.callback_uri = to_unicode(callback_uri)
-        self.session.fetch_request_token(self.request_token_url)
-        url = self.session.authorization_url(self.authorization_url)
-        return redirect(url)
+        with self.span("login", self.request_token_url) as span:
+            secure = request.is_secure or request.headers.get("X-Forwarded-Proto", "http") == "https"
+            callback_uri = url_for(
+                ".authorized", next=request.args.get('next'), _external=True,
+                _scheme="https" if secure else "http",
+            )
+            self.session._client.client.callback_uri = to_unicode(callback_uri)
+            try:
+                with self.span("fetch_request_token", self.request_token_url):
+                    self.session.fetch_request_token(self.request_token_url)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                span.status, span.error = "error", exc
+                return self.request_failed("request token", exc)
+            url = self.session.authorization_url(self.authorization_url)
+            return redirect(url)
 
     def authorized(self):
+        with self.span("authorized", self.access_token_url) as span:
+            self.session.parse_authorization_response(request.url)
+            try:
+                with self.span("fetch_token", self.access_token_url):
+                    token = self.session.fetch_access_token(self.access_token_url)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                span.status, span.error = "error", exc
+                return self.request_failed("access token", exc)
+            results = oauth_authorized.send(self, token=token) or []
+            if not any(ret == False for func, ret in results):
+                self.token = token
+            else:
+                span.status = "declined"
+            return redirect(self.next_url())
+
+    def next_url(self):
+        """
+        The URL to redirect the user to when the OAuth dance is over.
+        """
         if "next" in request.args:
-            next_url = request.args["next"]
+            return request.args["next"]
         elif self.redirect_url:
-            next_url = self.redirect_url
+            return self.redirect_url
         elif self.redirect_to:
-            next_url = url_for(self.redirect_to)
-        else:
-            next_url = "/"
-        self.session.parse_authorization_response(request.url)
-        token = self.session.fetch_access_token(self.access_token_url)
-        results = oauth_authorized.send(self, token=token) or []
-        if not any(ret == False for func, ret in results):
-            self.token = token
-        return redirect(next_url)
+            return url_for(self.redirect_to)
+        return "/"
+
+    def request_failed(self, what, exc):
+        log.warning("OAuth 1 %s request failed: %s", what, exc)
+        oauth_error.send(self, error=exc)
+        return redirect(self.next_url())
@@ -1,7 +1,7 @@
 from __future__ import unicode_literals, print_function
 
 import logging
-from lazy import lazy
+import requests
 import flask
 from flask import request, url_for, redirect
 from urlobject import URLObject
@@ -9,6 +9,9 @@ from .base import (
     BaseOAuthConsumerBlueprint, oauth_authorized, oauth_error
 )
 from .requests import OAuth2Session
+from .refresh import RefreshCoordinator
+from .tenants import tenant_setting
+from flask_dance.utils import local_lazy
 
 log = logging.getLogger(__name__)
 
@@ -17,6 +20,18 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
     """
     A subclass of :class:`flask.Blueprint` that sets up OAuth 2 authentication.
     """
+    # settings that each tenant can override
+    client_id = tenant_setting("client_id")
+    client_secret = tenant_setting("client_secret")
+    scope = tenant_setting("scope")
+    base_url = tenant_setting("base_url")
+    authorization_url = tenant_setting("authorization_url")
+    authorization_url_params = tenant_setting("authorization_url_params")
+    token_url = tenant_setting("token_url")
+    token_url_params = tenant_setting("token_url_params")
+    auto_refresh_url = tenant_setting("auto_refresh_url")
+    auto_refresh_kwargs = tenant_setting("auto_refresh_kwargs")
+
     def __init__(self, name, import_name,
             client_id=None,
             client_secret=None,
@@ -40,6 +55,13 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
             redirect_to=None,
             session_class=None,
             backend=None,
+            pool_maxsize=None,
+            http_cache=None,
+            rate_limit=None,
+            timeout=None,
+            retries=None,
+            circuit_breaker=None,
+            tenants=None,
 
             **kwargs):
         """
@@ -97,6 +119,43 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
             backend: A storage backend class, or an instance of a storage
                 backend class, to use for this blueprint. Defaults to
                 :class:`~flask_dance.consumer.backend.session.SessionBackend`.
+            pool_maxsize (int): The maximum number of connections to keep
+                open to each host used by the OAuth provider. The connection
+                pool is shared by all requests to your Flask application.
+                Defaults to 10.
+            http_cache: A
+                :class:`~flask_dance.consumer.http_cache.ConditionalCache`
+                to make GET requests to the OAuth provider conditional,
+                so that unchanged responses aren't downloaded again.
+                Disabled by default.
+            rate_limit: A
+                :class:`~flask_dance.consumer.ratelimit.RateLimitTracker`
+                to pace requests so that they stay within the rate limits
+                that the OAuth provider reports. Disabled by default.
+            timeout: The default timeout for requests to the OAuth provider,
+                in seconds: either a single number, or a ``(connect, read)``
+                tuple. Defaults to ``(5, 30)``.
+            retries: How to retry requests to the OAuth provider that fail:
+                a number of retries, or a :class:`urllib3.util.retry.Retry`.
+                Defaults to a
+                :class:`~flask_dance.consumer.resilience.JitteredRetry`,
+                which retries idempotent requests up to twice.
+                Pass ``0`` to disable retries.
+            circuit_breaker: A
+                :class:`~flask_dance.consumer.resilience.CircuitBreaker`
+                that stops sending requests to the OAuth provider while it
+                keeps failing, or ``True`` for one with the default
+                settings. Disabled by default. Failures of any request to a
+                host count, so once the circuit opens, every user's
+                requests to that host fail until it closes again.
+            tenants: A :class:`~flask_dance.consumer.tenants.TenantRegistry`
+                of tenants that bring their own OAuth client credentials and
+                endpoints. Use :meth:`tenant_resolver` to pick the tenant
+                for each request. Tenants can override the ``client_id``,
+                ``client_secret``, ``scope``, ``base_url``,
+                ``authorization_url``, ``authorization_url_params``,
+                ``token_url``, ``token_url_params``, ``auto_refresh_url``,
+                ``auto_refresh_kwargs`` settings of the blueprint.
         """
         BaseOAuthConsumerBlueprint.__init__(
             self, name, import_name,
@@ -108,6 +167,13 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
             login_url=login_url,
             authorized_url=authorized_url,
             backend=backend,
+            pool_maxsize=pool_maxsize,
+            http_cache=http_cache,
+            rate_limit=rate_limit,
+            timeout=timeout,
+            retries=retries,
+            circuit_breaker=circuit_breaker,
+            tenants=tenants,
         )
 
         self.base_url = base_url
@@ -131,9 +197,11 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
         self.redirect_url = redirect_url
         self.redirect_to = redirect_to
 
+        self.refresh_coordinator = RefreshCoordinator()
+
         self.teardown_app_request(self.teardown_session)
 
-    @lazy
+    @local_lazy
     def session(self):
         ret = self.session_class(
             client_id=self.client_id,
@@ -142,34 +210,62 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
             auto_refresh_kwargs=self.auto_refresh_kwargs,
             scope=self.scope,
             state=self.state,
-            token=self.token,
             blueprint=self,
             base_url=self.base_url,
             **self.kwargs
         )
         def token_updater(token):
-            self.token = token
+            # tokens refreshed through the refresh coordinator
+            # have already been stored
+            if token is not ret.refreshed_token:
+                self.token = token
         ret.token_updater = token_updater
-        return ret
+        return self.mount_transport(ret)
+
+    @local_lazy
+    def async_session(self):
+        """
+        An :class:`~flask_dance.consumer.aio.AsyncOAuth2Session` for calling
+        the OAuth provider's API from :mod:`asyncio` code. Requires Python 3.5
+        or newer, and HTTPX.
+        """
+        from .aio import AsyncOAuth2Session
+        return AsyncOAuth2Session(
+            client_id=self.client_id,
+            client=self.client,
+            auto_refresh_url=self.auto_refresh_url,
+            auto_refresh_kwargs=self.auto_refresh_kwargs,
+            scope=self.scope,
+            state=self.state,
+            blueprint=self,
+            base_url=self.base_url,
+            **self.kwargs
+        )
 
     def teardown_session(self, exception=None):
-        lazy.invalidate(self, "session")
+        local_lazy.invalidate(self, "session")
+        local_lazy.invalidate(self, "async_session")
 
     def login(self):
-        secure = request.is_secure or request.headers.get("X-Forwarded-Proto", "http") == "https"
-        self.session.redirect_uri = url_for(
-            ".authorized", next=request.args.get('next'), _external=True,
-            _scheme="https" if secure else "http",
-        )
-        url, state = self.session.authorization_url(
-            self.authorization_url, state=self.state,
-            **self.authorization_url_params
-        )
-        state_key = "{bp.name}_oauth_state".format(bp=self)
-        flask.session[state_key] = state
-        return redirect(url)
+        with self.span("login", self.authorization_url):
+            secure = request.is_secure or request.headers.get("X-Forwarded-Proto", "http") == "https"
+            self.session.redirect_uri = url_for(
+                ".authorized", next=request.args.get('next'), _external=True,
+                _scheme="https" if secure else "http",
+            )
+            url, state = self.session.authorization_url(
+                self.authorization_url, state=self.state,
+                **self.authorization_url_params
+            )
+            state_key = "{bp.name}_oauth_state".format(bp=self)
+            flask.session[state_key] = state
+            return redirect(url)
 
     def authorized(self):
+        with self.span("authorized", self.token_url) as span:
+            return self._authorized(span)
+
+    def _authorized(self, span):
         if "next" in request.args:
             next_url = request.args["next"]
         elif self.redirect_url:
@@ -188,6 +284,7 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
                 "OAuth 2 authorization error: %s description: %s uri: %s",
                 error, error_desc, error_uri,
             )
+            span.status, span.error = "error", error
             oauth_error.send(self,
                 error=error, error_description=error_desc, error_uri=error_uri,
             )
@@ -200,13 +297,24 @@ class OAuth2ConsumerBlueprint(BaseOAuthConsumerBlueprint):
         url = URLObject(request.url)
         if request.headers.get("X-Forwarded-Proto", "http") == "https":
             url = url.with_scheme("https")
-        token = self.session.fetch_token(
-            self.token_url,
-            authorization_response=url,
-            client_secret=self.client_secret,
-            **self.token_url_params
-        )
+        try:
+            with self.span("fetch_token", self.token_url):
+                token = self.session.fetch_token(
+                    self.token_url,
+                    authorization_response=url,
+                    client_secret=self.client_secret,
+                    **self.token_url_params
+                )
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            log.warning("OAuth 2 token request failed: %s", exc)
+            span.status, span.error = "error", exc
+            oauth_error.send(self,
+                error=exc, error_description=None, error_uri=None,
+            )
+            return redirect(next_url)
         results = oauth_authorized.send(self, token=token) or []
         if not any(ret == False for func, ret in results):
             self.token = token
+        else:
+            span.status = "declined"
         return redirect(next_url)
@@ -0,0 +1,234 @@
+from __future__ import unicode_literals
+
+import time
+import hashlib
+import threading
+from collections import namedtuple
+
+from urlobject import URLObject
+
+from flask_dance.utils import LocalCache
+
+
+# GitHub sends X-RateLimit-*, Twitter sends X-Rate-Limit-*
+HEADER_PREFIXES = ("X-RateLimit-", "X-Rate-Limit-")
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised instead of sending a request when the OAuth provider's rate limit
+    has been used up, and the :class:`RateLimitTracker` won't wait for it to
+    reset. The ``rate_limit`` attribute is the :class:`RateLimit` that was
+    used up, and ``wait`` is the number of seconds until it resets.
+    """
+    def __init__(self, rate_limit, wait):
+        super(RateLimitExceeded, self).__init__(
+            "Rate limit exceeded; it resets in {:.0f} seconds".format(wait)
+        )
+        self.rate_limit = rate_limit
+        self.wait = wait
+
+
+class RateLimit(namedtuple("RateLimit", ["limit", "remaining", "reset"])):
+    """
+    The quota that an OAuth provider reported on its last response:
+    the number of requests allowed per window, the number remaining in the
+    current window, and when the window resets, as a Unix timestamp.
+    """
+    __slots__ = ()
+
+
+def github_resource(url):
+    """
+    Which of GitHub's rate limits a request to ``url`` counts against.
+    """
+    path = URLObject(url).path
+    if path.startswith("/search/"):
+        return "search"
+    if path.startswith("/graphql"):
+        return "graphql"
+    return "core"
+
+
+def endpoint_resource(url):
+    """
+    Use a separate rate limit for every endpoint, as Twitter does. Numeric
+    IDs in the path are ignored, so ``/1.1/statuses/show/20.json`` and
+    ``/1.1/statuses/show/21.json`` count against the same limit.
+    """
+    segments = []
+    for segment in URLObject(url).path.split("/"):
+        name, dot, ext = segment.partition(".")
+        if name.isdigit() and not ext.isdigit():
+            segment = ":id" + dot + ext
+        segments.append(segment)
+    return "/".join(segments)
+
+
+class _Quota(object):
+    def __init__(self, limit, remaining, reset):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.next_allowed = 0
+
+
+class RateLimitTracker(object):
+    """
+    Keeps track of the rate limits that an OAuth provider reports in the
+    headers of its responses, and paces requests so that they don't run into
+    them. Pass one to a blueprint to enable it::
+
+        blueprint = OAuth2ConsumerBlueprint(..., rate_limit=RateLimitTracker())
+
+    Quotas are tracked separately for each token, and for requests that are
+    made without a user's token, which count against the application's quota.
+    Once less than ``pace_below`` of a quota is left, requests are spread
+    out evenly over the time until it resets, like a token bucket. Once it
+    is used up, requests either wait for it to reset, or fail immediately
+    with :class:`RateLimitExceeded`, depending on ``mode``.
+
+    Quotas are forgotten once they reset, and at most ``maxsize`` of them
+    are kept: the least recently used ones are dropped first.
+    """
+    def __init__(self, mode="wait", max_wait=60, pace_below=0.1, resource=None,
+                 maxsize=10000):
+        """
+        Args:
+            mode (str): ``"wait"`` to hold requests until the quota allows
+                them, or ``"fail"`` to raise :class:`RateLimitExceeded` as
+                soon as the quota is used up, without pacing.
+            max_wait (int): In ``"wait"`` mode, the longest time to hold a
+                request, in seconds. If the quota doesn't reset in time,
+                :class:`RateLimitExceeded` is raised instead.
+            pace_below (float): Start spreading requests out once less than
+                this fraction of the quota is left.
+            resource: A function that takes a URL and returns the name of the
+                quota that requests to it count against, like
+                :func:`github_resource` or :func:`endpoint_resource`.
+                Defaults to a single quota for all URLs.
+            maxsize (int): The number of quotas to keep track of.
+        """
+        if mode not in ("wait", "fail"):
+            raise ValueError("mode must be 'wait' or 'fail'")
+        self.mode = mode
+        self.max_wait = max_wait
+        self.pace_below = pace_below
+        self.resource = resource
+        self._quotas = LocalCache(maxsize=maxsize, default_timeout=0)
+        self._lock = threading.Lock()
+
+    def make_key(self, token, url):
+        """
+        Which quota a request counts against: a hash of the token (or
+        ``"app"``, if the request isn't made with a user's token), and the
+        resource for the URL.
+        """
+        token = token or {}
+        secret = token.get("access_token") or token.get("oauth_token")
+        if secret:
+            identity = hashlib.sha256(secret.encode("utf-8")).hexdigest()
+        else:
+            identity = "app"
+        resource = self.resource(url) if self.resource else None
+        return (identity, resource)
+
+    def get(self, token=None, url=""):
+        """
+        Return the :class:`RateLimit` last reported for ``token`` and
+        ``url``, or ``None`` if the provider hasn't reported one yet. If
+        ``token`` is ``None``, return the application's quota.
+        """
+        with self._lock:
+            quota = self._quotas.get(self.make_key(token, url))
+            if quota is None:
+                return None
+            return RateLimit(quota.limit, quota.remaining, quota.reset)
+
+    def acquire(self, key):
+        """
+        Wait until a request may be sent under the quota for ``key``,
+        or raise :class:`RateLimitExceeded`.
+        """
+        with self._lock:
+            quota = self._quotas.get(key)
+            if quota is None:
+                return
+            now = time.time()
+            if quota.reset <= now:
+                # a new window has started; we'll find out how much quota
+                # is left from the next response
+                self._quotas.delete(key)
+                return
+            if quota.remaining <= 0:
+                wait = quota.reset - now
+            elif self.mode == "wait" and quota.remaining < quota.limit * self.pace_below:
+                interval = (quota.reset - now) / quota.remaining
+                start = max(now, quota.next_allowed)
+                quota.next_allowed = start + interval
+                wait = start - now
+            else:
+                wait = 0
+            if wait > 0 and (self.mode == "fail" or wait > self.max_wait):
+                raise RateLimitExceeded(
+                    RateLimit(quota.limit, quota.remaining, quota.reset), wait,
+                )
+            # count this request now, so that concurrent requests
+            # don't all think that they can have the last one
+            quota.remaining -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, key, response):
+        """
+        Record the quota reported in the headers of ``response``.
+        """
+        headers = response.headers
+        for prefix in HEADER_PREFIXES:
+            if prefix + "Remaining" in headers:
+                break
+        else:
+            return
+        try:
+            remaining = int(headers[prefix + "Remaining"])
+            limit = int(headers.get(prefix + "Limit", remaining))
+            reset = float(headers.get(prefix + "Reset", 0))
+        except ValueError:
+            return
+        if response.status_code == 429 and "Retry-After" in headers:
+            try:
+                reset = max(reset, time.time() + float(headers["Retry-After"]))
+            except ValueError:
+                pass
+        with self._lock:
+            timeout = reset - time.time()
+            if timeout <= 0:
+                # the window has already reset, so there's nothing to track
+                self._quotas.delete(key)
+                return
+            quota = self._quotas.get(key)
+            if quota is None:
+                quota = _Quota(limit, remaining, reset)
+            else:
+                if reset != quota.reset:
+                    quota.next_allowed = 0
+                quota.limit = limit
+                # responses can arrive out of order; trust the lowest count
+                # within a window
+                if reset != quota.reset or remaining < quota.remaining:
+                    quota.remaining = remaining
+                quota.reset = reset
+            # forget the quota once it resets
+            self._quotas.set(key, quota, timeout=timeout)
+
+    def send(self, send, request, token, **kwargs):
+        """
+        Send ``request`` by calling ``send``, once the quota allows it.
+        """
+        if "Authorization" not in request.headers:
+            token = None
+        key = self.make_key(token, request.url)
+        self.acquire(key)
+        response = send(request, **kwargs)
+        self.update(key, response)
+        return response
@@ -0,0 +1,322 @@
+from __future__ import unicode_literals
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from six.moves import queue
+from urlobject import URLObject
+from requests_oauthlib import OAuth2Session
+
+log = logging.getLogger(__name__)
+
+
+class RefreshCoordinator(object):
+    """
+    Makes sure that an OAuth 2 token is only refreshed once, even if many
+    threads find out that it has expired at the same time. The first thread
+    to arrive refreshes the token and stores it in the backend; the others
+    wait for it to finish, and then reuse the token that it stored.
+
+    Threads in the same process wait on an in-process lock. To coordinate
+    with other processes, the coordinator also holds the backend's
+    :meth:`~flask_dance.consumer.backend.BaseBackend.refresh_lock` while
+    refreshing, which re-reads the stored token.
+
+    Every :class:`~flask_dance.consumer.OAuth2ConsumerBlueprint` has one of
+    these as its ``refresh_coordinator`` attribute. The ``refreshed`` and
+    ``reused`` attributes count how many tokens it has refreshed, and how
+    many times a waiting thread reused a token refreshed by someone else.
+    """
+    def __init__(self):
+        self.refreshed = 0
+        self.reused = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def make_key(self, blueprint, token):
+        """
+        The key that identifies a refresh. Refresh tokens are issued to a
+        single user, so the expired token identifies the user without the
+        coordinator needing to know how the backend tells users apart.
+        """
+        token = token or {}
+        return (
+            blueprint.name,
+            token.get("refresh_token") or token.get("access_token"),
+        )
+
+    def refresh(self, blueprint, stale_token, refresh):
+        """
+        Refresh ``stale_token`` by calling ``refresh``, unless another thread
+        or process has already done so, and return the new token.
+
+        Args:
+            blueprint: The blueprint that the token belongs to.
+            stale_token (dict): The expired token.
+            refresh: A function that takes no arguments, fetches a new token
+                from the OAuth provider, and returns it.
+        """
+        with self.lock(blueprint, stale_token):
+            with blueprint.backend.refresh_lock(blueprint) as current:
+                if self.is_fresher(current, stale_token):
+                    self.reused += 1
+                    return current
+                with blueprint.span("refresh", blueprint.token_url):
+                    token = refresh()
+                blueprint.token = token
+                self.refreshed += 1
+                return token
+
+    @contextmanager
+    def lock(self, blueprint, stale_token):
+        """
+        A context manager that holds the in-process lock for refreshing
+        ``stale_token``, without touching the backend.
+        """
+        key = self.make_key(blueprint, stale_token)
+        entry = self._checkout(key)
+        try:
+            with entry[0]:
+                yield
+        finally:
+            self._checkin(key, entry)
+
+    def is_fresher(self, token, stale_token):
+        """
+        Whether ``token`` replaces ``stale_token``, and hasn't expired yet.
+        """
+        if not token:
+            return False
+        if token.get("access_token") == (stale_token or {}).get("access_token"):
+            return False
+        expires_at = token.get("expires_at")
+        return not expires_at or float(expires_at) > time.time()
+
+    def _checkout(self, key):
+        with self._locks_lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        return entry
+
+    def _checkin(self, key, entry):
+        with self._locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+class RefreshScheduler(object):
+    """
+    Refreshes OAuth 2 tokens in the background before they expire, so that
+    requests to your Flask application don't have to wait for the OAuth
+    provider to issue a new token. This is opt-in::
+
+        scheduler = RefreshScheduler(app, window=600)
+        scheduler.start()
+
+    Every ``interval`` seconds, the scheduler asks the backend of each
+    blueprint for tokens that expire in the next ``window`` seconds, and
+    refreshes them on a pool of ``workers`` threads, using the blueprint's
+    ``token_url``, ``client_id`` and ``client_secret``. Only backends with an
+    ``expiring_tokens`` method, like
+    :class:`~flask_dance.consumer.backend.sqla.SQLAlchemyBackend`, can be
+    scanned; other blueprints are ignored.
+
+    Each refresh holds the blueprint's in-process refresh lock and the
+    backend's ``refresh_lock``, so it never races with a refresh triggered
+    by a request. The ``refreshed``, ``failed`` and ``skipped`` attributes
+    count what the scheduler has done so far. A token is skipped if someone
+    else refreshed it first.
+    """
+    def __init__(self, app, blueprints=None, window=300, interval=150,
+                 workers=2, rate_limit=None):
+        """
+        Args:
+            app: The Flask application. The scheduler pushes an application
+                context for this app while it works.
+            blueprints: The OAuth 2 blueprints to refresh tokens for.
+                Defaults to every OAuth 2 blueprint registered on ``app``.
+            window (int): Refresh tokens that expire within this many seconds.
+            interval (int): The number of seconds between scans. Keep it
+                shorter than ``window``, so that every token is seen at
+                least once before it expires. Each scan reads the tokens of
+                every blueprint from its backend, which can be expensive:
+                see :meth:`SQLAlchemyBackend.expiring_tokens
+                <flask_dance.consumer.backend.sqla.SQLAlchemyBackend.expiring_tokens>`.
+            workers (int): The number of threads that refresh tokens.
+            rate_limit (float): The maximum number of tokens to refresh per
+                second for each OAuth provider. Defaults to no limit.
+        """
+        self.app = app
+        self._blueprints = blueprints
+        self.window = window
+        self.interval = interval
+        self.workers = workers
+        self.rate_limit = rate_limit
+
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._counter_lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._next_slot = {}
+        self._rate_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    @property
+    def blueprints(self):
+        if self._blueprints is not None:
+            return self._blueprints
+        return [
+            bp for bp in self.app.blueprints.values()
+            if hasattr(bp, "refresh_coordinator")
+        ]
+
+    def start(self):
+        """
+        Start the scanning thread and the worker threads. They are daemon
+        threads, so they don't keep the process alive.
+        """
+        self._stopping.clear()
+        threads = [threading.Thread(target=self._scan_forever)]
+        threads.extend(
+            threading.Thread(target=self._work_forever)
+            for _ in range(self.workers)
+        )
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self._threads = threads
+
+    def stop(self, timeout=None):
+        """
+        Stop the threads started by :meth:`start`. Refreshes that are already
+        in progress are allowed to finish.
+        """
+        self._stopping.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self):
+        """
+        Scan for expiring tokens and refresh them in the calling thread.
+        """
+        for job in self.scan():
+            self.refresh(*job)
+
+    def scan(self):
+        """
+        Return a list of ``(blueprint, user_id, token)`` tuples for the
+        tokens that should be refreshed now.
+        """
+        before = time.time() + self.window
+        jobs = []
+        with self.app.app_context():
+            for blueprint in self.blueprints:
+                expiring_tokens = getattr(blueprint.backend, "expiring_tokens", None)
+                if expiring_tokens is None:
+                    continue
+                for user_id, token in expiring_tokens(blueprint, before):
+                    jobs.append((blueprint, user_id, token))
+        return jobs
+
+    def refresh(self, blueprint, user_id, stale_token):
+        """
+        Refresh one token, unless it has already been refreshed.
+        """
+        self._throttle(blueprint.name)
+        backend = blueprint.backend
+        try:
+            with self.app.app_context():
+                with blueprint.refresh_coordinator.lock(blueprint, stale_token):
+                    with backend.refresh_lock(blueprint, user_id=user_id) as current:
+                        if not self._needs_refresh(current, stale_token):
+                            self._count("skipped")
+                            return None
+                        with blueprint.span("refresh", blueprint.token_url):
+                            token = self._fetch(blueprint, current)
+                        backend.set(blueprint, token, user_id=user_id)
+        except Exception:
+            log.exception(
+                "Failed to refresh %s token for user %s", blueprint.name, user_id,
+            )
+            self._count("failed")
+            return None
+        self._count("refreshed")
+        return token
+
+    def _needs_refresh(self, token, stale_token):
+        if not token or not token.get("refresh_token"):
+            return False
+        if token.get("access_token") != stale_token.get("access_token"):
+            # someone else refreshed it already
+            return False
+        expires_at = token.get("expires_at")
+        return bool(expires_at) and float(expires_at) < time.time() + self.window
+
+    def _fetch(self, blueprint, token):
+        token_url = blueprint.token_url
+        if blueprint.base_url:
+            token_url = URLObject(blueprint.base_url).relative(token_url)
+        session = blueprint.mount_transport(
+            OAuth2Session(client_id=blueprint.client_id, token=token)
+        )
+        kwargs = dict(blueprint.auto_refresh_kwargs or {})
+        kwargs.setdefault("client_id", blueprint.client_id)
+        if blueprint.client_secret:
+            kwargs.setdefault("client_secret", blueprint.client_secret)
+        return session.refresh_token(
+            token_url, timeout=blueprint.timeout, **kwargs
+        )
+
+    def _throttle(self, provider):
+        if not self.rate_limit:
+            return
+        with self._rate_lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(provider, now))
+            self._next_slot[provider] = slot + 1.0 / self.rate_limit
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _count(self, name):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _scan_forever(self):
+        while not self._stopping.is_set():
+            try:
+                jobs = self.scan()
+            except Exception:
+                log.exception("Failed to scan for expiring tokens")
+                jobs = []
+            for job in jobs:
+                key = (job[0].name, job[1])
+                with self._pending_lock:
+                    if key in self._pending:
+                        continue
+                    self._pending.add(key)
+                self._queue.put(job)
+            self._stopping.wait(self.interval)
+
+    def _work_forever(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self.refresh(*job)
+            finally:
+                with self._pending_lock:
+                    self._pending.discard((job[0].name, job[1]))
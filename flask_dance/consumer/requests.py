@@ -1,22 +1,323 @@
 from __future__ import unicode_literals, print_function
 
+import sys
+import copy
+import threading
+import six
+from six.moves import queue
 from lazy import lazy
+import flask
 from urlobject import URLObject
 from requests_oauthlib import OAuth1Session as BaseOAuth1Session
 from requests_oauthlib import OAuth2Session as BaseOAuth2Session
-from oauthlib.common import to_unicode
+from oauthlib.oauth1 import SIGNATURE_RSA
+from .signing import token_credentials
 
 
-class OAuth1Session(BaseOAuth1Session):
+class PreparedCall(object):
+    """
+    A request that has been prepared and authenticated by
+    :meth:`BatchMixin.batch`, but not sent yet.
+    """
+    def __init__(self, request, send_kwargs):
+        self.request = request
+        self.send_kwargs = send_kwargs
+
+
+class BatchMixin(object):
+    """
+    Adds a :meth:`batch` method to a :class:`requests.Session` subclass.
+    """
+    def __init__(self, *args, **kwargs):
+        super(BatchMixin, self).__init__(*args, **kwargs)
+        self._batch_state = threading.local()
+
+    def batch(self, calls, max_workers=None, timeout=None, return_exceptions=False):
+        """
+        Send several requests concurrently, and return their responses in
+        the same order as ``calls``. For example::
+
+            repos, orgs, gists = github.batch([
+                "/user/repos",
+                ("GET", "/user/orgs"),
+                ("GET", "/gists", {"params": {"per_page": 100}}),
+            ])
+
+        The requests are prepared one after another in the calling thread,
+        so the token is loaded, refreshed if it has expired, and applied
+        before anything is sent. Only sending happens on worker threads,
+        over the blueprint's shared connection pool.
+
+        Args:
+            calls: A list of requests. Each one is a URL to ``GET``, a
+                ``(method, url)`` tuple, or a ``(method, url, kwargs)`` tuple,
+                where ``kwargs`` are passed to :meth:`request`.
+            max_workers (int): The maximum number of requests to send at once.
+                Defaults to the size of the blueprint's connection pool.
+            timeout: The default timeout for each request, in seconds, or a
+                ``(connect, read)`` tuple. A ``timeout`` in a request's
+                ``kwargs`` takes precedence.
+            return_exceptions (bool): If true, an exception raised while
+                sending a request is returned in its place. Otherwise, the
+                first one is raised once all the requests are done.
+        """
+        prepared = [self._prepare_call(call, timeout) for call in calls]
+        if not prepared:
+            return []
+        if max_workers is None:
+            max_workers = getattr(self.blueprint, "pool_maxsize", None) or 10
+        results = [None] * len(prepared)
+        failed = [False] * len(prepared)
+        todo = queue.Queue()
+        for index, call in enumerate(prepared):
+            todo.put((index, call))
+
+        def work():
+            while True:
+                try:
+                    index, call = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[index] = self.send(call.request, **call.send_kwargs)
+                except Exception as e:
+                    results[index] = e
+                    failed[index] = True
+
+        workers = [
+            threading.Thread(target=work)
+            for _ in range(min(max_workers, len(prepared)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if not return_exceptions and any(failed):
+            raise results[failed.index(True)]
+        return results
+
+    def _prepare_call(self, call, timeout):
+        if isinstance(call, six.string_types):
+            method, url, kwargs = "GET", call, {}
+        elif len(call) == 2:
+            (method, url), kwargs = call, {}
+        else:
+            method, url, kwargs = call
+        kwargs = dict(kwargs)
+        if timeout is not None:
+            kwargs.setdefault("timeout", timeout)
+        # go through the normal request() path, so that every request is
+        # authenticated exactly as it would be otherwise, but stop at send()
+        self._batch_state.preparing = True
+        try:
+            return self.request(method, url, **kwargs)
+        finally:
+            self._batch_state.preparing = False
+
+    def request(self, *args, **kwargs):
+        # requests made while handling a request, like refreshing an
+        # expired token, must still be sent while preparing a batch
+        state = self._batch_state
+        depth = getattr(state, "depth", 0)
+        state.depth = depth + 1
+        try:
+            return super(BatchMixin, self).request(*args, **kwargs)
+        finally:
+            state.depth = depth
+
+    def send(self, request, **kwargs):
+        state = self._batch_state
+        if getattr(state, "preparing", False) and state.depth == 1:
+            return PreparedCall(request, kwargs)
+        return super(BatchMixin, self).send(request, **kwargs)
+
+
+class PaginateMixin(object):
+    """
+    Adds a :meth:`paginate` method to a :class:`requests.Session` subclass.
+    """
+    def paginate(self, url, items=None, prefetch=1, **kwargs):
+        """
+        Iterate over the items of a paginated API, following the ``next``
+        link in the ``Link`` header of each page, as GitHub's API does.
+        For example::
+
+            for repo in github.paginate("/orgs/octocat/repos", params={"per_page": 100}):
+                print(repo["full_name"])
+
+        The first page is fetched before this method returns. Later pages
+        are fetched as they are needed, and with ``prefetch``, ahead of time
+        on a background thread while you work through the current page.
+        Any HTTP error is raised from the iterator.
+
+        Args:
+            url: The URL of the first page.
+            items: How to get the list of items from the JSON body of a page:
+                either a key to look up, or a function that takes the parsed
+                JSON and returns the items. By default, a page that is a list
+                is used as-is, and a page that is an object is expected to
+                have an ``items`` key, as GitHub's search API does.
+            prefetch (int): How many pages to fetch ahead of time. At most
+                this many pages, plus the current one, are held in memory.
+                Use 0 to fetch each page only when the previous one has been
+                used up, which holds only one page in memory at a time.
+            **kwargs: Passed to :meth:`get` for every page. The ``params``
+                only apply to the first page, since the ``next`` link already
+                includes them.
+        """
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+        kwargs.pop("params", None)
+        if prefetch:
+            pages = self._prefetch_pages(response, prefetch, kwargs)
+        else:
+            pages = self._fetch_pages(response, kwargs)
+        return self._page_items(pages, items)
+
+    def _page_items(self, pages, items):
+        for response in pages:
+            data = response.json()
+            if callable(items):
+                page = items(data)
+            elif items is not None:
+                page = data[items]
+            elif isinstance(data, dict):
+                page = data.get("items", [])
+            else:
+                page = data
+            for item in page:
+                yield item
+
+    def _fetch_pages(self, response, kwargs):
+        while response is not None:
+            yield response
+            response = self._next_page(response, kwargs)
+
+    def _next_page(self, response, kwargs):
+        next_url = response.links.get("next", {}).get("url")
+        if not next_url:
+            return None
+        response = self.get(next_url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _prefetch_pages(self, response, prefetch, kwargs):
+        pages = queue.Queue(maxsize=prefetch)
+        stopped = threading.Event()
+
+        def put(page):
+            # give up if the caller stops iterating
+            while not stopped.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch(response):
+            try:
+                while response is not None:
+                    response = self._next_page(response, kwargs)
+                    if not put(response):
+                        return
+            except Exception:
+                put(sys.exc_info())
+
+        if flask.has_request_context():
+            # refreshing the token may need the request context
+            fetch = flask.copy_current_request_context(fetch)
+        fetcher = threading.Thread(target=fetch, args=(response,))
+        fetcher.daemon = True
+        fetcher.start()
+        try:
+            yield response
+            while True:
+                page = pages.get()
+                if page is None:
+                    return
+                if isinstance(page, tuple):
+                    six.reraise(*page)
+                yield page
+        finally:
+            stopped.set()
+
+
+class HTTPCacheMixin(object):
+    """
+    Sends requests through the blueprint's ``http_cache``, if it has one.
+    See :class:`~flask_dance.consumer.http_cache.ConditionalCache`.
+    """
+    def send(self, request, **kwargs):
+        cache = getattr(self.blueprint, "http_cache", None)
+        if cache is None:
+            return super(HTTPCacheMixin, self).send(request, **kwargs)
+        return cache.send(
+            super(HTTPCacheMixin, self).send, request, self.token, **kwargs
+        )
+
+
+class RateLimitMixin(object):
+    """
+    Paces requests with the blueprint's ``rate_limit`` tracker, if it has one.
+    See :class:`~flask_dance.consumer.ratelimit.RateLimitTracker`.
+    """
+    def send(self, request, **kwargs):
+        tracker = getattr(self.blueprint, "rate_limit", None)
+        if tracker is None:
+            return super(RateLimitMixin, self).send(request, **kwargs)
+        return tracker.send(
+            super(RateLimitMixin, self).send, request, self.token, **kwargs
+        )
+
+
+class CircuitBreakerMixin(object):
+    """
+    Sends requests through the blueprint's ``circuit_breaker``, if it has one.
+    See :class:`~flask_dance.consumer.resilience.CircuitBreaker`.
+    """
+    def send(self, request, **kwargs):
+        breaker = getattr(self.blueprint, "circuit_breaker", None)
+        if breaker is None:
+            return super(CircuitBreakerMixin, self).send(request, **kwargs)
+        return breaker.send(
+            super(CircuitBreakerMixin, self).send, request, self.token, **kwargs
+        )
+
+
+class TimeoutMixin(object):
+    """
+    Applies the blueprint's default ``timeout`` to requests that
+    don't set their own.
+    """
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = getattr(self.blueprint, "timeout", None)
+        return super(TimeoutMixin, self).send(request, **kwargs)
+
+
+class OAuth1Session(PaginateMixin, BatchMixin, HTTPCacheMixin, RateLimitMixin,
+                    CircuitBreakerMixin, TimeoutMixin, BaseOAuth1Session):
     """
     A :class:`requests.Session` subclass that can do some special things:
 
     * lazy-loads OAuth1 tokens from the backend via the blueprint
     * handles OAuth1 authentication
       (from :class:`requests_oauthlib.OAuth1Session` superclass)
+    * signs each request with a copy of its client that holds the token,
+      so the token is never written into a shared client
     * has a ``base_url`` property used for relative URL resolution
+    * sends several requests concurrently with :meth:`~BatchMixin.batch`
+    * iterates over paginated APIs with :meth:`~PaginateMixin.paginate`
+    * can make GET requests conditional with an HTTP cache
+    * can pace requests to stay within the provider's rate limits
+    * times out, and stops sending requests to a provider that keeps failing
     """
-    def __init__(self, blueprint=None, base_url=None, *args, **kwargs):
+    def __init__(self, blueprint=None, base_url=None, signer=None, *args, **kwargs):
+        if signer is not None:
+            # copy the signer's client, rather than building a new one
+            kwargs["client_class"] = signer.make_client
         super(OAuth1Session, self).__init__(*args, **kwargs)
         self.blueprint = blueprint
         self.base_url = URLObject(base_url)
@@ -25,25 +326,44 @@ class OAuth1Session(BaseOAuth1Session):
     def token(self):
         return self.blueprint.token
 
+    @property
+    def authorized(self):
+        client = self.token_auth().client
+        if client.signature_method == SIGNATURE_RSA:
+            # RSA only uses resource_owner_key
+            return bool(client.resource_owner_key)
+        return (
+            bool(client.client_secret) and
+            bool(client.resource_owner_key) and
+            bool(client.resource_owner_secret)
+        )
+
+    def token_auth(self):
+        """
+        The :class:`requests_oauthlib.OAuth1` to sign requests with: a copy
+        of :attr:`auth` with the credentials of the current token set on its
+        client. :attr:`auth` itself is left alone, so that the token is never
+        written into a client that other requests are signed with.
+        """
+        credentials = token_credentials(self.token)
+        if not credentials:
+            return self.auth
+        auth = copy.copy(self.auth)
+        auth.client = copy.copy(self.auth.client)
+        for name, value in credentials.items():
+            setattr(auth.client, name, value)
+        return auth
+
     def prepare_request(self, request):
         if self.base_url:
             request.url = self.base_url.relative(request.url)
+        if request.auth is None:
+            request.auth = self.token_auth()
         return super(OAuth1Session, self).prepare_request(request)
 
-    def request(self, method, url, data=None, headers=None, **kwargs):
-        t = self.token
-        if t and "oauth_token" in t and "oauth_token_secret" in t:
-            # This really, really violates the Law of Demeter, but
-            # I don't see a better way to set these parameters. :(
-            self.auth.client.resource_owner_key = to_unicode(t["oauth_token"])
-            self.auth.client.resource_owner_secret = to_unicode(t["oauth_token_secret"])
-
-        return super(OAuth1Session, self).request(
-            method=method, url=url, data=data, headers=headers, **kwargs
-        )
-
 
-class OAuth2Session(BaseOAuth2Session):
+class OAuth2Session(PaginateMixin, BatchMixin, HTTPCacheMixin, RateLimitMixin,
+                    CircuitBreakerMixin, TimeoutMixin, BaseOAuth2Session):
     """
     A :class:`requests.Session` subclass that can do some special things:
 
@@ -51,7 +371,18 @@ class OAuth2Session(BaseOAuth2Session):
     * handles OAuth2 authentication
       (from :class:`requests_oauthlib.OAuth2Session` superclass)
     * has a ``base_url`` property used for relative URL resolution
+    * refreshes expired tokens only once, even when many requests find
+      out that a token has expired at the same time
+    * sends several requests concurrently with :meth:`~BatchMixin.batch`
+    * iterates over paginated APIs with :meth:`~PaginateMixin.paginate`
+    * can make GET requests conditional with an HTTP cache
+    * can pace requests to stay within the provider's rate limits
+    * times out, and stops sending requests to a provider that keeps failing
     """
+    # the last token that this session refreshed, which has already been
+    # stored in the backend
+    refreshed_token = None
+
     def __init__(self, blueprint=None, base_url=None, *args, **kwargs):
         super(OAuth2Session, self).__init__(*args, **kwargs)
         self.blueprint = blueprint
@@ -62,14 +393,57 @@ class OAuth2Session(BaseOAuth2Session):
     def token(self):
         return self.blueprint.token
 
+    def load_token(self):
+        """
+        Put the token from the backend into the session's client, so that
+        the client can use it.
+        """
+        token = self.token
+        self._client.token = token
+        if token:
+            self._client._populate_attributes(token)
+
+    @property
+    def access_token(self):
+        self.load_token()
+        return getattr(self._client, "access_token", None)
+
+    @access_token.setter
+    def access_token(self, value):
+        self._client.access_token = value
+
+    @property
+    def authorized(self):
+        """
+        Whether there is an OAuth token for the current user, loading it
+        from the backend if needed.
+        """
+        return bool(self.access_token)
+
     def request(self, method, url, data=None, headers=None, **kwargs):
         if self.base_url:
             url = self.base_url.relative(url)
 
-        self._client.token = self.token
-        if self.token:
-            self._client._populate_attributes(self.token)
+        self.load_token()
 
         return super(OAuth2Session, self).request(
             method=method, url=url, data=data, headers=headers, **kwargs
         )
+
+    def refresh_token(self, token_url, *args, **kwargs):
+        coordinator = getattr(self.blueprint, "refresh_coordinator", None)
+        if coordinator is None:
+            return super(OAuth2Session, self).refresh_token(
+                token_url, *args, **kwargs
+            )
+
+        base_refresh_token = super(OAuth2Session, self).refresh_token
+        def refresh():
+            return base_refresh_token(token_url, *args, **kwargs)
+
+        token = coordinator.refresh(self.blueprint, self.token, refresh)
+        self.token = token
+        self._client.token = token
+        self._client._populate_attributes(token)
+        self.refreshed_token = token
+        return token
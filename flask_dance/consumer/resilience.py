@@ -0,0 +1,164 @@
+from __future__ import unicode_literals
+
+import time
+import random
+import threading
+
+import requests
+from requests.packages.urllib3.util.retry import Retry
+from urlobject import URLObject
+
+
+# (connect, read) timeouts, in seconds, for requests to the OAuth provider
+DEFAULT_TIMEOUT = (5, 30)
+
+
+class JitteredRetry(Retry):
+    """
+    A :class:`urllib3.util.retry.Retry` with defaults that suit requests to
+    an OAuth provider: connection errors are retried for every request, but
+    read errors and ``502``, ``503`` and ``504`` responses are only retried
+    for idempotent methods, like ``GET``. The time between retries is chosen
+    at random, up to the usual exponential backoff, so that many clients
+    that failed at the same moment don't all retry at the same moment, too.
+    ``Retry-After`` headers are ignored, so that a worker is never held
+    for longer than the backoff.
+    """
+    def __init__(self, total=2, backoff_factor=0.3,
+                 status_forcelist=(502, 503, 504), raise_on_status=False,
+                 respect_retry_after_header=False, **kwargs):
+        super(JitteredRetry, self).__init__(
+            total=total,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+            raise_on_status=raise_on_status,
+            respect_retry_after_header=respect_retry_after_header,
+            **kwargs
+        )
+
+    def get_backoff_time(self):
+        backoff = super(JitteredRetry, self).get_backoff_time()
+        return random.uniform(0, backoff)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of sending a request to a host that the
+    :class:`CircuitBreaker` has stopped sending requests to. The ``host``
+    attribute is the host, and ``retry_after`` is the number of seconds until
+    a request to it will be let through again.
+    """
+    def __init__(self, host, retry_after, request=None):
+        super(CircuitOpenError, self).__init__(
+            "Circuit open for {}; retry in {:.0f} seconds".format(host, retry_after),
+            request=request,
+        )
+        self.host = host
+        self.retry_after = retry_after
+
+
+class _Circuit(object):
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to a host of the OAuth provider once it has
+    failed ``failure_threshold`` times in a row, so that a slow or broken
+    provider can't tie up all of your application's workers. A failure is a
+    connection error, a timeout, or a ``5xx`` response. While the circuit is
+    open, requests fail immediately with :class:`CircuitOpenError`. After
+    ``reset_timeout`` seconds, one request is let through: if it succeeds,
+    the circuit closes again, and if it fails, it stays open for another
+    ``reset_timeout`` seconds.
+
+    Circuit breakers are off by default. Pass one to a blueprint as its
+    ``circuit_breaker`` to enable it; it keeps a separate circuit for each
+    host. A circuit counts the failures of every request to its host,
+    whichever user makes it, so while it is open, nobody's requests to that
+    host get through.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Args:
+            failure_threshold (int): The number of failures in a row that
+                open the circuit.
+            reset_timeout (int): The number of seconds to keep the circuit
+                open before trying the host again.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def state(self, url):
+        """
+        Return ``"closed"``, ``"open"`` or ``"half-open"``, for the circuit
+        of the host of ``url``.
+        """
+        with self._lock:
+            circuit = self._circuits.get(URLObject(url).netloc)
+            if circuit is None or circuit.opened_at is None:
+                return "closed"
+            if circuit.probing or circuit.opened_at + self.reset_timeout > time.time():
+                return "open"
+            return "half-open"
+
+    def before_request(self, host, request=None):
+        """
+        Raise :class:`CircuitOpenError` if a request to ``host`` may not
+        be sent now.
+        """
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.opened_at is None:
+                return
+            wait = circuit.opened_at + self.reset_timeout - time.time()
+            if wait > 0 or circuit.probing:
+                raise CircuitOpenError(host, max(wait, 0), request=request)
+            # half-open: let this request through to find out whether the
+            # host has recovered, and hold back all the others
+            circuit.probing = True
+
+    def record(self, host, success):
+        """
+        Record the outcome of a request to ``host``. ``success`` is
+        ``None`` if the request failed for a reason that says nothing about
+        the health of the host.
+        """
+        with self._lock:
+            if success:
+                self._circuits.pop(host, None)
+                return
+            circuit = self._circuits.get(host)
+            if success is None:
+                if circuit is not None:
+                    circuit.probing = False
+                return
+            if circuit is None:
+                circuit = self._circuits[host] = _Circuit()
+            circuit.probing = False
+            circuit.failures += 1
+            if circuit.opened_at is not None or circuit.failures >= self.failure_threshold:
+                circuit.opened_at = time.time()
+
+    def send(self, send, request, token, **kwargs):
+        """
+        Send ``request`` by calling ``send``, unless the circuit for its host
+        is open.
+        """
+        host = URLObject(request.url).netloc
+        self.before_request(host, request=request)
+        try:
+            response = send(request, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.record(host, False)
+            raise
+        except Exception:
+            self.record(host, None)
+            raise
+        self.record(host, response.status_code < 500)
+        return response
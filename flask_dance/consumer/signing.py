@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+
+import copy
+
+from oauthlib.common import to_unicode
+from oauthlib.oauth1 import SIGNATURE_HMAC, SIGNATURE_TYPE_AUTH_HEADER
+from requests_oauthlib import OAuth1
+
+
+def token_credentials(token):
+    """
+    The ``resource_owner_key`` and ``resource_owner_secret`` to sign requests
+    with for an OAuth 1 ``token``, as a dict. It is empty if the token
+    doesn't have both.
+    """
+    if token and "oauth_token" in token and "oauth_token_secret" in token:
+        return {
+            "resource_owner_key": to_unicode(token["oauth_token"]),
+            "resource_owner_secret": to_unicode(token["oauth_token_secret"]),
+        }
+    return {}
+
+
+class OAuth1Signer(object):
+    """
+    Signs OAuth 1 requests for a blueprint. The :class:`oauthlib.oauth1.Client`
+    is built once, from the client credentials and the other parameters
+    that are the same for every request, and is never changed afterwards,
+    so one signer can be shared by every session and thread. Each request is
+    signed with a shallow copy of the client that has the credentials of
+    the user's token set on it.
+    """
+    def __init__(self, client_key, client_secret=None,
+                 signature_method=SIGNATURE_HMAC,
+                 signature_type=SIGNATURE_TYPE_AUTH_HEADER,
+                 rsa_key=None, client_class=None, force_include_body=False,
+                 **kwargs):
+        self.auth = OAuth1(
+            client_key,
+            client_secret=client_secret,
+            signature_method=signature_method,
+            signature_type=signature_type,
+            rsa_key=rsa_key,
+            client_class=client_class,
+            force_include_body=force_include_body,
+            **kwargs
+        )
+
+    @property
+    def client(self):
+        return self.auth.client
+
+    def client_for(self, token=None, **params):
+        """
+        Return a copy of the client, with the credentials from ``token``,
+        and any other client attributes in ``params``, like ``verifier``.
+        """
+        client = copy.copy(self.auth.client)
+        params.update(token_credentials(token))
+        for name, value in params.items():
+            setattr(client, name, value)
+        return client
+
+    def auth_for(self, token=None):
+        """
+        Return a :class:`requests_oauthlib.OAuth1` for Requests to sign a
+        request with, using the credentials from ``token``.
+        """
+        auth = copy.copy(self.auth)
+        auth.client = self.client_for(token)
+        return auth
+
+    def sign(self, uri, http_method="GET", body=None, headers=None, token=None):
+        """
+        Sign a request with the credentials from ``token``. Returns the
+        ``(uri, headers, body)`` tuple from :meth:`oauthlib.oauth1.Client.sign`.
+        """
+        return self.client_for(token).sign(uri, http_method, body, headers)
+
+    def make_client(self, *args, **kwargs):
+        """
+        A stand-in for the ``client_class`` of
+        :class:`requests_oauthlib.OAuth1Session`, which returns a copy of
+        the client instead of building a new one. The arguments are ignored:
+        they are the ones that this signer's client was built with.
+        """
+        return copy.copy(self.auth.client)
@@ -0,0 +1,182 @@
+"""
+Multi-tenant blueprints: one blueprint that serves many OAuth client
+credentials, for applications where each tenant brings their own OAuth app.
+A :class:`TenantRegistry` loads each tenant's credentials and endpoints, and
+caches them; the blueprint's tenant resolver picks the tenant for each
+request. For example::
+
+    def load_tenant(tenant_id):
+        row = db.session.query(GitHubApp).get(tenant_id)
+        if row is None:
+            return None
+        return {"client_id": row.client_id, "client_secret": row.client_secret}
+
+    blueprint = OAuth2ConsumerBlueprint("github", __name__,
+        base_url="https://api.github.com/",
+        authorization_url="https://github.com/login/oauth/authorize",
+        token_url="https://github.com/login/oauth/access_token",
+        tenants=TenantRegistry(load_tenant),
+    )
+
+    @blueprint.tenant_resolver
+    def resolve_tenant():
+        return request.host.split(".")[0]
+
+Settings that a tenant doesn't have fall back to the blueprint's own.
+The blueprint itself is never changed: its attributes look up the current
+tenant's settings when they are read.
+
+Each tenant's tokens are stored apart, under the blueprint's
+:attr:`~flask_dance.consumer.base.BaseOAuthConsumerBlueprint.token_namespace`,
+such as ``github:acme``; with
+:class:`~flask_dance.consumer.backend.sqla.SQLAlchemyBackend`, that's the
+``provider`` column, so make sure it's long enough for your tenant IDs.
+The :class:`~flask_dance.consumer.refresh.RefreshScheduler` doesn't know
+about tenants, and only refreshes tokens stored under the blueprint's name.
+"""
+from __future__ import unicode_literals
+
+import threading
+
+from werkzeug.exceptions import NotFound
+
+from flask_dance.utils import LocalCache
+
+
+class UnknownTenant(NotFound):
+    """
+    Raised when the tenant resolver returns a tenant that the
+    :class:`TenantRegistry` can't load. It's a
+    :class:`~werkzeug.exceptions.NotFound`, so if it isn't handled, the
+    request ends with a 404 response. The ``tenant_id`` attribute is the
+    tenant that couldn't be found.
+    """
+    def __init__(self, tenant_id):
+        super(UnknownTenant, self).__init__(
+            "No such tenant: {!r}".format(tenant_id)
+        )
+        self.tenant_id = tenant_id
+
+
+class Tenant(object):
+    """
+    One tenant's OAuth settings. ``settings`` are named after the blueprint
+    attributes that they replace, such as ``client_id``, ``client_secret``
+    or ``token_url``.
+    """
+    def __init__(self, id, **settings):
+        self.id = id
+        self.settings = settings
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Tenant) and
+            self.id == other.id and self.settings == other.settings
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<Tenant {!r}>".format(self.id)
+
+
+class TenantRegistry(object):
+    """
+    Loads tenants with ``loader``, and keeps them in a cache so that the
+    loader isn't called for every request. By default, the cache is a
+    :class:`~flask_dance.utils.LocalCache` that holds the ``maxsize`` most
+    recently used tenants; pass any cache with the Flask-Cache API, such as
+    a :class:`~flask_dance.utils.LocalCache` in front of Redis, to share
+    tenants between processes.
+
+    The ``hits`` and ``misses`` attributes count cache hits, and calls to
+    the loader.
+    """
+    def __init__(self, loader, cache=None, maxsize=10000, timeout=300,
+                 negative_timeout=60):
+        """
+        Args:
+            loader: A function that takes a tenant ID, and returns a
+                :class:`Tenant`, a dict of settings, or ``None`` if there is
+                no such tenant.
+            cache: Where to keep loaded tenants. Defaults to a
+                :class:`~flask_dance.utils.LocalCache`.
+            maxsize (int): The number of tenants that the default cache holds.
+            timeout (int): The number of seconds to keep a tenant in the
+                cache. Change a tenant's settings, then call :meth:`forget`
+                to load them again sooner.
+            negative_timeout (int): The number of seconds to remember that
+                a tenant doesn't exist, so that requests for unknown tenants
+                don't call the loader every time. 0 turns this off.
+        """
+        self.loader = loader
+        if cache is None:
+            cache = LocalCache(maxsize=maxsize, default_timeout=timeout)
+        self.cache = cache
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def make_key(self, tenant_id):
+        return "flask_dance_tenant|{}".format(tenant_id)
+
+    def get(self, tenant_id):
+        """
+        Return the :class:`Tenant` with the ID ``tenant_id``, from the cache
+        if possible. Raises :class:`UnknownTenant` if there is no such
+        tenant.
+        """
+        key = self.make_key(tenant_id)
+        tenant = self.cache.get(key)
+        if tenant is None:
+            with self._counter_lock:
+                self.misses += 1
+            tenant = self.loader(tenant_id)
+            if tenant is None:
+                if self.negative_timeout:
+                    # False, rather than None, so that it counts as a hit
+                    self.cache.set(key, False, timeout=self.negative_timeout)
+                raise UnknownTenant(tenant_id)
+            if not isinstance(tenant, Tenant):
+                tenant = Tenant(tenant_id, **tenant)
+            self.cache.set(key, tenant, timeout=self.timeout)
+            return tenant
+        with self._counter_lock:
+            self.hits += 1
+        if tenant is False:
+            raise UnknownTenant(tenant_id)
+        return tenant
+
+    def forget(self, tenant_id):
+        """
+        Drop ``tenant_id`` from the cache, so that it is loaded again the
+        next time it is needed.
+        """
+        self.cache.delete(self.make_key(tenant_id))
+
+
+class tenant_setting(object):
+    """
+    A blueprint attribute that the current tenant can override. Setting it
+    sets the blueprint's own value, which is used when there is no tenant,
+    or the tenant doesn't have this setting.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, inst, cls):
+        if inst is None:
+            return self
+        if inst.tenants is not None:
+            tenant = inst.current_tenant
+            if tenant is not None:
+                settings = tenant.settings
+                if self.name in settings:
+                    return settings[self.name]
+        return inst.__dict__.get(self.name)
+
+    def __set__(self, inst, value):
+        inst.__dict__[self.name] = value
@@ -1,8 +1,10 @@
 from __future__ import unicode_literals
 
 from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.base import lookup_blueprint_session
+from flask_dance.consumer.ratelimit import RateLimitTracker, github_resource
 from functools import partial
-from flask.globals import LocalProxy, _lookup_app_object
+from flask.globals import LocalProxy
 try:
     from flask import _app_ctx_stack as stack
 except ImportError:
@@ -15,7 +17,7 @@ __maintainer__ = "David Baumgold <david@davidbaumgold.com>"
 def make_github_blueprint(
         client_id=None, client_secret=None, scope=None, redirect_url=None,
         redirect_to=None, login_url=None, authorized_url=None,
-        session_class=None, backend=None):
+        session_class=None, backend=None, http_cache=None, rate_limit=False):
     """
     Make a blueprint for authenticating with GitHub using OAuth 2. This requires
     a client ID and client secret from GitHub. You should either pass them to
@@ -41,10 +43,25 @@ def make_github_blueprint(
         backend: A storage backend class, or an instance of a storage
                 backend class, to use for this blueprint. Defaults to
                 :class:`~flask_dance.consumer.backend.session.SessionBackend`.
+        http_cache (optional): A
+            :class:`~flask_dance.consumer.http_cache.ConditionalCache` to make
+            GET requests to the API conditional. Disabled by default.
+        rate_limit (optional): A
+            :class:`~flask_dance.consumer.ratelimit.RateLimitTracker` to pace
+            requests to the API so that they stay within GitHub's rate limits.
+            Pass ``True`` to use a tracker that knows how GitHub counts
+            requests, and raises
+            :class:`~flask_dance.consumer.ratelimit.RateLimitExceeded` once a
+            quota is used up, rather than holding the request until it
+            resets. Disabled by default.
 
     :rtype: :class:`~flask_dance.consumer.OAuth2ConsumerBlueprint`
     :returns: A :ref:`blueprint <flask:blueprints>` to attach to your Flask app.
     """
+    if rate_limit is True:
+        rate_limit = RateLimitTracker(mode="fail", resource=github_resource)
+    elif rate_limit is False:
+        rate_limit = None
     github_bp = OAuth2ConsumerBlueprint("github", __name__,
         client_id=client_id,
         client_secret=client_secret,
@@ -58,6 +75,8 @@ def make_github_blueprint(
         authorized_url=authorized_url,
         session_class=session_class,
         backend=backend,
+        rate_limit=rate_limit,
+        http_cache=http_cache,
     )
     github_bp.from_config["client_id"] = "GITHUB_OAUTH_CLIENT_ID"
     github_bp.from_config["client_secret"] = "GITHUB_OAUTH_CLIENT_SECRET"
@@ -65,8 +84,8 @@ def make_github_blueprint(
     @github_bp.before_app_request
     def set_applocal_session():
         ctx = stack.top
-        ctx.github_oauth = github_bp.session
+        ctx.github_oauth_blueprint = github_bp
 
     return github_bp
 
-github = LocalProxy(partial(_lookup_app_object, "github_oauth"))
+github = LocalProxy(partial(lookup_blueprint_session, "github_oauth_blueprint"))
@@ -1,8 +1,9 @@
 from __future__ import unicode_literals
 
 from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.base import lookup_blueprint_session
 from functools import partial
-from flask.globals import LocalProxy, _lookup_app_object
+from flask.globals import LocalProxy
 try:
     from flask import _app_ctx_stack as stack
 except ImportError:
@@ -16,7 +17,7 @@ def make_google_blueprint(
         client_id=None, client_secret=None, scope=None,
         offline=False, reprompt_consent=False,
         redirect_url=None, redirect_to=None, login_url=None, authorized_url=None,
-        session_class=None, backend=None):
+        session_class=None, backend=None, http_cache=None):
     """
     Make a blueprint for authenticating with Google using OAuth 2. This requires
     a client ID and client secret from Google. You should either pass them to
@@ -49,6 +50,9 @@ def make_google_blueprint(
         backend: A storage backend class, or an instance of a storage
                 backend class, to use for this blueprint. Defaults to
                 :class:`~flask_dance.consumer.backend.session.SessionBackend`.
+        http_cache (optional): A
+            :class:`~flask_dance.consumer.http_cache.ConditionalCache` to make
+            GET requests to the API conditional. Disabled by default.
 
     :rtype: :class:`~flask_dance.consumer.OAuth2ConsumerBlueprint`
     :returns: A :ref:`blueprint <flask:blueprints>` to attach to your Flask app.
@@ -73,6 +77,7 @@ def make_google_blueprint(
         authorization_url_params=authorization_url_params,
         session_class=session_class,
         backend=backend,
+        http_cache=http_cache,
     )
     google_bp.from_config["client_id"] = "GOOGLE_OAUTH_CLIENT_ID"
     google_bp.from_config["client_secret"] = "GOOGLE_OAUTH_CLIENT_SECRET"
@@ -80,8 +85,8 @@ def make_google_blueprint(
     @google_bp.before_app_request
     def set_applocal_session():
         ctx = stack.top
-        ctx.google_oauth = google_bp.session
+        ctx.google_oauth_blueprint = google_bp
 
     return google_bp
 
-google = LocalProxy(partial(_lookup_app_object, "google_oauth"))
+google = LocalProxy(partial(lookup_blueprint_session, "google_oauth_blueprint"))
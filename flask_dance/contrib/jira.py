@@ -4,8 +4,9 @@ import os.path
 from urlobject import URLObject
 from oauthlib.oauth1 import SIGNATURE_RSA
 from flask_dance.consumer import OAuth1ConsumerBlueprint
+from flask_dance.consumer.base import lookup_blueprint_session
 from functools import partial
-from flask.globals import LocalProxy, _lookup_app_object
+from flask.globals import LocalProxy
 try:
     from flask import _app_ctx_stack as stack
 except ImportError:
@@ -33,7 +34,9 @@ def make_jira_blueprint(
         consumer_key (str): The consumer key for your Application Link on JIRA
         rsa_key (str or path): The RSA private key for your Application Link
             on JIRA. This can be the contents of the key as a string, or a path
-            to the key file on disk.
+            to the key file on disk. The key is parsed once, and reused for
+            every signature; see
+            :attr:`~flask_dance.consumer.OAuth1ConsumerBlueprint.signing_key`.
         redirect_url (str): the URL to redirect to after the authentication
             dance is complete
         redirect_to (str): if ``redirect_url`` is not defined, the name of the
@@ -80,8 +83,8 @@ def make_jira_blueprint(
     @jira_bp.before_app_request
     def set_applocal_session():
         ctx = stack.top
-        ctx.jira_oauth = jira_bp.session
+        ctx.jira_oauth_blueprint = jira_bp
 
     return jira_bp
 
-jira = LocalProxy(partial(_lookup_app_object, "jira_oauth"))
+jira = LocalProxy(partial(lookup_blueprint_session, "jira_oauth_blueprint"))
@@ -1,8 +1,10 @@
 from __future__ import unicode_literals
 
 from flask_dance.consumer import OAuth1ConsumerBlueprint
+from flask_dance.consumer.base import lookup_blueprint_session
+from flask_dance.consumer.ratelimit import RateLimitTracker, endpoint_resource
 from functools import partial
-from flask.globals import LocalProxy, _lookup_app_object
+from flask.globals import LocalProxy
 try:
     from flask import _app_ctx_stack as stack
 except ImportError:
@@ -15,7 +17,7 @@ __maintainer__ = "David Baumgold <david@davidbaumgold.com>"
 def make_twitter_blueprint(
         api_key=None, api_secret=None,
         redirect_url=None, redirect_to=None, login_url=None, authorized_url=None,
-        session_class=None, backend=None):
+        session_class=None, backend=None, rate_limit=False):
     """
     Make a blueprint for authenticating with Twitter using OAuth 1. This requires
     an API key and API secret from Twitter. You should either pass them to
@@ -40,10 +42,22 @@ def make_twitter_blueprint(
         backend: A storage backend class, or an instance of a storage
                 backend class, to use for this blueprint. Defaults to
                 :class:`~flask_dance.consumer.backend.session.SessionBackend`.
+        rate_limit (optional): A
+            :class:`~flask_dance.consumer.ratelimit.RateLimitTracker` to pace
+            requests to the API so that they stay within Twitter's rate limits.
+            Pass ``True`` to use a tracker that knows how Twitter counts
+            requests, and raises
+            :class:`~flask_dance.consumer.ratelimit.RateLimitExceeded` once a
+            quota is used up, rather than holding the request until it
+            resets. Disabled by default.
 
     :rtype: :class:`~flask_dance.consumer.OAuth1ConsumerBlueprint`
     :returns: A :ref:`blueprint <flask:blueprints>` to attach to your Flask app.
     """
+    if rate_limit is True:
+        rate_limit = RateLimitTracker(mode="fail", resource=endpoint_resource)
+    elif rate_limit is False:
+        rate_limit = None
     twitter_bp = OAuth1ConsumerBlueprint("twitter", __name__,
         client_key=api_key,
         client_secret=api_secret,
@@ -57,6 +71,7 @@ def make_twitter_blueprint(
         authorized_url=authorized_url,
         session_class=session_class,
         backend=backend,
+        rate_limit=rate_limit,
     )
     twitter_bp.from_config["client_key"] = "TWITTER_OAUTH_API_KEY"
     twitter_bp.from_config["client_secret"] = "TWITTER_OAUTH_API_SECRET"
@@ -64,8 +79,8 @@ def make_twitter_blueprint(
     @twitter_bp.before_app_request
     def set_applocal_session():
         ctx = stack.top
-        ctx.twitter_oauth = twitter_bp.session
+        ctx.twitter_oauth_blueprint = twitter_bp
 
     return twitter_bp
 
-twitter = LocalProxy(partial(_lookup_app_object, "twitter_oauth"))
+twitter = LocalProxy(partial(lookup_blueprint_session, "twitter_oauth_blueprint"))
@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
+import time
 import functools
-from collections import MutableMapping
+import threading
+from collections import MutableMapping, OrderedDict
 
 
 class FakeCache(object):
@@ -10,10 +12,176 @@ class FakeCache(object):
     """
     def get(self, key):
         return None
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         return None
     def delete(self, key):
         return None
+    def delete_many(self, *keys):
+        return None
+
+
+class LocalCache(object):
+    """
+    A bounded, thread-safe, in-process cache that mimics just enough of
+    Flask-Cache's API to be compatible with our needs. Once ``maxsize``
+    entries are stored, the least recently used entry is evicted to make room,
+    and every entry expires after its timeout.
+
+    If ``backend`` is given (for example, an instance of Flask-Cache backed by
+    Redis or memcached), this cache sits in front of it as a first-level
+    cache: lookups that miss locally fall through to the backend, and
+    writes and deletes go to both.
+
+    The ``hits``, ``misses`` and ``evictions`` attributes count what the
+    cache has done since it was created.
+    """
+    def __init__(self, maxsize=10000, default_timeout=60, backend=None):
+        """
+        Args:
+            maxsize (int): The maximum number of entries to keep in memory.
+            default_timeout (int): The number of seconds to keep an entry,
+                if no timeout is given when it is set. A timeout of 0 means
+                that entries never expire.
+            backend: An optional second-level cache with the Flask-Cache API.
+        """
+        self.maxsize = maxsize
+        self.default_timeout = default_timeout
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                value, expires_at = entry
+                if not expires_at or expires_at > time.time():
+                    # re-insert to mark this as the most recently used key
+                    self._data[key] = entry
+                    self.hits += 1
+                    return value
+            self.misses += 1
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                timeout = token_cache_timeout(value, self.default_timeout)
+                if timeout is not False:
+                    self._store(key, value, timeout)
+            return value
+        return None
+
+    def set(self, key, value, timeout=None):
+        self._store(key, value, timeout)
+        if self.backend is not None:
+            self.backend.set(key, value, timeout=timeout)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def delete_many(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+        if self.backend is not None:
+            delete_many(self.backend, keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _store(self, key, value, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        expires_at = time.time() + timeout if timeout else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+
+def token_cache_timeout(value, timeout):
+    """
+    The timeout to cache ``value`` with: ``timeout``, unless ``value`` is an
+    OAuth token with an ``expires_at`` time that comes first, in which case
+    it is the number of seconds until then. Returns ``False`` if the token
+    has already expired, and shouldn't be cached at all. A ``timeout`` of
+    ``None`` or ``0`` doesn't limit the time by itself.
+    """
+    expires_at = value.get("expires_at") if isinstance(value, dict) else None
+    if not expires_at:
+        return timeout
+    remaining = int(float(expires_at) - time.time())
+    if remaining <= 0:
+        return False
+    if not timeout or remaining < timeout:
+        return remaining
+    return timeout
+
+
+def delete_many(cache, keys):
+    """
+    Delete ``keys`` from a cache with the Flask-Cache API, in one call if
+    the cache has a ``delete_many`` method, and one at a time otherwise.
+    """
+    if not keys:
+        return
+    bulk_delete = getattr(cache, "delete_many", None)
+    if bulk_delete is not None:
+        bulk_delete(*keys)
+    else:
+        for key in keys:
+            cache.delete(key)
+
+
+class local_lazy(object):
+    """
+    Like :class:`lazy.lazy`, but the value is computed and kept separately
+    for each thread, so that requests handled at the same time by different
+    threads never share it. Use ``local_lazy.invalidate(obj, name)`` to
+    forget the value for the current thread.
+    """
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, inst, cls):
+        if inst is None:
+            return self
+        local = inst.__dict__.get("_local_lazy")
+        if local is None:
+            local = inst.__dict__.setdefault("_local_lazy", threading.local())
+        try:
+            return local.__dict__[self.__name__]
+        except KeyError:
+            value = self.func(inst)
+            setattr(local, self.__name__, value)
+            return value
+
+    @classmethod
+    def peek(cls, inst, name):
+        """
+        Return the current thread's value, or ``None`` if it hasn't been
+        computed.
+        """
+        local = inst.__dict__.get("_local_lazy")
+        return None if local is None else local.__dict__.get(name)
+
+    @classmethod
+    def invalidate(cls, inst, name):
+        local = inst.__dict__.get("_local_lazy")
+        if local is not None:
+            local.__dict__.pop(name, None)
 
 
 def first(iterable, default=None, key=None):
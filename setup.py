@@ -51,6 +51,8 @@ setup(
     extras_require={
         'sqla': ['sqlalchemy', 'sqlalchemy-utils'],
         'signals': ['blinker'],
+        'async': ['httpx'],
+        'rsa': ['cryptography', 'pyjwt'],
     },
     cmdclass = {'test': PyTest},
     license='MIT',
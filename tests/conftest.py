@@ -1,5 +1,17 @@
+import sys
+import json
+import time
+import threading
 import pytest
 import responses as resp_module
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlsplit
+
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # uses async/await syntax
+    collect_ignore.append("consumer/test_aio.py")
 
 
 @pytest.fixture
@@ -9,3 +21,114 @@ def responses(request):
         resp_module.stop()
         resp_module.reset()
     request.addfinalizer(done)
+
+
+class StubRequest(object):
+    """
+    A request received by a :class:`StubProvider`.
+    """
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class StubProvider(object):
+    """
+    A fake OAuth provider that runs a real HTTP server on a local port, in a
+    background thread. Register responses with :meth:`add`; every request
+    it receives is recorded in :attr:`requests`.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        provider = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def handle_request(self):
+                provider.handle(self)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05},
+        )
+        self.thread.daemon = True
+
+    def add(self, method, path, body="", status=200, headers=None, delay=0):
+        """
+        Respond to ``method`` requests for ``path``. ``body`` may be a string,
+        a dict or list (sent as JSON), or a function that takes a
+        :class:`StubRequest` and returns a ``(status, headers, body)`` tuple.
+        ``delay`` is a number of seconds to wait before responding.
+        """
+        self.routes[(method, path)] = (body, status, headers or {}, delay)
+
+    def calls(self, method=None, path=None):
+        return [
+            req for req in self.requests
+            if (method is None or req.method == method) and
+               (path is None or req.path == path)
+        ]
+
+    def handle(self, handler):
+        url = urlsplit(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length).decode("utf-8") if length else ""
+        req = StubRequest(
+            handler.command, url.path, url.query, dict(handler.headers), body,
+        )
+        with self._lock:
+            self.requests.append(req)
+        route = self.routes.get((handler.command, url.path))
+        if route is None:
+            status, headers, body = 404, {}, "not found"
+        else:
+            body, status, headers, delay = route
+            if delay:
+                time.sleep(delay)
+            if callable(body):
+                status, headers, body = body(req)
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            headers = dict(headers)
+            headers.setdefault("Content-Type", "application/json")
+        body = body.encode("utf-8")
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_provider(request):
+    """
+    A :class:`StubProvider` that is running for the duration of the test.
+    """
+    provider = StubProvider()
+    provider.start()
+    request.addfinalizer(provider.stop)
+    return provider
@@ -0,0 +1,66 @@
+import pytest
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import (
+    BaseBackend, NullBackend, BulkNotSupported,
+)
+
+
+class SingleTokenBackend(BaseBackend):
+    """
+    A backend written to the documented interface, without ``user_id``.
+    """
+    def __init__(self):
+        self.token = None
+
+    def get(self, blueprint):
+        return self.token
+
+    def set(self, blueprint, token):
+        self.token = token
+
+    def delete(self, blueprint):
+        self.token = None
+
+
+class PerUserBackend(BaseBackend):
+    def __init__(self):
+        self.tokens = {}
+
+    def get(self, blueprint, user_id=None):
+        return self.tokens.get(user_id)
+
+    def set(self, blueprint, token, user_id=None):
+        self.tokens[user_id] = token
+
+    def delete(self, blueprint, **kwargs):
+        self.tokens.pop(kwargs.get("user_id"), None)
+
+
+def test_null_backend_bulk():
+    bp = OAuth2ConsumerBlueprint("test-service", __name__)
+    backend = NullBackend()
+    assert backend.get_many(bp, [1, 2]) == {}
+    backend.set_many(bp, {1: {"access_token": "one"}})
+    backend.delete_many(bp, [1])
+
+
+def test_bulk_without_user_id():
+    bp = OAuth2ConsumerBlueprint("test-service", __name__)
+    backend = SingleTokenBackend()
+    with pytest.raises(BulkNotSupported):
+        backend.get_many(bp, [1, 2])
+    with pytest.raises(BulkNotSupported):
+        backend.set_many(bp, {1: {"access_token": "one"}})
+    with pytest.raises(BulkNotSupported):
+        backend.delete_many(bp, [1])
+
+
+def test_bulk_with_user_id():
+    bp = OAuth2ConsumerBlueprint("test-service", __name__)
+    backend = PerUserBackend()
+    backend.set_many(bp, [(1, {"access_token": "one"}), (2, {"access_token": "two"})])
+    assert backend.get_many(bp, [1, 2, 3]) == {
+        1: {"access_token": "one"}, 2: {"access_token": "two"},
+    }
+    backend.delete_many(bp, [1])
+    assert backend.get_many(bp, [1, 2]) == {2: {"access_token": "two"}}
@@ -0,0 +1,152 @@
+import os
+import binascii
+import tempfile
+import pytest
+import flask
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import BulkNotSupported
+from flask_dance.consumer.backend.session import (
+    SessionBackend, MemoryTokenStore, SQLiteTokenStore,
+)
+
+
+def random_string(length):
+    return binascii.hexlify(os.urandom(length // 2)).decode("ascii")
+
+
+TOKEN = {
+    "access_token": random_string(200),
+    "refresh_token": random_string(200),
+    "id_token": random_string(1500),
+    "token_type": "bearer",
+    "scope": ["profile", "email"],
+}
+
+
+@pytest.fixture
+def sqlite_path(request):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    request.addfinalizer(lambda: os.remove(path))
+    return path
+
+
+def make_app(backend):
+    blueprint = OAuth2ConsumerBlueprint("test-service", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        base_url="https://example.com",
+        backend=backend,
+    )
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(blueprint, url_prefix="/login")
+    return app, blueprint
+
+
+def test_session_backend_without_store():
+    app, bp = make_app(SessionBackend())
+    with app.test_request_context("/"):
+        bp.token = TOKEN
+        assert flask.session["test-service_oauth_token"] == TOKEN
+        assert bp.backend.get(bp) == TOKEN
+
+
+def test_session_backend_bulk_lookup():
+    app, bp = make_app(SessionBackend())
+    with app.test_request_context("/"):
+        assert list(bp.backend.iter_tokens(bp)) == []
+        bp.token = TOKEN
+        # only the current request's token is known, and it has no user
+        assert list(bp.backend.iter_tokens(bp)) == [(None, TOKEN)]
+        # other users' tokens aren't in this session
+        assert bp.backend.get_many(bp, [1, 2]) == {}
+
+
+def test_session_backend_bulk_write():
+    app, bp = make_app(SessionBackend())
+    with app.test_request_context("/"):
+        bp.token = TOKEN
+        with pytest.raises(BulkNotSupported):
+            bp.backend.set_many(bp, {1: TOKEN})
+        with pytest.raises(BulkNotSupported):
+            bp.backend.delete_many(bp, [1])
+        # the current request's token is left alone
+        assert bp.backend.get(bp) == TOKEN
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda path: MemoryTokenStore(),
+    lambda path: SQLiteTokenStore(path),
+], ids=["memory", "sqlite"])
+def test_session_backend_with_store(make_store, sqlite_path):
+    store = make_store(sqlite_path)
+    app, bp = make_app(SessionBackend(store=store))
+    with app.test_request_context("/"):
+        bp.token = TOKEN
+        handle = flask.session["test-service_oauth_token"]
+        assert len(handle) == 32
+        assert store.get(handle) == TOKEN
+        assert bp.backend.get(bp) == TOKEN
+
+        # a new token gets a new handle, and the old one is forgotten
+        bp.token = {"access_token": "new"}
+        new_handle = flask.session["test-service_oauth_token"]
+        assert new_handle != handle
+        assert store.get(handle) is None
+        assert bp.backend.get(bp) == {"access_token": "new"}
+
+        del bp.token
+        assert "test-service_oauth_token" not in flask.session
+        assert store.get(new_handle) is None
+        assert bp.backend.get(bp) is None
+
+
+def test_session_backend_store_shrinks_cookie():
+    app, bp = make_app(SessionBackend())
+    with app.test_request_context("/"):
+        bp.token = TOKEN
+        full = app.session_interface.get_signing_serializer(app).dumps(dict(flask.session))
+
+    app, bp = make_app(SessionBackend(store=MemoryTokenStore()))
+    with app.test_request_context("/"):
+        bp.token = TOKEN
+        compact = app.session_interface.get_signing_serializer(app).dumps(dict(flask.session))
+
+    assert len(full) > 1000
+    assert len(compact) < 150
+
+
+def test_session_backend_store_reads_legacy_token():
+    app, bp = make_app(SessionBackend(store=MemoryTokenStore()))
+    with app.test_request_context("/"):
+        flask.session["test-service_oauth_token"] = TOKEN
+        assert bp.backend.get(bp) == TOKEN
+        bp.token = {"access_token": "new"}
+        assert bp.backend.get(bp) == {"access_token": "new"}
+
+
+def test_session_backend_store_missing_token():
+    store = MemoryTokenStore()
+    app, bp = make_app(SessionBackend(store=store))
+    with app.test_request_context("/"):
+        bp.token = TOKEN
+        store.clear()
+        assert bp.backend.get(bp) is None
+
+
+def test_sqlite_token_store_timeout(sqlite_path):
+    store = SQLiteTokenStore(sqlite_path, timeout=60)
+    store.set("live", TOKEN)
+    store.set("dead", TOKEN, timeout=-1)
+    assert store.get("live") == TOKEN
+    assert store.get("dead") is None
+
+    store.set("dead", TOKEN, timeout=-1)
+    assert store.purge_expired() == 1
+
+    # tokens are shared between connections to the same database
+    other = SQLiteTokenStore(sqlite_path)
+    assert other.get("live") == TOKEN
+    other.close()
+    store.close()
@@ -2,6 +2,8 @@ import pytest
 sa = pytest.importorskip("sqlalchemy")
 
 import os
+import time
+import mock
 import responses
 import flask
 from lazy import lazy
@@ -9,9 +11,14 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event
 from sqlalchemy.orm.exc import NoResultFound
 from flask_cache import Cache
+from flask_dance.utils import LocalCache
 from flask_login import LoginManager, UserMixin, current_user, login_user, logout_user
 from flask_dance.consumer import OAuth2ConsumerBlueprint, oauth_authorized
-from flask_dance.consumer.backend.sqla import OAuthConsumerMixin, SQLAlchemyBackend
+from flask_dance.consumer.backend import sqla
+from flask_dance.consumer.refresh import RefreshScheduler
+from flask_dance.consumer.backend.sqla import (
+    OAuthConsumerMixin, SQLAlchemyBackend, NO_TOKEN
+)
 try:
     import blinker
 except ImportError:
@@ -110,7 +117,7 @@ def test_sqla_backend_without_user(app, db, blueprint, request):
             assert resp.status_code == 302
             assert resp.headers["Location"] == "https://a.b.c/oauth_done"
 
-    assert len(queries) == 3
+    assert len(queries) == 2
 
     # check the database
     authorizations = OAuth.query.all()
@@ -187,7 +194,7 @@ def test_sqla_backend(app, db, blueprint, request):
             assert resp.status_code == 302
             assert resp.headers["Location"] == "https://a.b.c/oauth_done"
 
-    assert len(queries) == 4
+    assert len(queries) == 3
 
     # check the database
     alice = User.query.first()
@@ -321,7 +328,7 @@ def test_sqla_flask_login(app, db, blueprint, request):
             assert resp.status_code == 302
             assert resp.headers["Location"] == "https://a.b.c/oauth_done"
 
-    assert len(queries) == 5
+    assert len(queries) == 4
 
     # lets do it again, with Bob as the logged in user -- he gets a different token
     responses.reset()
@@ -346,7 +353,7 @@ def test_sqla_flask_login(app, db, blueprint, request):
             assert resp.status_code == 302
             assert resp.headers["Location"] == "https://a.b.c/oauth_done"
 
-    assert len(queries) == 5
+    assert len(queries) == 4
 
     # check the database
     authorizations = OAuth.query.all()
@@ -428,7 +435,7 @@ def test_sqla_flask_login_anon_to_authed(app, db, blueprint, request):
             assert resp.status_code == 302
             assert resp.headers["Location"] == "https://a.b.c/oauth_done"
 
-    assert len(queries) == 6
+    assert len(queries) == 5
 
     # check the database
     users = User.query.all()
@@ -599,7 +606,8 @@ def test_sqla_overwrite_token(app, db, blueprint, request):
             assert resp.status_code == 302
             assert resp.headers["Location"] == "https://a.b.c/oauth_done"
 
-    assert len(queries) == 3
+    # the existing record is updated in place
+    assert len(queries) == 1
 
     # check that the database record was overwritten
     authorizations = OAuth.query.all()
@@ -642,7 +650,7 @@ def test_sqla_cache(app, db, blueprint, request):
             assert resp.status_code == 302
             assert resp.headers["Location"] == "https://a.b.c/oauth_done"
 
-    assert len(queries) == 3
+    assert len(queries) == 2
 
     expected_token = {
         "access_token": "foobar",
@@ -673,3 +681,745 @@ def test_sqla_cache(app, db, blueprint, request):
     with record_queries(db.engine) as queries:
         assert blueprint.token == expected_token
     assert len(queries) == 0
+
+
+def test_sqla_negative_cache(app, db, blueprint, request):
+    cache = Cache(app)
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        pass
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session, cache=cache)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    # first reference to the missing token should generate SQL queries
+    with record_queries(db.engine) as queries:
+        assert blueprint.token is None
+    assert len(queries) == 1
+
+    # the miss should be cached, so subsequent references should not
+    with record_queries(db.engine) as queries:
+        assert blueprint.token is None
+        assert blueprint.token is None
+    assert len(queries) == 0
+
+    # setting a token should invalidate the cached miss
+    blueprint.token = {"access_token": "abc", "token_type": "bearer"}
+    with record_queries(db.engine) as queries:
+        assert blueprint.token == {"access_token": "abc", "token_type": "bearer"}
+    assert len(queries) == 1
+
+
+class RecordingCache(object):
+    def __init__(self):
+        self.data = {}
+        self.timeouts = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+        self.timeouts[key] = timeout
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.timeouts.pop(key, None)
+
+
+def test_sqla_cache_timeouts(app, db, blueprint, request):
+    cache = RecordingCache()
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    blueprint.backend = SQLAlchemyBackend(
+        OAuth, db.session, cache=cache,
+        cache_timeout=600, negative_cache_timeout=30,
+    )
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    now = time.time()
+    db.session.add_all([
+        # no expiry: cached for the full timeout
+        OAuth(provider="test-service", user_id=1, token={"access_token": "one"}),
+        # expires soon: cached only until it expires
+        OAuth(provider="test-service", user_id=2,
+              token={"access_token": "two", "expires_at": now + 60}),
+        # already expired: not cached at all
+        OAuth(provider="test-service", user_id=3,
+              token={"access_token": "three", "expires_at": now - 60}),
+    ])
+    db.session.commit()
+
+    for user_id in (1, 2, 3, 4):
+        blueprint.backend.get(blueprint, user_id=user_id)
+
+    assert cache.timeouts["flask_dance_token|test-service|1"] == 600
+    assert 50 < cache.timeouts["flask_dance_token|test-service|2"] <= 60
+    assert "flask_dance_token|test-service|3" not in cache.data
+    assert cache.data["flask_dance_token|test-service|4"] is NO_TOKEN
+    assert cache.timeouts["flask_dance_token|test-service|4"] == 30
+
+
+def test_sqla_cache_off_and_forever(app, db, blueprint, request):
+    cache = RecordingCache()
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    now = time.time()
+    db.session.add_all([
+        OAuth(provider="test-service", user_id=1, token={"access_token": "one"}),
+        OAuth(provider="test-service", user_id=2,
+              token={"access_token": "two", "expires_at": now + 60}),
+    ])
+    db.session.commit()
+
+    # False turns caching off
+    backend = SQLAlchemyBackend(
+        OAuth, db.session, cache=cache,
+        cache_timeout=False, negative_cache_timeout=False,
+    )
+    for user_id in (1, 2, 3):
+        backend.get(blueprint, user_id=user_id)
+    assert cache.data == {}
+
+    # 0 is passed on to the cache, which keeps entries forever, but tokens
+    # are still dropped when they expire
+    backend = SQLAlchemyBackend(
+        OAuth, db.session, cache=cache,
+        cache_timeout=0, negative_cache_timeout=0,
+    )
+    for user_id in (1, 2, 3):
+        backend.get(blueprint, user_id=user_id)
+    assert cache.timeouts["flask_dance_token|test-service|1"] == 0
+    assert 50 < cache.timeouts["flask_dance_token|test-service|2"] <= 60
+    assert cache.data["flask_dance_token|test-service|3"] is NO_TOKEN
+    assert cache.timeouts["flask_dance_token|test-service|3"] == 0
+
+
+def test_sqla_default_cache(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        pass
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session)
+    assert isinstance(blueprint.backend.cache, LocalCache)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    blueprint.token = {"access_token": "abc", "token_type": "bearer"}
+
+    with record_queries(db.engine) as queries:
+        assert blueprint.token == {"access_token": "abc", "token_type": "bearer"}
+        assert blueprint.token == {"access_token": "abc", "token_type": "bearer"}
+    assert len(queries) == 1
+    assert blueprint.backend.cache.hits == 1
+
+
+def test_sqla_default_cache_misses(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session, user_id=1)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    # the default cache is private to this process, so misses aren't cached
+    with record_queries(db.engine) as queries:
+        assert blueprint.token is None
+        assert blueprint.token is None
+    assert len(queries) == 2
+
+    # as if another worker process had linked the account
+    db.session.add(OAuth(provider="test-service", user_id=1,
+                         token={"access_token": "abc"}))
+    db.session.commit()
+    assert blueprint.token == {"access_token": "abc"}
+
+    # unless negative_cache_timeout asks for it
+    blueprint.backend = SQLAlchemyBackend(
+        OAuth, db.session, user_id=2, negative_cache_timeout=30,
+    )
+    with record_queries(db.engine) as queries:
+        assert blueprint.token is None
+        assert blueprint.token is None
+    assert len(queries) == 1
+
+
+def test_sqla_resolve_identity_once(app, db, blueprint, request):
+    login_manager = LoginManager(app)
+
+    class User(db.Model, UserMixin):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(80))
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer, db.ForeignKey(User.id))
+        user = db.relationship(User)
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session, user=current_user)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    alice = User(name="Alice")
+    alice_token = {"access_token": "alice123", "token_type": "bearer"}
+    bob = User(name="Bob")
+    bob_token = {"access_token": "bob456", "token_type": "bearer"}
+    db.session.add_all([
+        alice, bob,
+        OAuth(user=alice, token=alice_token, provider="test-service"),
+        OAuth(user=bob, token=bob_token, provider="test-service"),
+    ])
+    db.session.commit()
+
+    @login_manager.user_loader
+    def load_user(userid):
+        return User.query.get(userid)
+
+    with app.test_request_context("/"):
+        login_user(alice)
+        with mock.patch("flask_dance.consumer.backend.sqla._get_real_user",
+                        wraps=sqla._get_real_user) as get_real_user:
+            assert blueprint.backend.get(blueprint) == alice_token
+            calls = get_real_user.call_count
+            assert blueprint.backend.get(blueprint) == alice_token
+            blueprint.backend.make_cache_key(blueprint)
+            # current_user was only resolved once
+            assert get_real_user.call_count == calls
+
+            # changing the blueprint config means resolving the user again
+            blueprint.config["user_id"] = bob.id
+            assert blueprint.backend.get(blueprint) == bob_token
+            del blueprint.config["user_id"]
+            assert blueprint.backend.get(blueprint) == alice_token
+            assert get_real_user.call_count == calls * 2
+
+    with app.test_request_context("/"):
+        # a new request resolves the user again
+        login_user(bob)
+        assert blueprint.backend.get(blueprint) == bob_token
+
+
+def test_sqla_upsert_index(app, db, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    class OAuthWithoutUser(db.Model, OAuthConsumerMixin):
+        pass
+
+    indexes = {idx.name: idx for idx in OAuth.__table__.indexes}
+    index = indexes["uq_flask_dance_oauth_provider_user_id"]
+    assert index.unique
+    assert [col.name for col in index.columns] == ["provider", "user_id"]
+    assert not OAuthWithoutUser.__table__.indexes
+
+
+@pytest.mark.parametrize("dialect_name,expected", [
+    ("postgresql", "ON CONFLICT (provider, user_id) DO UPDATE SET"),
+    ("mysql", "ON DUPLICATE KEY UPDATE"),
+])
+def test_sqla_upsert_statement(app, db, dialect_name, expected):
+    dialect_module = pytest.importorskip("sqlalchemy.dialects." + dialect_name)
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    backend = SQLAlchemyBackend(OAuth, db.session)
+    backend._unique_user_key = True
+    bind = mock.Mock()
+    bind.dialect.name = dialect_name
+    with mock.patch.object(backend.session, "get_bind", return_value=bind):
+        stmt = backend._upsert_statement({
+            "provider": "test-service", "user_id": 1, "token": {"access_token": "a"},
+        })
+    if stmt is None:
+        pytest.skip("this version of SQLAlchemy can't upsert on " + dialect_name)
+    sql = str(stmt.compile(dialect=dialect_module.dialect()))
+    assert sql.startswith("INSERT INTO flask_dance_oauth")
+    assert expected in sql
+
+
+def test_sqla_upsert_sqlite(app, db, blueprint, request):
+    from sqlalchemy.dialects import sqlite
+    if not hasattr(sqlite, "insert"):
+        pytest.skip("this version of SQLAlchemy can't upsert on sqlite")
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("only runs against SQLite")
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    assert blueprint.backend._upsert_statement({
+        "provider": "test-service", "user_id": 1, "token": {},
+    }) is not None
+    blueprint.backend.set(blueprint, {"access_token": "one"}, user_id=1)
+    with record_queries(db.engine) as queries:
+        blueprint.backend.set(blueprint, {"access_token": "two"}, user_id=1)
+        blueprint.backend.set(blueprint, {"access_token": "bob"}, user_id=2)
+    assert len(queries) == 2
+    assert all(query.startswith("INSERT") for query in queries)
+
+    tokens = {o.user_id: o.token for o in OAuth.query.all()}
+    assert tokens == {1: {"access_token": "two"}, 2: {"access_token": "bob"}}
+
+
+def test_sqla_set_without_index(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+    # a table created before the model declared the unique index
+    db.session.execute("DROP INDEX uq_flask_dance_oauth_provider_user_id")
+    db.session.commit()
+
+    assert blueprint.backend._upsert_statement({
+        "provider": "test-service", "user_id": 1, "token": {},
+    }) is None
+    blueprint.backend.set(blueprint, {"access_token": "one"}, user_id=1)
+    blueprint.backend.set(blueprint, {"access_token": "two"}, user_id=1)
+    blueprint.backend.set_many(blueprint, {2: {"access_token": "bob"}})
+
+    tokens = {o.user_id: o.token for o in OAuth.query.all()}
+    assert tokens == {1: {"access_token": "two"}, 2: {"access_token": "bob"}}
+
+
+def test_sqla_set_in_place(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add(OAuth(provider="test-service", user_id=2, token={"access_token": "bob"}))
+    db.session.commit()
+
+    blueprint.backend.set(blueprint, {"access_token": "one"}, user_id=1)
+    with record_queries(db.engine) as queries:
+        blueprint.backend.set(blueprint, {"access_token": "two"}, user_id=1)
+    # a single statement: either an upsert, or an update in place
+    assert len(queries) == 1
+
+    tokens = {o.user_id: o.token for o in OAuth.query.all()}
+    assert tokens == {1: {"access_token": "two"}, 2: {"access_token": "bob"}}
+
+
+def test_sqla_get_loads_only_token(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session, user_id=7)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add(OAuth(provider="test-service", user_id=7, token={"access_token": "a"}))
+    db.session.commit()
+    db.session.expunge_all()
+
+    with record_queries(db.engine) as queries:
+        assert blueprint.token == {"access_token": "a"}
+    assert len(queries) == 1
+    select_clause = queries[0].split("FROM")[0]
+    assert "token" in select_clause
+    assert "created_at" not in select_clause
+    # no model instances were loaded into the session
+    assert len(db.session.identity_map) == 0
+
+
+def test_sqla_refresh_lock(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    backend = SQLAlchemyBackend(OAuth, db.session, user_id=7)
+    blueprint.backend = backend
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add(OAuth(provider="test-service", user_id=7, token={"access_token": "a"}))
+    db.session.commit()
+    # a stale token in the cache doesn't hide the one in the database
+    backend.cache.set(backend.make_cache_key(blueprint), {"access_token": "stale"})
+
+    with record_queries(db.engine) as queries:
+        with backend.refresh_lock(blueprint) as token:
+            assert token == {"access_token": "a"}
+            blueprint.token = {"access_token": "b"}
+    assert blueprint.token == {"access_token": "b"}
+
+    with pytest.raises(ValueError):
+        with backend.refresh_lock(blueprint, user_id=8) as token:
+            assert token is None
+            raise ValueError()
+
+
+def test_sqla_get_many(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    backend = SQLAlchemyBackend(OAuth, db.session)
+    blueprint.backend = backend
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add_all([
+        OAuth(provider="test-service", user_id=uid, token={"access_token": str(uid)})
+        for uid in range(1, 11)
+    ] + [
+        OAuth(provider="other-service", user_id=11, token={"access_token": "x"}),
+    ])
+    db.session.commit()
+
+    with record_queries(db.engine) as queries:
+        tokens = backend.get_many(blueprint, range(1, 13), batch_size=5)
+    # one query per batch of users
+    assert len(queries) == 3
+    assert all(" IN " in query for query in queries)
+    assert tokens == dict(
+        (uid, {"access_token": str(uid)}) for uid in range(1, 11)
+    )
+    assert backend.get_many(blueprint, []) == {}
+    # nothing was cached
+    assert len(backend.cache) == 0
+
+
+def test_sqla_get_many_without_user_id(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        pass
+
+    backend = SQLAlchemyBackend(OAuth, db.session)
+    blueprint.backend = backend
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add(OAuth(provider="test-service", token={"access_token": "a"}))
+    db.session.commit()
+
+    # without a user_id column, every user gets the one token
+    assert backend.get_many(blueprint, [1, 2]) == {
+        1: {"access_token": "a"}, 2: {"access_token": "a"},
+    }
+    assert list(backend.iter_tokens(blueprint)) == [(None, {"access_token": "a"})]
+
+
+def test_sqla_iter_tokens(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    backend = SQLAlchemyBackend(OAuth, db.session)
+    blueprint.backend = backend
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add_all([
+        OAuth(provider="test-service", user_id=uid, token={"access_token": str(uid)})
+        for uid in range(1, 26)
+    ] + [
+        OAuth(provider="test-service", user_id=26, token=None),
+        OAuth(provider="other-service", user_id=27, token={"access_token": "x"}),
+    ])
+    db.session.commit()
+
+    tokens = backend.iter_tokens(blueprint, batch_size=10)
+    assert sorted(tokens) == sorted(
+        (uid, {"access_token": str(uid)}) for uid in range(1, 26)
+    )
+    # no model instances are loaded
+    assert len(db.session.identity_map) == 0
+
+
+
+def test_sqla_set_many(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    cache = LocalCache()
+    backend = SQLAlchemyBackend(OAuth, db.session, cache=cache)
+    blueprint.backend = backend
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add_all([
+        OAuth(provider="test-service", user_id=1, token={"access_token": "old"}),
+        OAuth(provider="other-service", user_id=2, token={"access_token": "x"}),
+    ])
+    db.session.commit()
+    assert backend.get(blueprint, user_id=1) == {"access_token": "old"}
+
+    tokens = [(uid, {"access_token": str(uid)}) for uid in range(1, 11)]
+    # the last token for a user wins
+    tokens.append((10, {"access_token": "new"}))
+    upsert = backend._upsert_insert(["provider", "user_id", "token"])
+    commit = mock.patch.object(db.session, "commit", wraps=db.session.commit)
+    with record_queries(db.engine) as queries, commit as commit:
+        backend.set_many(blueprint, tokens, batch_size=6)
+    if upsert is None:
+        # without an upsert, each batch is one DELETE and one executemany INSERT
+        assert len(queries) == 4
+    else:
+        assert len(queries) == 2
+    assert commit.call_count == 2
+
+    expected = dict(tokens)
+    assert backend.get_many(blueprint, range(1, 11)) == expected
+    # cached tokens were invalidated
+    assert backend.get(blueprint, user_id=1) == {"access_token": "1"}
+    assert db.session.query(OAuth).count() == 11
+    other = db.session.query(OAuth).filter_by(provider="other-service").one()
+    assert other.token == {"access_token": "x"}
+
+    # dicts work too
+    backend.set_many(blueprint, {1: {"access_token": "dict"}})
+    assert backend.get(blueprint, user_id=1) == {"access_token": "dict"}
+
+
+def test_sqla_delete_many(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    backend = SQLAlchemyBackend(OAuth, db.session, cache=LocalCache())
+    blueprint.backend = backend
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    backend.set_many(blueprint, [
+        (uid, {"access_token": str(uid)}) for uid in range(1, 6)
+    ])
+    assert backend.get(blueprint, user_id=2) == {"access_token": "2"}
+
+    with record_queries(db.engine) as queries:
+        backend.delete_many(blueprint, [1, 2, 3, 4], batch_size=2)
+    assert len(queries) == 2
+    assert all(query.startswith("DELETE") for query in queries)
+    assert backend.get(blueprint, user_id=2) is None
+    assert backend.get_many(blueprint, range(1, 6)) == {5: {"access_token": "5"}}
+
+
+def test_sqla_refresh_scheduler(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    backend = SQLAlchemyBackend(OAuth, db.session, cache=LocalCache())
+    blueprint.backend = backend
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    soon = time.time() + 60
+    later = time.time() + 3600
+    db.session.add_all([
+        OAuth(provider="test-service", user_id=1, token={
+            "access_token": "a1", "refresh_token": "r1", "expires_at": soon,
+        }),
+        OAuth(provider="test-service", user_id=2, token={
+            "access_token": "a2", "refresh_token": "r2", "expires_at": later,
+        }),
+        OAuth(provider="test-service", user_id=3, token={
+            "access_token": "a3", "expires_at": soon,
+        }),
+    ])
+    db.session.commit()
+    # cached tokens are invalidated when the scheduler stores a new one
+    assert backend.get(blueprint, user_id=1)["access_token"] == "a1"
+
+    scheduler = RefreshScheduler(app, window=300)
+    assert scheduler.blueprints == [blueprint]
+    assert [job[1] for job in scheduler.scan()] == [1]
+    scheduler.run_once()
+
+    assert scheduler.refreshed == 1
+    assert len(responses.calls) == 1
+    body = responses.calls[0].request.body
+    assert "grant_type=refresh_token" in body
+    assert "refresh_token=r1" in body
+    assert "client_id=client_id" in body
+    token = backend.get(blueprint, user_id=1)
+    assert token["access_token"] == "foobar"
+    assert token["refresh_token"] == "r1"
+
+    # nothing is left to refresh
+    assert scheduler.scan() == []
+
+    # a token that someone else refreshed is skipped
+    stale = {"access_token": "a1", "refresh_token": "r1", "expires_at": soon}
+    assert scheduler.refresh(blueprint, 1, stale) is None
+    assert scheduler.skipped == 1
+
+    # errors from the provider are counted, not raised
+    responses.replace(
+        responses.POST, "https://example.com/oauth/access_token",
+        body='{"error":"invalid_grant"}', status=400,
+    )
+    db.session.query(OAuth).filter_by(user_id=2).update({"token": {
+        "access_token": "a2", "refresh_token": "r2", "expires_at": soon,
+    }}, synchronize_session=False)
+    db.session.commit()
+    scheduler.run_once()
+    assert scheduler.failed == 1
+    assert scheduler.refreshed == 1
+    assert backend.get(blueprint, user_id=2)["access_token"] == "a2"
+
+
+def test_sqla_expiring_tokens_column(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+        expires_at = db.Column(db.Float, index=True)
+
+    backend = SQLAlchemyBackend(OAuth, db.session)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    now = time.time()
+    backend.set(blueprint, {
+        "access_token": "a1", "refresh_token": "r1", "expires_at": now + 60,
+    }, user_id=1)
+    backend.set_many(blueprint, {
+        2: {"access_token": "a2", "refresh_token": "r2", "expires_at": now + 3600},
+        3: {"access_token": "a3", "refresh_token": "r3"},
+        4: {"access_token": "a4", "expires_at": now + 60},
+    })
+    expires = dict(db.session.query(OAuth.user_id, OAuth.expires_at))
+    assert expires[1] == now + 60
+    assert expires[2] == now + 3600
+    assert expires[3] is None
+
+    with record_queries(db.engine) as queries:
+        tokens = list(backend.expiring_tokens(blueprint, now + 300))
+    assert [uid for uid, token in tokens] == [1]
+    # expiring tokens are found in the database, not in Python
+    assert len(queries) == 1
+    assert "expires_at <" in queries[0]
+
+
+def test_sqla_refresh_scheduler_rate_limit(app, blueprint):
+    scheduler = RefreshScheduler(app, rate_limit=20)
+    start = time.time()
+    for _ in range(3):
+        scheduler._throttle(blueprint.name)
+    assert time.time() - start >= 0.09
+
+
+def test_sqla_refresh_scheduler_threads(app, db, blueprint, request):
+
+    class OAuth(db.Model, OAuthConsumerMixin):
+        user_id = db.Column(db.Integer)
+
+    blueprint.backend = SQLAlchemyBackend(OAuth, db.session)
+
+    db.create_all()
+    def done():
+        db.session.remove()
+        db.drop_all()
+    request.addfinalizer(done)
+
+    db.session.add(OAuth(provider="test-service", user_id=1, token={
+        "access_token": "a1", "refresh_token": "r1", "expires_at": time.time(),
+    }))
+    db.session.commit()
+
+    scheduler = RefreshScheduler(app, interval=0.01, workers=1)
+    scheduler.start()
+    try:
+        deadline = time.time() + 5
+        while not scheduler.refreshed and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        scheduler.stop(timeout=5)
+    assert scheduler.refreshed == 1
+    assert scheduler.failed == 0
+    assert not scheduler._threads
@@ -0,0 +1,235 @@
+from __future__ import unicode_literals
+
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+import pytest
+httpx = pytest.importorskip("httpx")
+
+import flask
+from flask_dance.consumer import OAuth1ConsumerBlueprint, OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.aio import (
+    BaseAsyncSession, AsyncOAuth1Session, AsyncOAuth2Session, get_async_client,
+)
+
+
+@pytest.fixture(autouse=True)
+def insecure_transport(monkeypatch):
+    # the stub provider doesn't use HTTPS
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class CountingBackend(MemoryBackend):
+    gets = 0
+    sets = 0
+
+    def get(self, blueprint):
+        self.gets += 1
+        return super(CountingBackend, self).get(blueprint)
+
+    def set(self, blueprint, token):
+        self.sets += 1
+        super(CountingBackend, self).set(blueprint, token)
+
+
+def make_oauth2_app(base_url, token, **kwargs):
+    blueprint = OAuth2ConsumerBlueprint("test-service", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        base_url=base_url,
+        token_url="/oauth/access_token",
+        backend=CountingBackend(token),
+        **kwargs
+    )
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(blueprint, url_prefix="/login")
+    return app, blueprint
+
+
+def test_oauth2_async_session(stub_provider):
+    stub_provider.add("GET", "/user", {"login": "dance"})
+    app, bp = make_oauth2_app(stub_provider.url, {
+        "access_token": "abc", "token_type": "bearer",
+    })
+
+    async def calls():
+        sess = bp.async_session
+        first = await sess.get("/user", params={"page": 2})
+        second = await sess.get("/user")
+        await sess.aclose()
+        return first, second
+
+    with app.test_request_context("/"):
+        assert isinstance(bp.async_session, AsyncOAuth2Session)
+        first, second = run(calls())
+
+    assert first.json() == {"login": "dance"}
+    assert second.status_code == 200
+    requests = stub_provider.calls("GET", "/user")
+    assert [r.headers["Authorization"] for r in requests] == ["Bearer abc"] * 2
+    assert requests[0].query == "page=2"
+    # the token was only loaded from the backend once
+    assert bp.backend.gets == 1
+
+
+def test_oauth2_async_session_auto_refresh(stub_provider):
+    stub_provider.add("GET", "/user", {"login": "dance"})
+    stub_provider.add("POST", "/oauth/access_token", {
+        "access_token": "new", "token_type": "bearer", "expires_in": 3600,
+    }, delay=0.05)
+    app, bp = make_oauth2_app(stub_provider.url, {
+        "access_token": "old", "token_type": "bearer",
+        "refresh_token": "refresh", "expires_at": time.time() - 10,
+    }, auto_refresh_url="/oauth/access_token",
+       auto_refresh_kwargs={"client_id": "client_id"})
+
+    async def calls():
+        sess = bp.async_session
+        responses = await asyncio.gather(*[sess.get("/user") for _ in range(5)])
+        await sess.aclose()
+        return responses
+
+    with app.test_request_context("/"):
+        responses = run(calls())
+
+    assert [r.status_code for r in responses] == [200] * 5
+    refreshes = stub_provider.calls("POST", "/oauth/access_token")
+    assert len(refreshes) == 1
+    assert "grant_type=refresh_token" in refreshes[0].body
+    assert "refresh_token=refresh" in refreshes[0].body
+    auths = [r.headers["Authorization"] for r in stub_provider.calls("GET", "/user")]
+    assert auths == ["Bearer new"] * 5
+    assert bp.backend.sets == 1
+    assert bp.backend.token["access_token"] == "new"
+    assert bp.backend.token["refresh_token"] == "refresh"
+
+
+def test_oauth1_async_session(stub_provider):
+    stub_provider.add("POST", "/statuses", {"ok": True})
+    bp = OAuth1ConsumerBlueprint("test-service", __name__,
+        client_key="client_key",
+        client_secret="client_secret",
+        base_url=stub_provider.url,
+        backend=MemoryBackend({
+            "oauth_token": "token", "oauth_token_secret": "secret",
+        }),
+    )
+    app = flask.Flask(__name__)
+    app.register_blueprint(bp, url_prefix="/login")
+
+    async def calls():
+        sess = bp.async_session
+        resp = await sess.post("/statuses", data={"status": "dancing"})
+        await sess.aclose()
+        return resp
+
+    with app.test_request_context("/"):
+        assert isinstance(bp.async_session, AsyncOAuth1Session)
+        resp = run(calls())
+
+    assert resp.json() == {"ok": True}
+    req = stub_provider.calls("POST", "/statuses")[0]
+    assert req.body == "status=dancing"
+    auth = req.headers["Authorization"]
+    assert auth.startswith("OAuth ")
+    assert 'oauth_consumer_key="client_key"' in auth
+    assert 'oauth_token="token"' in auth
+    assert "oauth_signature=" in auth
+
+
+def test_async_client_per_event_loop():
+    bp = OAuth2ConsumerBlueprint("test-service", __name__, pool_maxsize=3)
+
+    async def client():
+        return get_async_client(bp)
+
+    loop1 = asyncio.new_event_loop()
+    loop2 = asyncio.new_event_loop()
+    try:
+        client1 = loop1.run_until_complete(client())
+        assert loop1.run_until_complete(client()) is client1
+        client2 = loop2.run_until_complete(client())
+        assert client2 is not client1
+    finally:
+        loop1.run_until_complete(client1.aclose())
+        loop2.run_until_complete(client2.aclose())
+        loop1.close()
+        loop2.close()
+
+
+class ThreadRecordingBackend(MemoryBackend):
+    def __init__(self, token):
+        super(ThreadRecordingBackend, self).__init__(token)
+        self.calls = []
+
+    def record(self, name):
+        self.calls.append(
+            (name, threading.current_thread().name, flask.has_request_context())
+        )
+
+    def get(self, blueprint):
+        self.record("get")
+        return super(ThreadRecordingBackend, self).get(blueprint)
+
+    def set(self, blueprint, token):
+        self.record("set")
+        super(ThreadRecordingBackend, self).set(blueprint, token)
+
+    @contextmanager
+    def refresh_lock(self, blueprint):
+        self.record("lock")
+        yield self.token
+        self.record("unlock")
+
+
+def test_base_async_session_is_abstract():
+    with pytest.raises(TypeError):
+        BaseAsyncSession()
+
+
+def test_oauth2_async_backend_off_event_loop(stub_provider):
+    stub_provider.add("GET", "/user", {"login": "dance"})
+    stub_provider.add("POST", "/oauth/access_token", {
+        "access_token": "new", "token_type": "bearer", "expires_in": 3600,
+    })
+    app, bp = make_oauth2_app(stub_provider.url, None,
+        auto_refresh_url="/oauth/access_token",
+        auto_refresh_kwargs={"client_id": "client_id"},
+    )
+    bp.backend = ThreadRecordingBackend({
+        "access_token": "old", "token_type": "bearer",
+        "refresh_token": "refresh", "expires_at": time.time() - 10,
+    })
+
+    async def calls():
+        sess = bp.async_session
+        resp = await sess.get("/user")
+        await sess.aclose()
+        return resp
+
+    with app.test_request_context("/"):
+        assert run(calls()).status_code == 200
+
+    loop_thread = threading.current_thread().name
+    names = [name for name, thread, has_request in bp.backend.calls]
+    # the refresh holds the backend's refresh lock, like a synchronous one
+    assert names == ["get", "lock", "set", "unlock"]
+    for name, thread, has_request in bp.backend.calls:
+        assert thread != loop_thread
+        assert has_request
+    # the lock is taken and released on the same thread
+    threads = dict((name, thread) for name, thread, _ in bp.backend.calls)
+    assert threads["lock"] == threads["set"] == threads["unlock"]
+    assert bp.refresh_coordinator.refreshed == 1
+    assert bp.backend.token["access_token"] == "new"
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+
+import json
+import pytest
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.http_cache import ConditionalCache
+
+
+@pytest.fixture(autouse=True)
+def insecure_transport(monkeypatch):
+    # the stub provider doesn't use HTTPS
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+
+
+BODY = {"login": "dance", "repos": list(range(100))}
+
+
+def etag_resource(req):
+    if req.headers.get("If-None-Match") == '"v1"':
+        return 304, {"ETag": '"v1"'}, ""
+    return 200, {"ETag": '"v1"', "Content-Type": "application/json"}, BODY
+
+
+def make_blueprint(stub_provider, cache, token="abc"):
+    return OAuth2ConsumerBlueprint("test-service", __name__,
+        base_url=stub_provider.url,
+        backend=MemoryBackend({"access_token": token, "token_type": "bearer"}),
+        http_cache=cache,
+    )
+
+
+def test_etag(stub_provider):
+    stub_provider.add("GET", "/user", etag_resource)
+    cache = ConditionalCache()
+    bp = make_blueprint(stub_provider, cache)
+
+    first = bp.session.get("/user")
+    second = bp.session.get("/user")
+
+    assert first.json() == BODY
+    assert second.status_code == 200
+    assert second.json() == BODY
+    assert second.headers["Content-Type"] == "application/json"
+    assert second.from_cache
+    calls = stub_provider.calls("GET", "/user")
+    assert "If-None-Match" not in calls[0].headers
+    assert calls[1].headers["If-None-Match"] == '"v1"'
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.bytes_saved == len(json.dumps(BODY))
+
+
+def test_last_modified(stub_provider):
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    def resource(req):
+        if req.headers.get("If-Modified-Since") == date:
+            return 304, {}, ""
+        return 200, {"Last-Modified": date}, "hello"
+    stub_provider.add("GET", "/user", resource)
+    cache = ConditionalCache()
+    bp = make_blueprint(stub_provider, cache)
+
+    assert bp.session.get("/user").text == "hello"
+    assert bp.session.get("/user").text == "hello"
+    assert cache.hits == 1
+
+
+def test_cache_is_per_token(stub_provider):
+    stub_provider.add("GET", "/user", etag_resource)
+    cache = ConditionalCache()
+    make_blueprint(stub_provider, cache, token="abc").session.get("/user")
+    make_blueprint(stub_provider, cache, token="def").session.get("/user")
+
+    calls = stub_provider.calls("GET", "/user")
+    assert "If-None-Match" not in calls[1].headers
+    assert cache.hits == 0
+    assert cache.misses == 2
+
+
+def test_not_cached(stub_provider):
+    stub_provider.add("GET", "/plain", "no validators")
+    stub_provider.add("GET", "/private", "secret",
+        headers={"ETag": '"v1"', "Cache-Control": "no-store"})
+    stub_provider.add("POST", "/user", etag_resource)
+    cache = ConditionalCache()
+    bp = make_blueprint(stub_provider, cache)
+
+    for _ in range(2):
+        bp.session.get("/plain")
+        bp.session.get("/private")
+        bp.session.post("/user")
+
+    assert len(cache.store) == 0
+    assert not any("If-None-Match" in call.headers for call in stub_provider.requests)
+
+
+def test_disabled_by_default(stub_provider):
+    stub_provider.add("GET", "/user", etag_resource)
+    bp = make_blueprint(stub_provider, None)
+    bp.session.get("/user")
+    bp.session.get("/user")
+    assert not any("If-None-Match" in call.headers for call in stub_provider.requests)
+
+
+def test_batch_uses_cache(stub_provider):
+    stub_provider.add("GET", "/user", etag_resource)
+    cache = ConditionalCache()
+    bp = make_blueprint(stub_provider, cache)
+    bp.session.get("/user")
+    results = bp.session.batch(["/user"] * 3)
+    assert [r.json() for r in results] == [BODY] * 3
+    assert cache.hits == 3
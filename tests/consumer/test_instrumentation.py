@@ -0,0 +1,241 @@
+from __future__ import unicode_literals
+
+import logging
+import pytest
+import mock
+import requests
+import responses
+import flask
+from flask_dance.consumer import (
+    OAuth1ConsumerBlueprint, OAuth2ConsumerBlueprint,
+    oauth_authorized, oauth_span,
+)
+from flask_dance.consumer.base import Span
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.instrumentation import LoggingObserver, MetricsRegistry
+
+try:
+    import blinker
+except ImportError:
+    blinker = None
+requires_blinker = pytest.mark.skipif(not blinker, reason="requires blinker")
+
+
+def make_app(blueprint):
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(blueprint, url_prefix="/login")
+
+    @app.route("/")
+    def index():
+        return "index"
+
+    return app
+
+
+def make_oauth2_blueprint():
+    return OAuth2ConsumerBlueprint("test-service", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        state="random-string",
+        base_url="https://api.example.com",
+        authorization_url="https://example.com/oauth/authorize",
+        token_url="https://example.com/oauth/access_token",
+        redirect_to="index",
+        backend=MemoryBackend(),
+    )
+
+
+@pytest.fixture
+def spans(request):
+    recorded = []
+    def record(blueprint, **kwargs):
+        kwargs["blueprint"] = blueprint.name
+        recorded.append(kwargs)
+    if blinker:
+        oauth_span.connect(record)
+        request.addfinalizer(lambda: oauth_span.disconnect(record))
+    return recorded
+
+
+def test_no_receivers():
+    bp = make_oauth2_blueprint()
+    span = bp.span("login")
+    assert not isinstance(span, Span)
+    with span as entered:
+        entered.status = "error"
+    assert span.status is None
+
+
+@requires_blinker
+@responses.activate
+def test_oauth2_dance(spans):
+    responses.add(
+        responses.POST,
+        "https://example.com/oauth/access_token",
+        body='{"access_token":"foobar","token_type":"bearer","scope":""}',
+    )
+    bp = make_oauth2_blueprint()
+    app = make_app(bp)
+
+    with app.test_client() as client:
+        client.get("/login/test-service")
+        resp = client.get(
+            "/login/test-service/authorized?code=secret-code&state=random-string",
+            base_url="https://a.b.c",
+        )
+    assert resp.status_code == 302
+
+    phases = [(s["phase"], s["status"], s["host"]) for s in spans]
+    assert phases == [
+        ("login", "ok", "example.com"),
+        ("fetch_token", "ok", "example.com"),
+        ("backend.set", "ok", "api.example.com"),
+        ("authorized", "ok", "example.com"),
+    ]
+    assert all(s["blueprint"] == "test-service" for s in spans)
+    assert all(s["duration"] >= 0 for s in spans)
+    assert all(s["error"] is None for s in spans)
+
+    del spans[:]
+    assert bp.token["access_token"] == "foobar"
+    del bp.token
+    assert bp.token is None
+    assert [(s["phase"], s["status"]) for s in spans] == [
+        ("backend.get", "ok"), ("backend.delete", "ok"), ("backend.get", "miss"),
+    ]
+
+
+@requires_blinker
+def test_oauth2_provider_error(spans):
+    bp = make_oauth2_blueprint()
+    app = make_app(bp)
+    with app.test_client() as client:
+        client.get("/login/test-service/authorized?error=access_denied")
+    assert [(s["phase"], s["status"], s["error"]) for s in spans] == [
+        ("authorized", "error", "access_denied"),
+    ]
+
+
+@requires_blinker
+@responses.activate
+def test_oauth2_declined(spans, request):
+    responses.add(
+        responses.POST,
+        "https://example.com/oauth/access_token",
+        body='{"access_token":"foobar","token_type":"bearer","scope":""}',
+    )
+    def decline(blueprint, token):
+        return False
+    oauth_authorized.connect(decline)
+    request.addfinalizer(lambda: oauth_authorized.disconnect(decline))
+
+    bp = make_oauth2_blueprint()
+    app = make_app(bp)
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["test-service_oauth_state"] = "random-string"
+        client.get(
+            "/login/test-service/authorized?code=secret-code&state=random-string",
+            base_url="https://a.b.c",
+        )
+    assert [(s["phase"], s["status"]) for s in spans] == [
+        ("fetch_token", "ok"), ("authorized", "declined"),
+    ]
+
+
+@requires_blinker
+def test_oauth1_fetch_error(spans):
+    bp = OAuth1ConsumerBlueprint("test-service", __name__,
+        client_key="client_key",
+        client_secret="client_secret",
+        base_url="https://example.com",
+        request_token_url="https://example.com/oauth/request_token",
+        access_token_url="https://example.com/oauth/access_token",
+        authorization_url="https://example.com/oauth/authorize",
+    )
+    app = make_app(bp)
+    timeout = requests.Timeout("too slow")
+    with mock.patch.object(bp.session_class, "fetch_request_token", side_effect=timeout):
+        with app.test_client() as client:
+            resp = client.get("/login/test-service")
+    assert resp.status_code == 302
+    assert [(s["phase"], s["status"], s["error"]) for s in spans] == [
+        ("fetch_request_token", "error", timeout),
+        ("login", "error", timeout),
+    ]
+
+
+@requires_blinker
+def test_refresh(spans):
+    bp = make_oauth2_blueprint()
+    stale = {"access_token": "old", "refresh_token": "r"}
+    token = bp.refresh_coordinator.refresh(bp, stale, lambda: {"access_token": "new"})
+    assert token == {"access_token": "new"}
+    assert [s["phase"] for s in spans] == ["refresh", "backend.set"]
+    assert spans[0]["host"] == "example.com"
+
+
+@requires_blinker
+def test_logging_observer(request):
+    logger = mock.Mock(spec=logging.Logger)
+    logger.isEnabledFor.return_value = True
+    observer = LoggingObserver(logger).connect()
+    request.addfinalizer(observer.disconnect)
+
+    bp = make_oauth2_blueprint()
+    bp.token = {"access_token": "a"}
+    logger.log.assert_called_once_with(
+        logging.DEBUG, "%s %s %s in %.1f ms (host %s)",
+        "test-service", "backend.set", "ok", mock.ANY, "api.example.com",
+    )
+
+    logger.reset_mock()
+    with pytest.raises(ValueError):
+        with bp.span("refresh"):
+            raise ValueError("nope")
+    args = logger.log.call_args[0]
+    assert args[0] == logging.WARNING
+    assert args[2:4] == ("test-service", "refresh")
+    assert str(args[-1]) == "nope"
+
+    # nothing is formatted if the level is disabled
+    logger.reset_mock()
+    logger.isEnabledFor.return_value = False
+    bp.token
+    assert not logger.log.called
+
+
+@requires_blinker
+def test_metrics_registry(request):
+    metrics = MetricsRegistry(buckets=(0.1, 1)).connect()
+    request.addfinalizer(metrics.disconnect)
+    bp = make_oauth2_blueprint()
+
+    with mock.patch("flask_dance.consumer.base.default_timer", side_effect=[0, 0.05]):
+        bp.token
+    with mock.patch("flask_dance.consumer.base.default_timer", side_effect=[0, 0.5]):
+        bp.token
+    with mock.patch("flask_dance.consumer.base.default_timer", side_effect=[0, 3]):
+        bp.token = {"access_token": "a"}
+
+    assert metrics.count() == 3
+    assert metrics.count(phase="backend.get") == 2
+    assert metrics.count(phase="backend.get", status="ok") == 0
+    labels = 'blueprint="test-service",phase="backend.get",status="miss",host="api.example.com"'
+    lines = metrics.render().splitlines()
+    assert lines[:2] == [
+        "# HELP flask_dance_span_seconds Time spent in each phase of the OAuth dance.",
+        "# TYPE flask_dance_span_seconds histogram",
+    ]
+    assert lines[2:7] == [
+        'flask_dance_span_seconds_bucket{%s,le="0.1"} 1' % labels,
+        'flask_dance_span_seconds_bucket{%s,le="1.0"} 2' % labels,
+        'flask_dance_span_seconds_bucket{%s,le="+Inf"} 2' % labels,
+        'flask_dance_span_seconds_sum{%s} 0.55' % labels,
+        'flask_dance_span_seconds_count{%s} 2' % labels,
+    ]
+    assert 'phase="backend.set",status="ok",host="api.example.com",le="1.0"} 0' in lines[8]
+
+    metrics.clear()
+    assert metrics.count() == 0
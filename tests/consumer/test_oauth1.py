@@ -5,13 +5,16 @@ try:
     from urllib.parse import quote_plus
 except ImportError:
     from urllib import quote_plus
+import threading
 import pytest
 import mock
 import responses
 import flask
 from flask_dance.consumer import OAuth1ConsumerBlueprint, oauth_authorized
+from oauthlib.common import to_unicode
 from oauthlib.oauth1.rfc5849.utils import parse_authorization_header
 from flask_dance.consumer.requests import OAuth1Session
+from flask_dance.consumer.backend import MemoryBackend
 
 try:
     import blinker
@@ -343,3 +346,109 @@ def test_custom_session_class():
     )
     assert isinstance(bp.session, CustomOAuth1Session)
     assert bp.session.my_attr == "foobar"
+
+
+def test_shared_transport():
+    app, bp = make_app()
+    with app.test_request_context("/"):
+        sess1 = bp.session
+    with app.test_request_context("/"):
+        sess2 = bp.session
+
+    assert sess1 is not sess2
+    assert sess1.get_adapter("https://example.com/") is bp.transport
+    assert sess2.get_adapter("https://example.com/") is bp.transport
+
+
+@responses.activate
+def test_batch():
+    responses.add(responses.GET, "https://example.com/a", body="a")
+    responses.add(responses.POST, "https://example.com/b", body="b")
+    app, bp = make_app()
+    bp.backend = MemoryBackend({
+        "oauth_token": "token", "oauth_token_secret": "secret",
+    })
+    with app.test_request_context("/"):
+        results = bp.session.batch([
+            "/a",
+            ("POST", "/b", {"data": {"status": "dancing"}}),
+        ])
+
+    assert [r.text for r in results] == ["a", "b"]
+    signatures = set()
+    for call in responses.calls:
+        header = to_unicode(call.request.headers["Authorization"])
+        auth = dict(parse_authorization_header(header))
+        assert auth["oauth_token"] == "token"
+        signatures.add(auth["oauth_signature"])
+    # each request is signed separately
+    assert len(signatures) == 2
+
+
+@responses.activate
+def test_token_not_written_to_client():
+    responses.add(responses.GET, "https://example.com/user")
+    app, bp = make_app()
+    bp.backend = MemoryBackend({
+        "oauth_token": "token", "oauth_token_secret": "secret",
+    })
+    with app.test_request_context("/"):
+        assert bp.session.authorized
+        bp.session.get("/user")
+        client = bp.session.auth.client
+
+    header = to_unicode(responses.calls[0].request.headers["Authorization"])
+    assert dict(parse_authorization_header(header))["oauth_token"] == "token"
+    # the credentials were passed to a copy of the client, for this request
+    assert client.resource_owner_key is None
+    assert client.resource_owner_secret is None
+    assert bp.signer.client.resource_owner_key is None
+
+
+def test_signer_reused():
+    app, bp = make_app()
+    bp.from_config["client_key"] = "CLIENT_KEY"
+    app.config["CLIENT_KEY"] = "client_key"
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        signer = bp.signer
+        client1 = bp.session.auth.client
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert bp.signer is signer
+        client2 = bp.session.auth.client
+
+    # every session gets its own copy of the client, for the OAuth dance
+    assert client1 is not client2 is not signer.client
+    assert client2.client_key == "client_key"
+
+    app.config["CLIENT_KEY"] = "new_key"
+    # the app config is only read once, unless asked to read it again
+    bp.reload_config(app)
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert bp.signer is not signer
+        assert bp.session.auth.client.client_key == "new_key"
+
+
+def test_signer_threads():
+    app, bp = make_app()
+    signer = bp.signer
+    errors = []
+
+    def sign(n):
+        token = {"oauth_token": "token-{}".format(n), "oauth_token_secret": "s"}
+        for _ in range(200):
+            _, headers, _ = signer.sign("https://example.com/", token=token)
+            auth = dict(parse_authorization_header(
+                to_unicode(headers["Authorization"])
+            ))
+            if auth["oauth_token"] != token["oauth_token"]:
+                errors.append(auth["oauth_token"])
+
+    threads = [threading.Thread(target=sign, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -6,8 +6,11 @@ try:
 except ImportError:
     from urllib import quote_plus
     from urlparse import parse_qsl
+import time
+import threading
 import pytest
 import mock
+import requests
 import responses
 from urlobject import URLObject
 import flask
@@ -15,6 +18,8 @@ from flask_dance.consumer import (
     OAuth2ConsumerBlueprint, oauth_authorized, oauth_error
 )
 from flask_dance.consumer.requests import OAuth2Session
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.refresh import RefreshCoordinator
 
 try:
     import blinker
@@ -420,3 +425,342 @@ def test_custom_session_class():
     )
     assert isinstance(bp.session, CustomOAuth2Session)
     assert bp.session.my_attr == "foobar"
+
+
+def test_shared_transport():
+    bp = OAuth2ConsumerBlueprint("test", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        base_url="https://example.com",
+        authorization_url="https://example.com/oauth/authorize",
+        token_url="https://example.com/oauth/access_token",
+        pool_maxsize=4,
+    )
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(bp, url_prefix="/login")
+
+    with app.test_request_context("/"):
+        sess1 = bp.session
+    with app.test_request_context("/"):
+        sess2 = bp.session
+
+    # each request gets its own session...
+    assert sess1 is not sess2
+    # ...but they all send requests over the same connection pool
+    adapter = sess1.get_adapter("https://example.com/user")
+    assert adapter is bp.transport
+    assert sess2.get_adapter("https://example.com/user") is adapter
+    assert adapter._pool_maxsize == 4
+
+
+def test_session_per_thread():
+    app, bp = make_app()
+    started = threading.Event()
+    torn_down = threading.Event()
+    sessions = {}
+
+    def other_request():
+        with app.test_request_context("/"):
+            sessions["other"] = bp.session
+            started.set()
+            torn_down.wait(5)
+            # the other request's teardown didn't touch this one's session
+            sessions["other_after"] = bp.session
+
+    thread = threading.Thread(target=other_request)
+    thread.start()
+    started.wait(5)
+    with app.test_request_context("/"):
+        sessions["main"] = bp.session
+    torn_down.set()
+    thread.join(5)
+
+    assert sessions["main"] is not sessions["other"]
+    assert sessions["other_after"] is sessions["other"]
+
+
+@responses.activate
+def test_auto_refresh_stores_token_once():
+    responses.add(
+        responses.POST,
+        "https://example.com/oauth/access_token",
+        body='{"access_token":"new-token","token_type":"bearer",'
+             '"refresh_token":"refresh","expires_in":3600}',
+    )
+    responses.add(responses.GET, "https://example.com/user")
+    class CountingBackend(MemoryBackend):
+        sets = 0
+        def set(self, blueprint, token):
+            self.sets += 1
+            super(CountingBackend, self).set(blueprint, token)
+
+    backend = CountingBackend({
+        "access_token": "old-token",
+        "token_type": "bearer",
+        "refresh_token": "refresh",
+        "expires_at": 1,
+    })
+    bp = OAuth2ConsumerBlueprint("test-service", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        base_url="https://example.com",
+        token_url="https://example.com/oauth/access_token",
+        auto_refresh_url="https://example.com/oauth/access_token",
+        backend=backend,
+    )
+    bp.session.get("/user")
+
+    assert len(responses.calls) == 2
+    assert responses.calls[1].request.headers["Authorization"] == "Bearer new-token"
+    assert backend.sets == 1
+    assert backend.token["access_token"] == "new-token"
+    assert bp.refresh_coordinator.refreshed == 1
+
+
+def test_refresh_coordinator_single_flight():
+    stale = {"access_token": "old-token", "refresh_token": "refresh", "expires_at": 1}
+    bp = OAuth2ConsumerBlueprint("test-service", __name__,
+        backend=MemoryBackend(stale),
+    )
+    coordinator = RefreshCoordinator()
+    calls = []
+    def refresh():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"access_token": "new-token", "refresh_token": "refresh"}
+
+    results = []
+    def worker():
+        results.append(coordinator.refresh(bp, stale, refresh))
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [t["access_token"] for t in results] == ["new-token"] * 10
+    assert coordinator.refreshed == 1
+    assert coordinator.reused == 9
+    # no locks are left behind
+    assert not coordinator._locks
+
+
+@responses.activate
+def test_batch():
+    for name in ("a", "b", "c"):
+        responses.add(responses.GET, "https://example.com/" + name, body=name)
+    app, bp = make_app()
+    bp.backend = MemoryBackend({"access_token": "abc", "token_type": "bearer"})
+    with app.test_request_context("/"):
+        results = bp.session.batch(["/c", "/a", ("GET", "/b"), "/missing"],
+            return_exceptions=True)
+
+    assert [r.text for r in results[:3]] == ["c", "a", "b"]
+    assert isinstance(results[3], Exception)
+    auths = [call.request.headers.get("Authorization") for call in responses.calls]
+    assert auths == ["Bearer abc"] * 4
+
+    with app.test_request_context("/"):
+        with pytest.raises(Exception):
+            bp.session.batch(["/a", "/missing"])
+
+
+@responses.activate
+def test_batch_refreshes_token_once():
+    responses.add(
+        responses.POST,
+        "https://example.com/oauth/access_token",
+        body='{"access_token":"new-token","token_type":"bearer","expires_in":3600}',
+    )
+    responses.add(responses.GET, "https://example.com/user")
+    app, bp = make_app()
+    bp.auto_refresh_url = "https://example.com/oauth/access_token"
+    bp.backend = MemoryBackend({
+        "access_token": "old-token",
+        "token_type": "bearer",
+        "refresh_token": "refresh",
+        "expires_at": 1,
+    })
+    with app.test_request_context("/"):
+        results = bp.session.batch(["/user"] * 5)
+
+    assert [r.status_code for r in results] == [200] * 5
+    methods = [call.request.method for call in responses.calls]
+    assert methods == ["POST"] + ["GET"] * 5
+    auths = [call.request.headers["Authorization"] for call in responses.calls[1:]]
+    assert auths == ["Bearer new-token"] * 5
+
+
+def test_batch_is_concurrent(stub_provider, monkeypatch):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    stub_provider.add("GET", "/slow", "slow", delay=0.2)
+    bp = OAuth2ConsumerBlueprint("test-service", __name__,
+        base_url=stub_provider.url,
+        backend=MemoryBackend({"access_token": "abc", "token_type": "bearer"}),
+    )
+    start = time.time()
+    results = bp.session.batch(["/slow"] * 5, max_workers=5, timeout=5)
+    elapsed = time.time() - start
+
+    assert [r.text for r in results] == ["slow"] * 5
+    assert elapsed < 0.6
+    assert len(stub_provider.calls("GET", "/slow")) == 5
+
+
+def make_paginated_provider(stub_provider, total=10000):
+    def page(req):
+        query = dict(parse_qsl(req.query))
+        number = int(query.get("page", 1))
+        per_page = int(query.get("per_page", 30))
+        start = (number - 1) * per_page
+        items = [{"id": i} for i in range(start, min(start + per_page, total))]
+        headers = {}
+        if start + per_page < total:
+            headers["Link"] = '<{url}/items?page={next}&per_page={per_page}>; rel="next"'.format(
+                url=stub_provider.url, next=number + 1, per_page=per_page,
+            )
+        return 200, headers, items
+    stub_provider.add("GET", "/items", page)
+    return OAuth2ConsumerBlueprint("test-service", __name__,
+        base_url=stub_provider.url,
+        backend=MemoryBackend({"access_token": "abc", "token_type": "bearer"}),
+    )
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 3])
+def test_paginate(stub_provider, monkeypatch, prefetch):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    bp = make_paginated_provider(stub_provider)
+    items = bp.session.paginate(
+        "/items", params={"per_page": 100}, prefetch=prefetch,
+    )
+    ids = [item["id"] for item in items]
+
+    assert ids == list(range(10000))
+    calls = stub_provider.calls("GET", "/items")
+    assert len(calls) == 100
+    assert all(call.headers["Authorization"] == "Bearer abc" for call in calls)
+
+
+def test_paginate_stops_early(stub_provider, monkeypatch):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    bp = make_paginated_provider(stub_provider)
+    items = bp.session.paginate("/items", params={"per_page": 10}, prefetch=2)
+    # the first page is fetched right away
+    assert len(stub_provider.calls()) == 1
+    for item in items:
+        if item["id"] == 25:
+            break
+    items.close()
+    time.sleep(0.3)
+    # only a few pages past the last one that was used were fetched
+    assert len(stub_provider.calls()) <= 6
+
+
+def test_paginate_error(stub_provider, monkeypatch):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    stub_provider.add("GET", "/search", status=200, body={"items": [1, 2]},
+        headers={"Link": '<{}/broken>; rel="next"'.format(stub_provider.url)})
+    bp = OAuth2ConsumerBlueprint("test-service", __name__,
+        base_url=stub_provider.url,
+        backend=MemoryBackend({"access_token": "abc", "token_type": "bearer"}),
+    )
+    items = bp.session.paginate("/search")
+    assert next(items) == 1
+    assert next(items) == 2
+    with pytest.raises(requests.HTTPError):
+        next(items)
+
+
+def test_paginate_in_request_context(stub_provider, monkeypatch):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    bp = make_paginated_provider(stub_provider, total=50)
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(bp, url_prefix="/login")
+    with app.test_request_context("/"):
+        items = list(bp.session.paginate("/items", params={"per_page": 10}))
+    assert [item["id"] for item in items] == list(range(50))
+
+
+def test_load_config_once():
+    app, bp = make_app()
+    bp.from_config["client_id"] = "CLIENT_ID"
+    bp.from_config["session.scope"] = "SCOPE"
+    app.config["CLIENT_ID"] = "config-id"
+    app.config["SCOPE"] = "config-scope"
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert bp.client_id == "config-id"
+        assert bp.session.scope == "config-scope"
+
+    app.config["CLIENT_ID"] = "changed-id"
+    with mock.patch.object(bp, "_read_config", wraps=bp._read_config) as read:
+        with app.test_request_context("/"):
+            app.preprocess_request()
+            assert bp.client_id == "config-id"
+            # dotpaths are set on every request, for the new session
+            assert bp.session.scope == "config-scope"
+    assert not read.called
+
+
+def test_reload_config():
+    app, bp = make_app()
+    bp.from_config["client_id"] = "CLIENT_ID"
+    app.config["CLIENT_ID"] = "config-id"
+    with app.test_request_context("/"):
+        app.preprocess_request()
+    app.config["CLIENT_ID"] = "changed-id"
+    bp.reload_config(app)
+    assert bp.client_id == "changed-id"
+
+    app.config["CLIENT_ID"] = "changed-again"
+    with app.test_request_context("/"):
+        bp.reload_config()
+    assert bp.client_id == "changed-again"
+
+
+def test_watch_config():
+    app, bp = make_app()
+    bp.watch_config = True
+    bp.from_config["client_id"] = "CLIENT_ID"
+    app.config["CLIENT_ID"] = "config-id"
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert bp.client_id == "config-id"
+    app.config["CLIENT_ID"] = "changed-id"
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert bp.client_id == "changed-id"
+
+
+def test_change_from_config():
+    app, bp = make_app()
+    app.config["CLIENT_ID"] = "config-id"
+    app.config["OTHER_CLIENT_ID"] = "other-id"
+    bp.from_config["client_id"] = "CLIENT_ID"
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert bp.client_id == "config-id"
+    bp.from_config["client_id"] = "OTHER_CLIENT_ID"
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert bp.client_id == "other-id"
+
+
+def test_load_config_per_app():
+    app1, bp = make_app()
+    bp.from_config["client_id"] = "CLIENT_ID"
+    app1.config["CLIENT_ID"] = "first-id"
+    app2 = flask.Flask(__name__)
+    app2.secret_key = "secret"
+    app2.register_blueprint(bp, url_prefix="/login")
+    app2.config["CLIENT_ID"] = "second-id"
+    with app1.test_request_context("/"):
+        app1.preprocess_request()
+        assert bp.client_id == "first-id"
+    with app2.test_request_context("/"):
+        app2.preprocess_request()
+        assert bp.client_id == "second-id"
@@ -0,0 +1,164 @@
+from __future__ import unicode_literals
+
+import time
+import pytest
+import mock
+import responses
+import flask
+from requests import Response
+from flask_dance.consumer import OAuth2ConsumerBlueprint
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.ratelimit import (
+    RateLimitTracker, RateLimitExceeded,
+    github_resource, endpoint_resource,
+)
+from flask_dance.contrib.github import make_github_blueprint
+from flask_dance.contrib.twitter import make_twitter_blueprint
+
+
+def make_response(remaining, limit=5000, reset=None, prefix="X-RateLimit-", status=200):
+    response = Response()
+    response.status_code = status
+    response.headers[prefix + "Limit"] = str(limit)
+    response.headers[prefix + "Remaining"] = str(remaining)
+    response.headers[prefix + "Reset"] = str(int(reset or time.time() + 3600))
+    return response
+
+
+TOKEN = {"access_token": "abc"}
+
+
+def test_resources():
+    assert github_resource("https://api.github.com/user") == "core"
+    assert github_resource("https://api.github.com/search/code?q=x") == "search"
+    assert github_resource("https://api.github.com/graphql") == "graphql"
+    assert (endpoint_resource("https://api.twitter.com/1.1/statuses/show/20.json") ==
+            endpoint_resource("https://api.twitter.com/1.1/statuses/show/21.json") ==
+            "/1.1/statuses/show/:id.json")
+
+
+def test_track_per_token():
+    tracker = RateLimitTracker()
+    key = tracker.make_key(TOKEN, "https://example.com/")
+    tracker.update(key, make_response(4000))
+    app_key = tracker.make_key(None, "https://example.com/")
+    tracker.update(app_key, make_response(10, limit=60, prefix="X-Rate-Limit-"))
+
+    assert tracker.get(TOKEN).remaining == 4000
+    assert tracker.get(TOKEN).limit == 5000
+    assert tracker.get().remaining == 10
+    assert tracker.get({"access_token": "other"}) is None
+    # the token itself isn't kept
+    assert "abc" not in repr(list(tracker._quotas._data))
+
+
+def test_used_up_fail():
+    tracker = RateLimitTracker(mode="fail")
+    key = tracker.make_key(TOKEN, "https://example.com/")
+    tracker.update(key, make_response(0, reset=time.time() + 30))
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        tracker.acquire(key)
+    assert excinfo.value.rate_limit.remaining == 0
+    assert 0 < excinfo.value.wait <= 30
+
+
+def test_used_up_wait():
+    tracker = RateLimitTracker(max_wait=5)
+    key = tracker.make_key(TOKEN, "https://example.com/")
+    tracker.update(key, make_response(0, reset=time.time() + 30))
+    with pytest.raises(RateLimitExceeded):
+        tracker.acquire(key)
+
+    tracker.update(key, make_response(0, reset=time.time() + 2))
+    with mock.patch("time.sleep") as sleep:
+        tracker.acquire(key)
+    assert 0 < sleep.call_args[0][0] <= 2
+
+
+def test_reset_forgets_quota():
+    tracker = RateLimitTracker(mode="fail")
+    key = tracker.make_key(TOKEN, "https://example.com/")
+    tracker.update(key, make_response(0, reset=time.time() - 1))
+    tracker.acquire(key)
+    assert tracker.get(TOKEN) is None
+
+
+def test_quotas_are_bounded():
+    tracker = RateLimitTracker(maxsize=2)
+    for secret in ("one", "two", "three"):
+        key = tracker.make_key({"access_token": secret}, "https://example.com/")
+        tracker.update(key, make_response(4000))
+    assert len(tracker._quotas) == 2
+    assert tracker.get({"access_token": "one"}) is None
+    assert tracker.get({"access_token": "three"}).remaining == 4000
+
+    # quotas that have already reset aren't kept at all
+    key = tracker.make_key(TOKEN, "https://example.com/")
+    tracker.update(key, make_response(4000, reset=time.time() - 1))
+    assert tracker.get(TOKEN) is None
+
+
+def test_pacing():
+    tracker = RateLimitTracker(pace_below=0.1)
+    key = tracker.make_key(TOKEN, "https://example.com/")
+    # the reset time is truncated to whole seconds, so this is 10-11s away
+    tracker.update(key, make_response(10, limit=1000, reset=time.time() + 11))
+    with mock.patch("time.sleep") as sleep:
+        for _ in range(3):
+            tracker.acquire(key)
+    waits = [call[0][0] for call in sleep.call_args_list]
+    # the first request goes right away, then they are spaced out
+    assert len(waits) == 2
+    assert 0.9 < waits[0] < 1.2
+    assert 2 < waits[1] < 2.4
+    assert tracker.get(TOKEN).remaining == 7
+
+    # plenty of quota left: no pacing
+    tracker.update(key, make_response(900, limit=1000))
+    with mock.patch("time.sleep") as sleep:
+        tracker.acquire(key)
+    assert not sleep.called
+
+
+def test_retry_after():
+    tracker = RateLimitTracker(mode="fail")
+    key = tracker.make_key(TOKEN, "https://example.com/")
+    response = make_response(0, reset=1, status=429)
+    response.headers["Retry-After"] = "20"
+    tracker.update(key, response)
+    assert tracker.get(TOKEN).reset > time.time() + 15
+
+
+@responses.activate
+def test_github_rate_limit():
+    responses.add(
+        responses.GET, "https://api.github.com/user",
+        headers={
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(int(time.time() + 600)),
+        },
+    )
+    bp = make_github_blueprint(rate_limit=True, backend=MemoryBackend(
+        {"access_token": "abc", "token_type": "bearer"}
+    ))
+    assert isinstance(bp.rate_limit, RateLimitTracker)
+    assert bp.rate_limit.mode == "fail"
+    bp.session.get("/user")
+    rate_limit = bp.rate_limit.get({"access_token": "abc"}, "https://api.github.com/user")
+    assert rate_limit.limit == 5000
+    assert rate_limit.remaining == 0
+
+    with pytest.raises(RateLimitExceeded):
+        bp.session.get("/user")
+    # the request wasn't sent
+    assert len(responses.calls) == 1
+
+
+def test_rate_limit_disabled():
+    assert make_github_blueprint().rate_limit is None
+    assert make_twitter_blueprint().rate_limit is None
+    tracker = make_twitter_blueprint(rate_limit=True).rate_limit
+    assert tracker.resource is endpoint_resource
+    assert tracker.mode == "fail"
+    assert OAuth2ConsumerBlueprint("test", __name__).rate_limit is None
@@ -0,0 +1,234 @@
+from __future__ import unicode_literals
+
+import time
+import pytest
+import mock
+import requests
+import flask
+from flask_dance.consumer import (
+    OAuth1ConsumerBlueprint, OAuth2ConsumerBlueprint, oauth_error,
+)
+from flask_dance.consumer.backend import MemoryBackend
+from flask_dance.consumer.resilience import (
+    DEFAULT_TIMEOUT, JitteredRetry, CircuitBreaker, CircuitOpenError,
+)
+
+try:
+    import blinker
+except ImportError:
+    blinker = None
+requires_blinker = pytest.mark.skipif(not blinker, reason="requires blinker")
+
+
+@pytest.fixture(autouse=True)
+def insecure_transport(monkeypatch):
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+
+
+def flaky(failures, status=503):
+    """
+    A stub provider route that fails ``failures`` times, and then succeeds.
+    """
+    state = {"calls": 0}
+    def respond(req):
+        state["calls"] += 1
+        if state["calls"] <= failures:
+            return status, {}, "unavailable"
+        return 200, {}, "ok"
+    return respond
+
+
+def make_blueprint(stub_provider, **kwargs):
+    kwargs.setdefault("retries", JitteredRetry(backoff_factor=0))
+    return OAuth2ConsumerBlueprint("test-service", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        base_url=stub_provider.url,
+        token_url="/oauth/access_token",
+        authorization_url="/oauth/authorize",
+        redirect_to="index",
+        backend=MemoryBackend({"access_token": "abc", "token_type": "bearer"}),
+        **kwargs
+    )
+
+
+def test_defaults():
+    bp = OAuth2ConsumerBlueprint("test-service", __name__)
+    assert bp.timeout == DEFAULT_TIMEOUT
+    assert isinstance(bp.retries, JitteredRetry)
+    assert bp.transport.max_retries is bp.retries
+    assert bp.circuit_breaker is None
+
+    bp = OAuth2ConsumerBlueprint("test-service", __name__,
+        timeout=3, retries=0, circuit_breaker=True,
+    )
+    assert bp.timeout == 3
+    assert bp.transport.max_retries.total == 0
+    assert isinstance(bp.circuit_breaker, CircuitBreaker)
+
+
+def test_jittered_backoff():
+    retry = JitteredRetry(total=5, backoff_factor=1)
+    for _ in range(3):
+        retry = retry.increment(method="GET", url="/")
+    assert isinstance(retry, JitteredRetry)
+    with mock.patch("random.uniform", return_value=0.5) as uniform:
+        assert retry.get_backoff_time() == 0.5
+    uniform.assert_called_once_with(0, 4)
+
+
+def test_default_timeout(stub_provider):
+    stub_provider.add("GET", "/slow", "slow", delay=0.5)
+    bp = make_blueprint(stub_provider, timeout=0.1, retries=0)
+    start = time.time()
+    with pytest.raises(requests.Timeout):
+        bp.session.get("/slow")
+    assert time.time() - start < 0.4
+
+    # a timeout passed to the request wins
+    assert bp.session.get("/slow", timeout=2).text == "slow"
+
+
+def test_retry_idempotent(stub_provider):
+    stub_provider.add("GET", "/flaky", flaky(2))
+    stub_provider.add("POST", "/flaky", flaky(2))
+    bp = make_blueprint(stub_provider)
+
+    resp = bp.session.get("/flaky")
+    assert resp.status_code == 200
+    assert len(stub_provider.calls("GET", "/flaky")) == 3
+
+    # POST isn't idempotent, so it isn't retried
+    resp = bp.session.post("/flaky")
+    assert resp.status_code == 503
+    assert len(stub_provider.calls("POST", "/flaky")) == 1
+
+
+def test_circuit_breaker(stub_provider):
+    stub_provider.add("GET", "/flaky", flaky(2))
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    bp = make_blueprint(stub_provider, retries=0, circuit_breaker=breaker)
+
+    assert bp.session.get("/flaky").status_code == 503
+    assert breaker.state(stub_provider.url) == "closed"
+    assert bp.session.get("/flaky").status_code == 503
+    assert breaker.state(stub_provider.url) == "open"
+
+    with pytest.raises(CircuitOpenError) as excinfo:
+        bp.session.get("/flaky")
+    assert 0 < excinfo.value.retry_after <= 0.2
+    # it's a connection error, so existing error handling catches it
+    assert isinstance(excinfo.value, requests.ConnectionError)
+    assert len(stub_provider.calls()) == 2
+
+    time.sleep(0.25)
+    assert breaker.state(stub_provider.url) == "half-open"
+    assert bp.session.get("/flaky").status_code == 200
+    assert breaker.state(stub_provider.url) == "closed"
+    assert len(stub_provider.calls()) == 3
+
+
+def test_circuit_breaker_half_open_failure():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record("example.com", False)
+    assert breaker.state("https://example.com/") == "open"
+    time.sleep(0.15)
+
+    # only one request is let through to try the host again
+    breaker.before_request("example.com")
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("example.com")
+
+    # it failed, so the circuit stays open for another reset_timeout
+    breaker.record("example.com", False)
+    assert breaker.state("https://example.com/") == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("example.com")
+    # other hosts aren't affected
+    breaker.before_request("api.example.com")
+
+
+def test_circuit_breaker_connection_errors():
+    breaker = CircuitBreaker(failure_threshold=2)
+    request = requests.Request("GET", "http://example.com/").prepare()
+    send = mock.Mock(side_effect=requests.ConnectTimeout())
+    for _ in range(2):
+        with pytest.raises(requests.ConnectTimeout):
+            breaker.send(send, request, None)
+    with pytest.raises(CircuitOpenError):
+        breaker.send(send, request, None)
+    assert send.call_count == 2
+
+
+@requires_blinker
+def test_authorized_timeout(stub_provider, request):
+    stub_provider.add("POST", "/oauth/access_token", {
+        "access_token": "foobar", "token_type": "bearer",
+    }, delay=0.5)
+    bp = make_blueprint(stub_provider, timeout=0.1)
+    bp.backend = MemoryBackend()
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(bp, url_prefix="/login")
+
+    @app.route("/")
+    def index():
+        return "index"
+
+    calls = []
+    def callback(*args, **kwargs):
+        calls.append((args, kwargs))
+    oauth_error.connect(callback)
+    request.addfinalizer(lambda: oauth_error.disconnect(callback))
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["test-service_oauth_state"] = "random-string"
+        resp = client.get(
+            "/login/test-service/authorized?code=secret-code&state=random-string",
+        )
+
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == "http://localhost/"
+    assert len(calls) == 1
+    assert calls[0][0] == (bp,)
+    assert isinstance(calls[0][1]["error"], requests.Timeout)
+    assert bp.backend.get(bp) is None
+    # token requests aren't idempotent, so they aren't retried
+    assert len(stub_provider.calls("POST", "/oauth/access_token")) == 1
+
+
+@requires_blinker
+def test_oauth1_login_circuit_open(stub_provider, request):
+    stub_provider.add("POST", "/oauth/request_token", "unavailable", status=503)
+    bp = OAuth1ConsumerBlueprint("test-service", __name__,
+        client_key="client_key",
+        client_secret="client_secret",
+        base_url=stub_provider.url,
+        request_token_url="/oauth/request_token",
+        access_token_url="/oauth/access_token",
+        authorization_url="/oauth/authorize",
+        redirect_url="/error",
+        circuit_breaker=CircuitBreaker(failure_threshold=1),
+    )
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(bp, url_prefix="/login")
+
+    calls = []
+    def callback(*args, **kwargs):
+        calls.append((args, kwargs))
+    oauth_error.connect(callback)
+    request.addfinalizer(lambda: oauth_error.disconnect(callback))
+
+    with app.test_client() as client:
+        # the provider fails, and the circuit opens
+        resp = client.get("/login/test-service")
+        assert resp.status_code == 500
+        resp = client.get("/login/test-service")
+
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == "http://localhost/error"
+    assert len(calls) == 1
+    assert isinstance(calls[0][1]["error"], CircuitOpenError)
+    assert len(stub_provider.calls("POST", "/oauth/request_token")) == 1
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import base64
+import threading
+try:
+    from urllib.parse import parse_qsl, unquote
+except ImportError:
+    from urlparse import parse_qsl
+    from urllib import unquote
+import pytest
+import responses
+from requests.utils import to_native_string
+from urlobject import URLObject
+import flask
+from flask_dance.consumer import OAuth1ConsumerBlueprint, OAuth2ConsumerBlueprint
+from flask_dance.consumer.tenants import Tenant, TenantRegistry, UnknownTenant
+from flask_dance.utils import LocalCache
+
+
+TENANTS = {
+    "acme": {
+        "client_id": "acme-id",
+        "client_secret": "acme-secret",
+        "authorization_url": "https://acme.example.com/oauth/authorize",
+        "token_url": "https://acme.example.com/oauth/access_token",
+    },
+    "globex": {"client_id": "globex-id", "client_secret": "globex-secret"},
+}
+
+
+def make_app(loader=TENANTS.get):
+    blueprint = OAuth2ConsumerBlueprint("test-service", __name__,
+        client_id="client_id",
+        client_secret="client_secret",
+        state="random-string",
+        base_url="https://example.com",
+        authorization_url="https://example.com/oauth/authorize",
+        token_url="https://example.com/oauth/access_token",
+        redirect_to="index",
+        tenants=TenantRegistry(loader),
+    )
+
+    @blueprint.tenant_resolver
+    def resolve_tenant():
+        return flask.request.headers.get("X-Tenant")
+
+    app = flask.Flask(__name__)
+    app.secret_key = "secret"
+    app.register_blueprint(blueprint, url_prefix="/login")
+
+    @app.route("/")
+    def index():
+        return "index"
+
+    return app, blueprint
+
+
+def test_registry_caches_tenants():
+    calls = []
+
+    def loader(tenant_id):
+        calls.append(tenant_id)
+        return TENANTS.get(tenant_id)
+
+    registry = TenantRegistry(loader)
+    tenant = registry.get("acme")
+    assert tenant == Tenant("acme", **TENANTS["acme"])
+    assert registry.get("acme") is tenant
+    assert calls == ["acme"]
+    assert (registry.hits, registry.misses) == (1, 1)
+
+    registry.forget("acme")
+    registry.get("acme")
+    assert calls == ["acme", "acme"]
+
+
+def test_registry_unknown_tenant():
+    calls = []
+
+    def loader(tenant_id):
+        calls.append(tenant_id)
+        return None
+
+    registry = TenantRegistry(loader)
+    for _ in range(3):
+        with pytest.raises(UnknownTenant) as excinfo:
+            registry.get("initech")
+        assert excinfo.value.tenant_id == "initech"
+    # unknown tenants are remembered, too
+    assert calls == ["initech"]
+
+
+def test_registry_counts_concurrent_lookups():
+    registry = TenantRegistry(TENANTS.get)
+    registry.get("acme")
+
+    def lookups():
+        for _ in range(1000):
+            registry.get("acme")
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (registry.hits, registry.misses) == (8000, 1)
+
+
+def test_registry_evicts_least_recently_used():
+    registry = TenantRegistry(lambda tenant_id: {}, maxsize=2)
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    assert registry.cache.evictions == 1
+    registry.get("a")
+    registry.get("c")
+    assert registry.misses == 3
+    registry.get("b")
+    assert registry.misses == 4
+
+
+def test_registry_custom_cache():
+    cache = LocalCache()
+    registry = TenantRegistry(lambda tenant_id: Tenant(tenant_id), cache=cache)
+    tenant = registry.get("acme")
+    assert cache.get(registry.make_key("acme")) is tenant
+
+
+def test_login_per_tenant():
+    app, bp = make_app()
+    with app.test_client() as client:
+        resp = client.get("/login/test-service", headers={"X-Tenant": "acme"},
+            base_url="https://a.b.c")
+        location = URLObject(resp.headers["Location"])
+        assert location.without_query() == "https://acme.example.com/oauth/authorize"
+        assert location.query_dict["client_id"] == "acme-id"
+
+        resp = client.get("/login/test-service", headers={"X-Tenant": "globex"},
+            base_url="https://a.b.c")
+        location = URLObject(resp.headers["Location"])
+        # settings that the tenant doesn't have come from the blueprint
+        assert location.without_query() == "https://example.com/oauth/authorize"
+        assert location.query_dict["client_id"] == "globex-id"
+
+        resp = client.get("/login/test-service", base_url="https://a.b.c")
+        location = URLObject(resp.headers["Location"])
+        assert location.query_dict["client_id"] == "client_id"
+
+    # the blueprint itself is never changed
+    assert bp.client_id == "client_id"
+    assert bp.authorization_url == "https://example.com/oauth/authorize"
+
+
+def test_unknown_tenant_is_not_found():
+    app, bp = make_app()
+    with app.test_client() as client:
+        resp = client.get("/login/test-service", headers={"X-Tenant": "initech"},
+            base_url="https://a.b.c")
+    assert resp.status_code == 404
+
+
+def test_resolver_called_once_per_request():
+    app, bp = make_app()
+    calls = []
+
+    @bp.tenant_resolver
+    def resolve_tenant():
+        calls.append(flask.request.path)
+        return "acme"
+
+    with app.test_request_context("/"):
+        assert bp.client_id == "acme-id"
+        assert bp.client_secret == "acme-secret"
+        assert bp.token_namespace == "test-service:acme"
+    with app.test_request_context("/other"):
+        assert bp.client_id == "acme-id"
+    assert calls == ["/", "/other"]
+
+
+def client_credentials(request):
+    """
+    The client ID and secret sent with a token request: in the body, or in
+    a Basic ``Authorization`` header, as newer versions of
+    requests-oauthlib send them.
+    """
+    auth = request.headers.get("Authorization")
+    if auth:
+        kind, _, encoded = to_native_string(auth).partition(" ")
+        assert kind == "Basic"
+        client_id, _, secret = base64.b64decode(encoded).decode("utf-8").partition(":")
+        return unquote(client_id), unquote(secret)
+    data = dict(parse_qsl(request.body))
+    return data["client_id"], data["client_secret"]
+
+
+@responses.activate
+def test_authorized_per_tenant():
+    responses.add(
+        responses.POST,
+        "https://acme.example.com/oauth/access_token",
+        body='{"access_token":"acme-token","token_type":"bearer"}',
+    )
+    app, bp = make_app()
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["test-service_oauth_state"] = "random-string"
+        resp = client.get(
+            "/login/test-service/authorized?code=secret-code&state=random-string",
+            headers={"X-Tenant": "acme"},
+            base_url="https://a.b.c",
+        )
+        assert resp.status_code == 302
+        assert client_credentials(responses.calls[0].request) == (
+            "acme-id", "acme-secret",
+        )
+        # each tenant's tokens are stored apart
+        assert flask.session["test-service:acme_oauth_token"] == {
+            "access_token": "acme-token", "token_type": "bearer",
+        }
+        assert "test-service_oauth_token" not in flask.session
+
+
+def test_use_tenant():
+    app, bp = make_app()
+    with app.test_request_context("/"):
+        assert bp.session.client_id == "client_id"
+        with bp.use_tenant("globex") as tenant:
+            assert tenant.id == "globex"
+            assert bp.token_namespace == "test-service:globex"
+            assert bp.session.client_id == "globex-id"
+            with bp.use_tenant(None):
+                assert bp.token_namespace == "test-service"
+        assert bp.session.client_id == "client_id"
+    # outside of a request, too
+    with bp.use_tenant("acme"):
+        assert bp.client_id == "acme-id"
+    assert bp.client_id == "client_id"
+    with pytest.raises(UnknownTenant):
+        with bp.use_tenant("initech"):
+            pass
+
+
+def test_use_tenant_without_tenants():
+    bp = OAuth2ConsumerBlueprint("test-service", __name__)
+    assert bp.current_tenant is None
+    assert bp.token_namespace == "test-service"
+    with pytest.raises(ValueError):
+        with bp.use_tenant("acme"):
+            pass
+
+
+def test_oauth1_signer_per_tenant():
+    bp = OAuth1ConsumerBlueprint("test-service", __name__,
+        client_key="client_key",
+        client_secret="client_secret",
+        tenants=TenantRegistry({
+            "acme": {"client_key": "acme-key", "client_secret": "acme-secret"},
+        }.get),
+    )
+    signer = bp.signer
+    with bp.use_tenant("acme"):
+        acme_signer = bp.signer
+        assert acme_signer.client.client_key == "acme-key"
+        assert bp.signer is acme_signer
+    assert bp.signer is signer
+    with bp.use_tenant("acme"):
+        assert bp.signer is acme_signer
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 import pytest
+import mock
 import responses
 from urlobject import URLObject
 from flask import Flask
@@ -77,3 +78,62 @@ def test_context_local():
         github.get("https://google.com")
         request = responses.calls[1].request
         assert request.headers["Authorization"] == "Bearer app2"
+
+
+@responses.activate
+def test_lazy_session():
+    responses.add(responses.GET, "https://api.github.com/user")
+
+    app = Flask(__name__)
+    backend = MemoryBackend({"access_token": "lazy"})
+    ghbp = make_github_blueprint("foo", "bar", backend=backend)
+    app.register_blueprint(ghbp)
+
+    @app.route("/health")
+    def health():
+        return "ok"
+
+    @app.route("/me")
+    def me():
+        return github.get("user").text
+
+    with mock.patch.object(backend, "get", wraps=backend.get) as get:
+        # a route that never touches the `github` proxy shouldn't build
+        # a session, or load a token from the backend
+        resp = app.test_client().get("/health")
+        assert resp.status_code == 200
+        assert get.call_count == 0
+
+        # the token is only loaded once the proxy is actually used
+        resp = app.test_client().get("/me")
+        assert resp.status_code == 200
+        assert get.call_count == 1
+        request = responses.calls[0].request
+        assert request.headers["Authorization"] == "Bearer lazy"
+
+
+def test_authorized_with_stored_token():
+    app = Flask(__name__)
+    ghbp = make_github_blueprint(
+        "foo", "bar", backend=MemoryBackend({"access_token": "abc"}),
+    )
+    app.register_blueprint(ghbp)
+
+    @app.route("/")
+    def index():
+        # no request has been sent with the session yet
+        return "yes" if github.authorized else "no"
+
+    resp = app.test_client().get("/")
+    assert resp.get_data(as_text=True) == "yes"
+
+
+def test_not_authorized_without_token():
+    app = Flask(__name__)
+    ghbp = make_github_blueprint("foo", "bar", backend=MemoryBackend())
+    app.register_blueprint(ghbp)
+
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        assert not github.authorized
+        assert github.access_token is None
@@ -5,10 +5,11 @@ import mock
 import os
 import tempfile
 import responses
+import oauthlib.oauth1
 from flask import Flask
 from flask_dance.contrib.jira import make_jira_blueprint, jira
 from flask_dance.consumer import OAuth1ConsumerBlueprint
-from oauthlib.oauth1.rfc5849.utils import parse_authorization_header
+from oauthlib.oauth1.rfc5849.utils import parse_authorization_header, unescape
 
 
 def test_blueprint_factory():
@@ -110,3 +111,78 @@ def test_context_local():
         ))
         assert auth_header["oauth_consumer_key"] == "foo2"
         assert auth_header["oauth_signature"] == "sig2"
+
+
+def make_rsa_key():
+    rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    key = rsa.generate_private_key(
+        public_exponent=65537, key_size=1024, backend=default_backend(),
+    )
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode("ascii")
+
+
+@responses.activate
+def test_rsa_key_parsed_once():
+    pytest.importorskip("jwt")
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+    responses.add(responses.GET, "https://flask.atlassian.net/rest/api/2/myself")
+    pem = make_rsa_key()
+    app = Flask(__name__)
+    from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    with mock.patch(
+        "cryptography.hazmat.primitives.serialization.load_pem_private_key",
+        wraps=load_pem_private_key,
+    ) as load, mock.patch(
+        "jwt.algorithms.load_pem_private_key", wraps=load_pem_private_key,
+    ) as jwt_load:
+        jira_bp = make_jira_blueprint("https://flask.atlassian.net", "foo", pem)
+        app.register_blueprint(jira_bp)
+        for _ in range(3):
+            with app.test_request_context("/"):
+                jira_bp.session.get("/rest/api/2/myself")
+    # parsed once by the blueprint, and never by oauthlib
+    assert load.call_count == 1
+    assert jwt_load.call_count == 0
+    key = jira_bp.signing_key
+    assert isinstance(key, RSAPrivateKey)
+    assert jira_bp.session.auth.client.rsa_key is key
+
+    # the signature is the same as one made from the PEM string
+    request = responses.calls[0].request
+    auth_header = dict(
+        (k, unescape(v)) for k, v in parse_authorization_header(
+            request.headers["Authorization"].decode("utf-8")
+        )
+    )
+    assert auth_header["oauth_signature_method"] == "RSA-SHA1"
+    client = oauthlib.oauth1.Client("foo",
+        signature_method=oauthlib.oauth1.SIGNATURE_RSA,
+        rsa_key=pem,
+        nonce=auth_header["oauth_nonce"],
+        timestamp=auth_header["oauth_timestamp"],
+    )
+    _, headers, _ = client.sign(request.url, "GET")
+    expected = dict(
+        (k, unescape(v)) for k, v in parse_authorization_header(
+            headers["Authorization"]
+        )
+    )
+    assert auth_header["oauth_signature"] == expected["oauth_signature"]
+
+    # a new key is parsed when it changes
+    other_pem = make_rsa_key()
+    jira_bp.rsa_key = other_pem
+    assert jira_bp.signing_key is not key
+    assert jira_bp.signing_key.private_numbers() != key.private_numbers()
+
+
+def test_rsa_key_unparseable():
+    jira_bp = make_jira_blueprint("https://flask.atlassian.net", "foo", "not-a-key")
+    # oauthlib gets the string, and complains about it when it signs
+    assert jira_bp.signing_key == "not-a-key"
@@ -1,5 +1,6 @@
 import pytest
-from flask_dance.utils import FakeCache, first, getattrd
+import mock
+from flask_dance.utils import FakeCache, LocalCache, first, getattrd
 
 def test_first():
     assert first([1, 2, 3]) == 1
@@ -25,3 +26,92 @@ def test_getattrd():
     assert getattrd(A, "Q", default=42) == 42
     with pytest.raises(AttributeError):
         assert getattrd(A, "Q")
+
+
+def test_local_cache_lru():
+    cache = LocalCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is now the least recently used, so it gets evicted
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.hits == 3
+    assert cache.misses == 1
+    assert cache.evictions == 1
+    cache.delete("a")
+    assert cache.get("a") is None
+
+
+def test_local_cache_timeout():
+    cache = LocalCache(default_timeout=10)
+    with mock.patch("flask_dance.utils.time.time", return_value=1000):
+        cache.set("a", 1)
+        cache.set("b", 2, timeout=100)
+        cache.set("c", 3, timeout=0)
+    with mock.patch("flask_dance.utils.time.time", return_value=1050):
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert cache.get("c") == 3
+    with mock.patch("flask_dance.utils.time.time", return_value=99999):
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+
+def test_local_cache_backend():
+    backend = mock.Mock()
+    backend.get.return_value = "remote"
+    cache = LocalCache(backend=backend)
+
+    # misses fall through to the backend, and are then served locally
+    assert cache.get("a") == "remote"
+    assert cache.get("a") == "remote"
+    assert backend.get.call_count == 1
+
+    cache.set("b", "local", timeout=5)
+    backend.set.assert_called_once_with("b", "local", timeout=5)
+    cache.delete("b")
+    backend.delete.assert_called_once_with("b")
+    assert cache.get("b") == "remote"
+
+
+def test_local_cache_backend_token_expiry():
+    backend = mock.Mock()
+    cache = LocalCache(default_timeout=60, backend=backend)
+    with mock.patch("flask_dance.utils.time.time", return_value=1000):
+        # tokens from the backend aren't kept past their expiry
+        backend.get.return_value = {"access_token": "a", "expires_at": 1010}
+        assert cache.get("a")["access_token"] == "a"
+        # or at all, if they have already expired
+        backend.get.return_value = {"access_token": "b", "expires_at": 990}
+        assert cache.get("b")["access_token"] == "b"
+    with mock.patch("flask_dance.utils.time.time", return_value=1005):
+        backend.get.return_value = None
+        assert cache.get("a")["access_token"] == "a"
+        assert cache.get("b") is None
+    with mock.patch("flask_dance.utils.time.time", return_value=1020):
+        assert cache.get("a") is None
+
+
+def test_local_cache_delete_many():
+    backend = mock.Mock(spec=["get", "set", "delete"])
+    backend.get.return_value = None
+    cache = LocalCache(backend=backend)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+
+    cache.delete_many("a", "b")
+    assert cache.get("a") is None
+    assert cache.get("c") == 3
+    # a backend without delete_many has the keys deleted one at a time
+    assert backend.delete.call_count == 2
+
+    backend = mock.Mock()
+    cache = LocalCache(backend=backend)
+    cache.delete_many("a", "b")
+    backend.delete_many.assert_called_once_with("a", "b")
+    assert not backend.delete.called